@@ -36,7 +36,7 @@ subgroups ={'cumulative': '1: Cumulative Completeness',
             'colors': '5: Colors'}
 
 
-def setupSlicer(orbitFile, Hrange, obsFile=None):
+def setupSlicer(orbitFile, Hrange, obsFile=None, obsChunkSize=None):
     """
     Set up the slicer and read orbitFile and obsFile from disk.
 
@@ -49,6 +49,9 @@ def setupSlicer(orbitFile, Hrange, obsFile=None):
     obsFile : str, optional
         The file containing the observations of each object, optional.
         If not provided (default, None), then the slicer will not be able to 'slice', but can still plot.
+    obsChunkSize : int, optional
+        If provided, the observations are read in chunks of about this many observations while the
+        metrics are calculated, instead of all at once (see MoObjSlicer.readObs). Default None.
 
     Returns
     -------
@@ -58,7 +61,7 @@ def setupSlicer(orbitFile, Hrange, obsFile=None):
     slicer = slicers.MoObjSlicer()
     slicer.readOrbits(orbitFile, Hrange=Hrange)
     if obsFile is not None:
-        slicer.readObs(obsFile)
+        slicer.readObs(obsFile, chunkSize=obsChunkSize)
     return slicer
 
 
@@ -654,7 +657,20 @@ def setupMetrics(slicer, runName, metadata, mParams, albedo=None, Hmark=None):
     return allBundles
 
 
-def runMetrics(allBundles, outDir, resultsDb=None, Hmark=None):
+def _flattenBundles(allBundles):
+    # Un-nest dictionaries to run all at once.
+    bundleDict = {}
+    for k, v in allBundles.items():
+        if isinstance(v, dict):
+            for k2, v2 in v.items():
+                bundleKey = ' '.join([k, str(k2)])
+                bundleDict[bundleKey] = v2
+        else:
+            bundleDict[k] = v
+    return bundleDict
+
+
+def runMetrics(allBundles, outDir, resultsDb=None, Hmark=None, nWorkers=1, nShards=None):
     """
     Run metrics, write basic output in OutDir.
 
@@ -668,36 +684,57 @@ def runMetrics(allBundles, outDir, resultsDb=None, Hmark=None):
         The results database to use to track metrics and summary statistics.
     Hmark : float, optional
         The Hmark value to add to the completeness bundles plotDicts.
+    nWorkers : int, optional
+        The number of processes to use to calculate the metric values. Default 1.
+    nShards : int, optional
+        If provided, merge the metric values already calculated for nShards shards (see runShard),
+        instead of calculating them. Default None.
 
     Returns
     -------
     dict of metricBundles
         The bundles in this dict now contain the metric values as well.
     """
-    # Un-nest dictionaries to run all at once.
-    bundleDict = {}
-    count = 0
-    for k, v in allBundles.items():
-        if isinstance(v, dict):
-            for k2, v2 in v.items():
-                bundleKey = ' '.join([k, str(k2)])
-                bundleDict[bundleKey] = v2
-                count += 1
-        else:
-            bundleKey = k
-            bundleDict[k] = v
-            count += 1
-    print("Counted %d top-level metric bundles." % count)
+    bundleDict = _flattenBundles(allBundles)
+    print("Counted %d top-level metric bundles." % len(bundleDict))
 
-    print("Calculating and saving metric values.")
-    bg = mmb.MoMetricBundleGroup(bundleDict, outDir=outDir, resultsDb=resultsDb)
+    bg = mmb.MoMetricBundleGroup(bundleDict, outDir=outDir, resultsDb=resultsDb, nWorkers=nWorkers)
     # Just calculate here, we'll create the (mostly custom) plots later.
-    bg.runAll()
+    if nShards is None:
+        print("Calculating and saving metric values.")
+        bg.runAll()
+    else:
+        print("Merging and saving metric values from %d shards." % nShards)
+        bg.mergeShards(nShards)
     print("Generating completeness bundles.")
     allBundles = addAllCompletenessBundles(allBundles, Hmark, outDir, resultsDb)
     return allBundles
 
 
+def runShard(allBundles, outDir, shard, nShards, nWorkers=1):
+    """
+    Calculate the metric values for one shard of the orbits, writing partial metric values in outDir.
+    Once all shards are calculated, runMetrics (with nShards) merges them.
+
+    Parameters
+    ----------
+    allBundles : dict
+        The metric bundles to run.
+    outDir : str
+        The output directory to store results.
+    shard : int
+        The shard to calculate (from 0 to nShards-1).
+    nShards : int
+        The total number of shards.
+    nWorkers : int, optional
+        The number of processes to use to calculate the metric values. Default 1.
+    """
+    bundleDict = _flattenBundles(allBundles)
+    print("Calculating metric values for shard %d of %d." % (shard, nShards))
+    bg = mmb.MoMetricBundleGroup(bundleDict, outDir=outDir, nWorkers=nWorkers)
+    bg.runShard(shard, nShards)
+
+
 def addAllCompletenessBundles(allBundles, Hmark, outDir, resultsDb):
     """
     Generate completeness bundles from all N_Chances child metrics,
@@ -729,7 +766,7 @@ def addAllCompletenessBundles(allBundles, Hmark, outDir, resultsDb):
     if k in allBundles:
         for md in allBundles[k]:
             for submd in allBundles[k][md].childBundles:
-                if submd.startswith('Time') or submd.startswith['N_Chances']:
+                if submd.startswith('Time') or submd.startswith('N_Chances'):
                     b = allBundles[k][md].childBundles[submd]
                     compmd = ' '.join([md, submd.lstrip("Time")]).replace('_', ' ')
                     compmd = ' '.join([md, submd.lstrip("N_Chances")]).replace('_', ' ')
@@ -1485,6 +1522,17 @@ if __name__ == '__main__':
     parser.add_argument("--nYearsMax", type=int, default=10,
                         help="Maximum number of years out to which to evaluate completeness."
                              "Default 10.")
+    parser.add_argument("--obsChunkSize", type=int, default=None,
+                        help="Read the observations in chunks of about this many observations "
+                             "(to limit memory use). Default None reads all observations at once.")
+    parser.add_argument("--nWorkers", type=int, default=1,
+                        help="Number of processes to use to calculate the metric values. Default 1.")
+    parser.add_argument("--shard", type=str, default=None,
+                        help="Only calculate (partial) metric values for shard i of N of the orbits, "
+                             "specified as i/N (with i from 0 to N-1).")
+    parser.add_argument("--mergeShards", type=int, default=None,
+                        help="Merge the partial metric values calculated for this number of shards "
+                             "(with --shard), then calculate summary statistics and plot as usual.")
     parser.add_argument("--plotOnly", action='store_true', default=False,
                         help="Reload metric values from disk and replot them.")
     args = parser.parse_args()
@@ -1513,19 +1561,27 @@ if __name__ == '__main__':
         allBundles = readAll(allBundles, args.orbitFile, args.outDir)
 
     else:
-        if args.obsFile is None:
+        if args.obsFile is None and args.mergeShards is None:
             print('Must specify an obsFile when calculating the metrics.')
             exit()
-        # Set up resultsDb.
         if not (os.path.isdir(args.outDir)):
             os.makedirs(args.outDir)
-        resultsDb = db.ResultsDb(outDir=args.outDir)
-
         Hrange = np.arange(args.hMin, args.hMax + args.hStep, args.hStep)
-        slicer = setupSlicer(args.orbitFile, Hrange, obsFile=args.obsFile)
+        # The observations are not needed to merge shards.
+        obsFile = args.obsFile
+        if args.mergeShards is not None:
+            obsFile = None
+        slicer = setupSlicer(args.orbitFile, Hrange, obsFile=obsFile, obsChunkSize=args.obsChunkSize)
         allBundles = setupMetrics(slicer, runName=args.opsimRun, metadata=args.metadata,
                                   albedo=args.albedo, Hmark=args.hMark, mParams=mParams)
-        allBundles = runMetrics(allBundles, args.outDir, resultsDb, args.hMark)
+        if args.shard is not None:
+            shard, nShards = [int(x) for x in args.shard.split('/')]
+            runShard(allBundles, args.outDir, shard, nShards, nWorkers=args.nWorkers)
+            exit()
+        # Set up resultsDb.
+        resultsDb = db.ResultsDb(outDir=args.outDir)
+        allBundles = runMetrics(allBundles, args.outDir, resultsDb, args.hMark, nWorkers=args.nWorkers,
+                                nShards=args.mergeShards)
 
     plotMetrics(allBundles, args.outDir, args.metadata, args.opsimRun, mParams,
                 Hmark=args.hMark, resultsDb=resultsDb)
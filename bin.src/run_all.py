@@ -49,7 +49,7 @@ def setBatches(opsdb, colmap, args):
 
 if __name__ == '__main__':
     args = parseArgs(subdir='all')
-    opsdb, colmap = connectDb(args.dbfile)
+    opsdb, colmap = connectDb(args.dbfile, columnStore=args.columnStore)
     bdict = setBatches(opsdb, colmap, args)
     if args.plotOnly:
         replot(bdict, opsdb, colmap, args)
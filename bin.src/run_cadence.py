@@ -17,7 +17,7 @@ def setBatches(opsdb, colmap, args):
 
 if __name__ == '__main__':
     args = parseArgs('cadence')
-    opsdb, colmap = connectDb(args.dbfile)
+    opsdb, colmap = connectDb(args.dbfile, columnStore=args.columnStore)
     bdict = setBatches(opsdb, colmap, args)
     if args.plotOnly:
         replot(bdict, opsdb, colmap, args)
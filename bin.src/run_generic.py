@@ -19,16 +19,16 @@ import lsst.sims.maf.utils as mafUtils
 
 
 
-def connectDb(dbfile):
+def connectDb(dbfile, columnStore=False):
     version = db.testOpsimVersion(dbfile)
     if version == "Unknown":
         opsdb = db.Database(dbfile)
         colmap = batches.ColMapDict('barebones')
     elif version == "V3":
-        opsdb = db.OpsimDatabaseV3(dbfile)
+        opsdb = db.OpsimDatabaseV3(dbfile, columnStore=columnStore)
         colmap = batches.ColMapDict('OpsimV3')
     elif version == "V4":
-        opsdb = db.OpsimDatabaseV4(dbfile)
+        opsdb = db.OpsimDatabaseV4(dbfile, columnStore=columnStore)
         colmap = batches.ColMapDict('OpsimV4')
     return opsdb, colmap
 
@@ -79,6 +79,9 @@ def parseArgs(subdir='out', parser=None):
                         help="SQL constraint to apply to all metrics. "
                              " e.g.: 'night <= 365' or 'propId = 5' "
                              " (**may not work with slew batches)")
+    parser.add_argument('--columnStore', dest='columnStore', action='store_true', default=False,
+                        help="Cache the summary table as memory-mapped columns alongside the dbfile, "
+                             "and evaluate sql constraints on this cache where possible.")
     args = parser.parse_args()
 
     if args.runName is None:
@@ -91,7 +94,7 @@ def parseArgs(subdir='out', parser=None):
 
 if __name__ == '__main__':
     args = parseArgs()
-    opsdb, colmap = connectDb(args.dbfile)
+    opsdb, colmap = connectDb(args.dbfile, columnStore=args.columnStore)
     bdict = setBatches(opsdb, colmap, args)
     if args.plotOnly:
         replot(bdict, opsdb, colmap, args)
@@ -21,7 +21,7 @@ if __name__ == '__main__':
     parser.add_argument("--nyears", type=int, default=10, help="Number of years to create Hourglass plots.")
 
     args = parseArgs('hourglass', parser=parser)
-    opsdb, colmap = connectDb(args.dbfile)
+    opsdb, colmap = connectDb(args.dbfile, columnStore=args.columnStore)
     bdict = setBatches(opsdb, colmap, args)
     if args.plotOnly:
         raise ValueError('Cannot replot hourglass metric data, as it is not saved to disk.')
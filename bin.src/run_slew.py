@@ -53,7 +53,7 @@ def replotSlew(opsdb, colmap, args):
 
 if __name__ == '__main__':
     args = parseArgs(subdir='slew')
-    opsdb, colmap = connectDb(args.dbfile)
+    opsdb, colmap = connectDb(args.dbfile, columnStore=args.columnStore)
     if args.plotOnly:
         replotSlew(opsdb, colmap, args)
     else:
@@ -1,4 +1,6 @@
 from .database import *
+from .sqlConstraint import *
+from .columnStore import *
 from .opsimDatabase import *
 from .resultsDb import *
 from .trackingDb import *
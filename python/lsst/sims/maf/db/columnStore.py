@@ -0,0 +1,190 @@
+from __future__ import print_function
+from builtins import object
+import os
+import json
+import numpy as np
+from .sqlConstraint import constraintMask
+
+__all__ = ['ColumnStore']
+
+
+class ColumnStore(object):
+    """Columnar, memory-mapped copy of a single database table, to speed up repeated queries.
+
+    The first time it is used, the store writes each column of the table to its own .npy file
+    (plus a manifest.json) in storeDir; afterwards, columns are memory-mapped from these files.
+    The store is rebuilt if the (sqlite) database file changes.
+    Constraints are evaluated with numpy where possible (see lsst.sims.maf.db.compileConstraint);
+    for any other constraint, fetch returns None so that the caller can fall back to querying
+    the database.
+
+    Parameters
+    ----------
+    database : lsst.sims.maf.db.Database
+        The database holding the table.
+    tableName : str
+        The table to store.
+    storeDir : str, opt
+        Directory for the column files.
+        Default None uses '<database filename, without extension>_<tableName>_columns',
+        alongside the sqlite database file.
+    chunksize : int, opt
+        Number of rows to read from the database at a time while building the store.
+    verbose : bool, opt
+        Flag for additional output. Default False.
+    """
+    def __init__(self, database, tableName, storeDir=None, chunksize=1000000, verbose=False):
+        self.database = database
+        self.tableName = tableName
+        if storeDir is None:
+            storeDir = os.path.splitext(database.database)[0] + '_%s_columns' % (tableName)
+        self.storeDir = storeDir
+        self.chunksize = chunksize
+        self.verbose = verbose
+        self.columns = None
+        self.nrows = None
+        # Map of lowercase column name to column name (SQL column names are case insensitive).
+        self.colNames = dict([(c.lower(), c) for c in database.columnNames[tableName]])
+
+    def _manifestFile(self):
+        return os.path.join(self.storeDir, 'manifest.json')
+
+    def _columnFile(self, col):
+        return os.path.join(self.storeDir, '%s.npy' % (col))
+
+    def _sourceInfo(self):
+        """Identify the state of the source database file, to detect when the store is stale."""
+        stat = os.stat(self.database.database)
+        return {'table': self.tableName, 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def _read(self):
+        """Memory-map the columns from storeDir, if the store exists and is up to date."""
+        try:
+            with open(self._manifestFile(), 'r') as f:
+                manifest = json.load(f)
+        except (IOError, OSError, ValueError):
+            return False
+        if manifest.get('source') != self._sourceInfo():
+            return False
+        try:
+            columns = {}
+            for col in manifest['columns']:
+                columns[col] = np.load(self._columnFile(col), mmap_mode='r')[:manifest['nrows']]
+        except (IOError, OSError, ValueError):
+            return False
+        self.columns = columns
+        self.nrows = manifest['nrows']
+        return True
+
+    def _write(self):
+        """Write each column of the table into its own .npy file, then the manifest.
+
+        Each file is written to a temporary file and renamed into place, so that other processes
+        never see a partially written file (and processes which have memory-mapped the previous files
+        keep reading them).
+        """
+        if not os.path.isdir(self.storeDir):
+            os.makedirs(self.storeDir)
+        # Remove the stale manifest first, so the store is not read until it has been rebuilt.
+        if os.path.isfile(self._manifestFile()):
+            os.remove(self._manifestFile())
+        colnames = self.database.columnNames[self.tableName]
+        nrows = int(self.database.execute_arbitrary('select count(*) from %s' % (self.tableName),
+                                                    dtype=[('nrows', int)])['nrows'][0])
+        dtype = np.dtype(self.database._query_dtype(self.tableName, colnames))
+        tmpfiles = dict([(col, self._columnFile(col) + '.%d.tmp' % os.getpid()) for col in colnames])
+        try:
+            outs = {}
+            for col in colnames:
+                outs[col] = np.lib.format.open_memmap(tmpfiles[col], mode='w+',
+                                                      dtype=dtype[col], shape=(nrows,))
+            start = 0
+            for chunk in self.database.query_columns_chunks(self.tableName, colnames=colnames,
+                                                            chunksize=self.chunksize):
+                stop = min(start + len(chunk), nrows)
+                for col in colnames:
+                    outs[col][start:stop] = chunk[col][:stop - start]
+                start = stop
+            for col in colnames:
+                outs[col].flush()
+            del outs
+            for col in colnames:
+                os.rename(tmpfiles[col], self._columnFile(col))
+        finally:
+            for tmpfile in tmpfiles.values():
+                if os.path.isfile(tmpfile):
+                    os.remove(tmpfile)
+        # Writing the manifest last means an interrupted build is simply rebuilt next time.
+        manifest = {'source': self._sourceInfo(), 'nrows': int(start), 'columns': colnames}
+        tmpfile = self._manifestFile() + '.%d.tmp' % os.getpid()
+        with open(tmpfile, 'w') as f:
+            json.dump(manifest, f)
+        os.rename(tmpfile, self._manifestFile())
+
+    def load(self):
+        """Memory-map the column store, building it first if necessary."""
+        if self.columns is not None:
+            return
+        if not self._read():
+            if self.verbose:
+                print('Building column store for %s in %s' % (self.tableName, self.storeDir))
+            self._write()
+            if not self._read():
+                raise IOError('Could not read column store in %s' % (self.storeDir))
+
+    def constraintMask(self, sqlconstraint):
+        """Evaluate a sql constraint as a numpy mask over the rows of the table.
+
+        Parameters
+        ----------
+        sqlconstraint : str or None
+            The sql constraint (minus "WHERE").
+
+        Returns
+        -------
+        numpy.ndarray or None
+            Boolean mask of the rows matching the constraint, or None if the constraint cannot be
+            evaluated with numpy (see lsst.sims.maf.db.compileConstraint).
+        """
+        self.load()
+        return constraintMask(self.columns, sqlconstraint)
+
+    def fetch(self, colnames, sqlconstraint=None, groupBy=None):
+        """Fetch colnames from the column store, for rows matching sqlconstraint.
+
+        Parameters
+        ----------
+        colnames : list of str
+            The columns to fetch.
+        sqlconstraint : str or None, opt
+            The sql constraint to apply to the data (minus "WHERE"). Default None.
+        groupBy : str or None, opt
+            Column to group the returned data by (as for sql, only one row is returned for each value).
+
+        Returns
+        -------
+        numpy.recarray or None
+            The data, or None if the query cannot be served from the column store.
+        """
+        self.load()
+        cols = [self.colNames.get(col.lower()) for col in colnames]
+        if None in cols:
+            return None
+        if groupBy is not None:
+            groupBy = self.colNames.get(groupBy.lower())
+            if groupBy is None:
+                return None
+        mask = self.constraintMask(sqlconstraint)
+        if mask is None:
+            return None
+        rows = np.where(mask)[0]
+        if groupBy is not None:
+            # Order by the groupBy column, keeping the first row of each group.
+            rows = rows[np.argsort(self.columns[groupBy][rows], kind='mergesort')]
+            uniq, first = np.unique(self.columns[groupBy][rows], return_index=True)
+            rows = rows[first]
+        dtype = [(col, self.columns[c].dtype) for col, c in zip(colnames, cols)]
+        data = np.recarray((len(rows),), dtype=dtype)
+        for col, c in zip(colnames, cols):
+            data[col] = self.columns[c][rows]
+        return data
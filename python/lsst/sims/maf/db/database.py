@@ -181,6 +181,9 @@ class Database(with_metaclass(DatabaseRegistry, DBObject)):
                             groupBy=None, numLimit=None, chunksize=1000000):
         """Query a table in the database and return data from colnames in recarray.
 
+        The number of rows matching the query is counted first, so that the recarray can be allocated
+        once and filled column by column as the results are fetched (in chunks of chunksize).
+
         Parameters
         ----------
         tablename : str
@@ -194,7 +197,8 @@ class Database(with_metaclass(DatabaseRegistry, DBObject)):
         numLimit : int or None, opt
             Number of records to return. Default no limit.
         chunksize : int, opt
-            Query database and convert to recarray in series of chunks of chunksize.
+            Fetch results from the database in a series of chunks of chunksize rows.
+            If None or 0, all results are fetched at once.
 
         Returns
         -------
@@ -207,31 +211,94 @@ class Database(with_metaclass(DatabaseRegistry, DBObject)):
         # Build the query.
         query = self._build_query(tablename, colnames=colnames, sqlconstraint=sqlconstraint,
                                   groupBy=groupBy, numLimit=numLimit)
+        dtype = self._query_dtype(tablename, colnames)
 
-        # Determine dtype for numpy recarray.
-        dtype = []
-        for col in colnames:
-            dt = self.dbTypeMap[self.tables[tablename].c[col].type.__visit_name__]
-            dtype.append((col,) + dt)
+        # Preallocate the recarray using the number of matching rows.
+        nrows = query.count()
+        data = np.recarray((nrows,), dtype=dtype)
 
         # Execute query on database.
         exec_query = self.connection.session.execute(query)
 
-        if chunksize is None or chunksize==0:
-            # Fetch all results and convert to numpy recarray.
+        if chunksize is None or chunksize == 0:
             results = exec_query.fetchall()
-            data = self._convert_results(results, dtype)
+            data = self._fill_results(data, 0, results)
+            nfilled = len(results)
         else:
-            chunks = []
-            # Loop through results, converting in steps of chunksize.
+            nfilled = 0
             results = exec_query.fetchmany(chunksize)
             while len(results) > 0:
-                chunks.append(self._convert_results(results, dtype))
+                data = self._fill_results(data, nfilled, results)
+                nfilled += len(results)
                 results = exec_query.fetchmany(chunksize)
-            if len(chunks) == 0:
-                data = np.recarray((0,), dtype=dtype)
-            else:
-                data = np.hstack(chunks)
+        # Trim, in case the table changed between counting and fetching.
+        if nfilled < len(data):
+            data = data[:nfilled]
+        return data
+
+    def query_columns_chunks(self, tablename, colnames=None, sqlconstraint=None,
+                             groupBy=None, numLimit=None, chunksize=1000000):
+        """Query a table in the database, yielding the data from colnames in recarrays of chunksize rows.
+
+        This is a generator version of query_columns, for processing tables which are too large to
+        hold in memory at once.
+
+        Parameters
+        ----------
+        tablename : str
+            Name of table to query.
+        colnames : list of str or None, opt
+            Columns from the table to query for. If None, all columns are selected.
+        sqlconstraint : str or None, opt
+            Constraint to apply to to the query.  Default None.
+        groupBy : str or None, opt
+            Name of column to group by. Default None.
+        numLimit : int or None, opt
+            Number of records to return. Default no limit.
+        chunksize : int, opt
+            The (maximum) number of rows in each recarray.
+
+        Yields
+        ------
+        numpy.recarray
+        """
+        if chunksize is None or chunksize <= 0:
+            raise ValueError('chunksize must be a positive integer (got %s).' % (chunksize))
+        query = self._build_query(tablename, colnames=colnames, sqlconstraint=sqlconstraint,
+                                  groupBy=groupBy, numLimit=numLimit)
+        dtype = self._query_dtype(tablename, colnames)
+        exec_query = self.connection.session.execute(query)
+        results = exec_query.fetchmany(chunksize)
+        while len(results) > 0:
+            data = np.recarray((len(results),), dtype=dtype)
+            yield self._fill_results(data, 0, results)
+            results = exec_query.fetchmany(chunksize)
+
+    def _query_dtype(self, tablename, colnames=None):
+        """Determine the numpy recarray dtype for colnames in tablename."""
+        if colnames is None:
+            colnames = self.columnNames[tablename]
+        dtype = []
+        for col in colnames:
+            dt = self.dbTypeMap[self.tables[tablename].c[col].type.__visit_name__]
+            dtype.append((col,) + dt)
+        return dtype
+
+    def _fill_results(self, data, start, results):
+        """Fill data[start:start + len(results)] with results (a list of rows), column by column.
+
+        The recarray is grown (by doubling) if it is too small to hold the results.
+        """
+        if len(results) == 0:
+            return data
+        stop = start + len(results)
+        if stop > len(data):
+            grown = np.recarray((max(stop, 2 * len(data)),), dtype=data.dtype)
+            grown[:start] = data[:start]
+            data = grown
+        # Transpose the rows into columns, to assign each column of the chunk at once.
+        for name, column in zip(data.dtype.names, zip(*results)):
+            data[name][start:stop] = column
         return data
 
     def _build_query(self, tablename, colnames, sqlconstraint=None, groupBy=None, numLimit=None):
@@ -262,11 +329,3 @@ class Database(with_metaclass(DatabaseRegistry, DBObject)):
         if numLimit is not None:
             query = query.limit(numLimit)
         return query
-
-    def _convert_results(self, results, dtype):
-        if len(results) == 0:
-            data = np.recarray((0,), dtype=dtype)
-        else:
-            # Have to do the tuple(xx) for py2 string objects. With py3 is okay to just pass results.
-            data = np.rec.fromrecords([tuple(xx) for xx in results], dtype=dtype)
-        return data
\ No newline at end of file
@@ -5,6 +5,7 @@ import os, re
 import numpy as np
 import warnings
 from .database import Database
+from .columnStore import ColumnStore
 from lsst.sims.utils import Site
 from lsst.sims.maf.utils import getDateVersion
 
@@ -22,7 +23,7 @@ def testOpsimVersion(database, driver='sqlite', host=None, port=None):
     return version
 
 def OpsimDatabase(database, driver='sqlite', host=None, port=None,
-                  longstrings=False, verbose=False):
+                  longstrings=False, verbose=False, columnStore=False, columnStoreDir=None):
     """Convenience method to return an appropriate OpsimDatabaseV3/V4 version.
 
     This is here for backwards compatibility, as 'opsdb = db.OpsimDatabase(dbFile)' will
@@ -32,10 +33,12 @@ def OpsimDatabase(database, driver='sqlite', host=None, port=None,
     version = testOpsimVersion(database)
     if version == 'V4':
         opsdb = OpsimDatabaseV4(database, driver=driver, host=host, port=port,
-                                longstrings=longstrings, verbose=verbose)
+                                longstrings=longstrings, verbose=verbose,
+                                columnStore=columnStore, columnStoreDir=columnStoreDir)
     elif version == 'V3':
         opsdb =  OpsimDatabaseV3(database, driver=driver, host=host, port=port,
-                                 longstrings=longstrings, verbose=verbose)
+                                 longstrings=longstrings, verbose=verbose,
+                                 columnStore=columnStore, columnStoreDir=columnStoreDir)
     else:
         warnings.warn('Could not identify opsim database version; just using Database class instead')
         opsdb = Database(database, driver=driver, host=host, port=port,
@@ -46,9 +49,14 @@ def OpsimDatabase(database, driver='sqlite', host=None, port=None,
 class BaseOpsimDatabase(Database):
     """Base opsim database class to gather common methods among different versions of the opsim schema.
 
-    Not intended to be used directly; use OpsimDatabaseV3 or OpsimDatabaseV4 instead."""
+    Not intended to be used directly; use OpsimDatabaseV3 or OpsimDatabaseV4 instead.
+
+    If columnStore is True, a memory-mapped columnar copy of the default (summary) table is built
+    alongside the sqlite file the first time metric data is fetched (in columnStoreDir, if set), and
+    fetchMetricData serves queries from this copy instead of the database, whenever the constraint
+    can be evaluated with numpy."""
     def __init__(self, database, driver='sqlite', host=None, port=None, defaultTable=None,
-                 longstrings=False, verbose=False):
+                 longstrings=False, verbose=False, columnStore=False, columnStoreDir=None):
         super(BaseOpsimDatabase, self).__init__(database=database, driver=driver, host=host, port=port,
                                                 defaultTable=defaultTable, longstrings=longstrings,
                                                 verbose=verbose)
@@ -56,6 +64,13 @@ class BaseOpsimDatabase(Database):
         self.filterlist = np.array(['u', 'g', 'r', 'i', 'z', 'y'])
         self.defaultTable = defaultTable
         self._colNames()
+        self.columnStore = None
+        if columnStore:
+            if driver != 'sqlite':
+                warnings.warn('The column store is only available for sqlite databases; not using it.')
+            else:
+                self.columnStore = ColumnStore(self, self.defaultTable, storeDir=columnStoreDir,
+                                               verbose=verbose)
 
     def _colNames(self):
         # Add version-specific column names in subclasses.
@@ -90,6 +105,10 @@ class BaseOpsimDatabase(Database):
             groupBy = self.mjdCol
         if groupBy is 'default' and tableName!=self.defaultTable:
             groupBy = None
+        if self.columnStore is not None and tableName == self.defaultTable:
+            metricdata = self.columnStore.fetch(colnames, sqlconstraint=sqlconstraint, groupBy=groupBy)
+            if metricdata is not None:
+                return metricdata
         metricdata = super(BaseOpsimDatabase, self).fetchMetricData(colnames=colnames,
                                                                 sqlconstraint=sqlconstraint,
                                                                 groupBy=groupBy, tableName=tableName)
@@ -256,12 +275,18 @@ class OpsimDatabaseV4(BaseOpsimDatabase):
     dbTables : dict, opt
         Dictionary of the names of the tables in the database.
         The dict should be key = table name, value = [table name, primary key].
+    columnStore : bool, opt
+        Serve metric data queries from a memory-mapped columnar copy of the summary table,
+        built on first use (see lsst.sims.maf.db.ColumnStore). Default False.
+    columnStoreDir : str, opt
+        Directory for the column store. Default None (alongside the sqlite file).
     """
     def __init__(self, database, driver='sqlite', host=None, port=None, defaultTable='SummaryAllProps',
-                 longstrings=False, verbose=False):
+                 longstrings=False, verbose=False, columnStore=False, columnStoreDir=None):
         super(OpsimDatabaseV4, self).__init__(database=database, driver=driver, host=host, port=port,
                                               defaultTable=defaultTable, longstrings=longstrings,
-                                              verbose=verbose)
+                                              verbose=verbose, columnStore=columnStore,
+                                              columnStoreDir=columnStoreDir)
 
     def _colNames(self):
         """
@@ -690,7 +715,7 @@ class OpsimDatabaseV4(BaseOpsimDatabase):
 
 class OpsimDatabaseV3(BaseOpsimDatabase):
     def __init__(self, database, driver='sqlite', host=None, port=None, defaultTable='Summary',
-                 longstrings=False, verbose=False):
+                 longstrings=False, verbose=False, columnStore=False, columnStoreDir=None):
         """
         Instantiate object to handle queries of the opsim database.
         (In general these will be the sqlite database files produced by opsim, but could
@@ -700,11 +725,14 @@ class OpsimDatabaseV3(BaseOpsimDatabase):
         driver =  Name of database dialect+driver for sqlalchemy (e.g. 'sqlite', 'pymssql+mssql')
         host = Name of database host (optional)
         port = String port number (optional)
+        columnStore = Serve metric data queries from a columnar copy of the summary table (optional)
+        columnStoreDir = Directory for the column store (optional; default alongside the sqlite file)
 
         """
         super(OpsimDatabaseV3, self).__init__(database=database, driver=driver, host=host, port=port,
                                               defaultTable=defaultTable, longstrings=longstrings,
-                                              verbose=verbose)
+                                              verbose=verbose, columnStore=columnStore,
+                                              columnStoreDir=columnStoreDir)
 
     def _colNames(self):
         """
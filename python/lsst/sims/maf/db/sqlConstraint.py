@@ -0,0 +1,393 @@
+from builtins import object
+import re
+import operator
+from collections import OrderedDict
+import numpy as np
+
+__all__ = ['compileConstraint', 'constraintColumns', 'constraintMask']
+
+# Tokens of the subset of sql (WHERE clause) syntax which can be evaluated with numpy.
+_tokenRegex = re.compile(r"""\s*(?:
+    (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?) |
+    (?P<string>'(?:[^']|'')*') |
+    (?P<dquote>"(?:[^"]|"")*") |
+    (?P<op><>|!=|==|<=|>=|[=<>(),+\-*/%]) |
+    (?P<word>[A-Za-z_]\w*)
+    )""", re.VERBOSE)
+
+# (The operator functions, unlike the numpy ufuncs, also compare string arrays in older versions of numpy.)
+_comparisons = {'=': operator.eq, '==': operator.eq, '!=': operator.ne, '<>': operator.ne,
+                '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+_keywords = set(['and', 'or', 'not', 'in', 'between', 'is', 'null', 'like', 'glob', 'escape',
+                 'exists', 'case', 'when', 'then', 'else', 'end', 'select', 'collate', 'cast'])
+
+
+def _tokenize(sqlconstraint):
+    tokens = []
+    pos = 0
+    sqlconstraint = sqlconstraint.rstrip()
+    while pos < len(sqlconstraint):
+        match = _tokenRegex.match(sqlconstraint, pos)
+        if match is None:
+            raise ValueError('Cannot parse "%s" in constraint %s' % (sqlconstraint[pos:], sqlconstraint))
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'word' and value.lower() in _keywords:
+            kind = 'keyword'
+            value = value.lower()
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+
+class _Parser(object):
+    """Recursive descent parser for sql constraints, producing a tree of tuples.
+
+    Precedence (lowest to highest): OR, AND, NOT, comparisons (including IN and BETWEEN),
+    addition/subtraction, multiplication/division/modulo, unary minus.
+    """
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def accept(self, kind, value=None):
+        token = self.peek()
+        if token[0] == kind and (value is None or token[1] == value):
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, kind, value=None):
+        if not self.accept(kind, value):
+            raise ValueError('Expected %s but found %s' % (value or kind, self.peek()[1]))
+
+    def parse(self):
+        node = self.orExpr()
+        if self.pos != len(self.tokens):
+            raise ValueError('Unexpected %s' % (self.peek()[1]))
+        return node
+
+    def orExpr(self):
+        node = self.andExpr()
+        while self.accept('keyword', 'or'):
+            node = ('or', node, self.andExpr())
+        return node
+
+    def andExpr(self):
+        node = self.notExpr()
+        while self.accept('keyword', 'and'):
+            node = ('and', node, self.notExpr())
+        return node
+
+    def notExpr(self):
+        if self.accept('keyword', 'not'):
+            return ('not', self.notExpr())
+        return self.comparison()
+
+    def comparison(self):
+        node = self.sum()
+        while True:
+            kind, value = self.peek()
+            if kind == 'op' and value in _comparisons:
+                self.next()
+                node = ('compare', value, node, self.sum())
+                continue
+            negate = False
+            if kind == 'keyword' and value == 'not':
+                # 'x NOT IN (...)' or 'x NOT BETWEEN a AND b'.
+                self.next()
+                negate = True
+                kind, value = self.peek()
+            if kind == 'keyword' and value == 'in':
+                self.next()
+                self.expect('op', '(')
+                items = [self.sum()]
+                while self.accept('op', ','):
+                    items.append(self.sum())
+                self.expect('op', ')')
+                node = ('in', node, items)
+            elif kind == 'keyword' and value == 'between':
+                self.next()
+                low = self.sum()
+                self.expect('keyword', 'and')
+                high = self.sum()
+                node = ('between', node, low, high)
+            elif negate:
+                raise ValueError('Unsupported use of NOT')
+            else:
+                return node
+            if negate:
+                node = ('not', node)
+
+    def sum(self):
+        node = self.product()
+        while True:
+            kind, value = self.peek()
+            if kind == 'op' and value in ('+', '-'):
+                self.next()
+                node = ('arith', value, node, self.product())
+            else:
+                return node
+
+    def product(self):
+        node = self.unary()
+        while True:
+            kind, value = self.peek()
+            if kind == 'op' and value in ('*', '/', '%'):
+                self.next()
+                node = ('arith', value, node, self.unary())
+            else:
+                return node
+
+    def unary(self):
+        if self.accept('op', '-'):
+            return ('neg', self.unary())
+        if self.accept('op', '+'):
+            return self.unary()
+        return self.primary()
+
+    def primary(self):
+        kind, value = self.next()
+        if kind == 'number':
+            if re.match(r'^\d+$', value):
+                return ('literal', int(value))
+            return ('literal', float(value))
+        if kind == 'string':
+            return ('literal', value[1:-1].replace("''", "'"))
+        if kind == 'dquote':
+            # sqlite treats a double quoted string as a column name if there is such a column.
+            return ('dquote', value[1:-1].replace('""', '"'))
+        if kind == 'word':
+            return ('column', value)
+        if kind == 'op' and value == '(':
+            node = self.orExpr()
+            self.expect('op', ')')
+            return node
+        raise ValueError('Unsupported or unexpected %s' % (value))
+
+
+def _isString(value):
+    return isinstance(value, str) or (isinstance(value, np.ndarray) and value.dtype.kind in 'US')
+
+
+def _isNumber(value):
+    if isinstance(value, np.ndarray):
+        return value.dtype.kind in 'biuf'
+    return isinstance(value, (bool, int, float, np.number, np.bool_))
+
+
+def _checkComparable(a, b):
+    # sqlite compares numbers and strings by type class rather than value, which numpy does not emulate.
+    if not ((_isString(a) and _isString(b)) or (_isNumber(a) and _isNumber(b))):
+        raise ValueError('Cannot compare values of different types')
+
+
+def _isInteger(value):
+    if isinstance(value, np.ndarray):
+        return value.dtype.kind in 'biu'
+    return isinstance(value, (int, np.integer))
+
+
+def _evaluate(node, columns):
+    kind = node[0]
+    if kind == 'literal':
+        return node[1]
+    if kind == 'column':
+        return columns[node[1].lower()]
+    if kind == 'dquote':
+        return columns.get(node[1].lower(), node[1])
+    if kind in ('and', 'or'):
+        a = _asBool(_evaluate(node[1], columns))
+        b = _asBool(_evaluate(node[2], columns))
+        return np.logical_and(a, b) if kind == 'and' else np.logical_or(a, b)
+    if kind == 'not':
+        return np.logical_not(_asBool(_evaluate(node[1], columns)))
+    if kind == 'compare':
+        a = _evaluate(node[2], columns)
+        b = _evaluate(node[3], columns)
+        _checkComparable(a, b)
+        return _comparisons[node[1]](a, b)
+    if kind == 'in':
+        a = _evaluate(node[1], columns)
+        result = np.zeros(np.shape(a), dtype=bool)
+        for item in node[2]:
+            b = _evaluate(item, columns)
+            _checkComparable(a, b)
+            result = result | (a == b)
+        return result
+    if kind == 'between':
+        a = _evaluate(node[1], columns)
+        low = _evaluate(node[2], columns)
+        high = _evaluate(node[3], columns)
+        _checkComparable(a, low)
+        _checkComparable(a, high)
+        return (a >= low) & (a <= high)
+    if kind == 'neg':
+        a = _evaluate(node[1], columns)
+        if not _isNumber(a):
+            raise ValueError('Cannot negate a string')
+        return -a
+    if kind == 'arith':
+        a = _evaluate(node[2], columns)
+        b = _evaluate(node[3], columns)
+        if not (_isNumber(a) and _isNumber(b)):
+            raise ValueError('Arithmetic is only supported for numbers')
+        op = node[1]
+        if op == '+':
+            return a + b
+        if op == '-':
+            return a - b
+        if op == '*':
+            return a * b
+        if op == '%' and not (_isInteger(a) and _isInteger(b)):
+            # sqlite casts the operands of modulo to integers (so 5.5 % 2 is 1 and x % 0.5 is NULL).
+            raise ValueError('Modulo is only supported for integers')
+        if np.any(np.asarray(b) == 0):
+            # sqlite returns NULL when dividing by zero.
+            raise ValueError('Division by zero')
+        if _isInteger(a) and _isInteger(b):
+            # sqlite integer division and modulo truncate towards zero.
+            if op == '/':
+                return np.trunc(np.true_divide(a, b)).astype(int)
+            return np.fmod(a, b)
+        return np.true_divide(a, b)
+    raise ValueError('Unknown expression %s' % (kind,))
+
+
+def _asBool(value):
+    if _isString(value):
+        raise ValueError('Cannot use a string as a condition')
+    if isinstance(value, np.ndarray):
+        return value if value.dtype == bool else (value != 0)
+    return bool(value)
+
+
+def compileConstraint(sqlconstraint):
+    """Compile a sql constraint (a WHERE clause) into a function which evaluates it with numpy.
+
+    Supports comparisons (=, ==, !=, <>, <, <=, >, >=), [NOT] IN, [NOT] BETWEEN, AND, OR, NOT,
+    parentheses and arithmetic (+, -, *, /, %) between columns and numeric or string literals.
+    Other sql syntax (such as LIKE, IS NULL or functions) raises a ValueError.
+
+    Parameters
+    ----------
+    sqlconstraint : str
+        The sql constraint (minus "WHERE").
+
+    Returns
+    -------
+    function
+        A function with arguments (columns, nrows), where columns is a dict of the column arrays
+        keyed by lowercase column name, returning a boolean numpy array of length nrows.
+        This function raises a ValueError if the constraint combines values in ways which numpy
+        does not evaluate like sql (e.g. comparing strings to numbers), or a KeyError if a column
+        is missing.
+    """
+    tree = _Parser(_tokenize(sqlconstraint)).parse()
+
+    def evaluate(columns, nrows):
+        result = _asBool(_evaluate(tree, columns))
+        return np.array(np.broadcast_to(result, (nrows,)), dtype=bool)
+    return evaluate
+
+
+def _treeColumns(node, columns):
+    if not isinstance(node, tuple):
+        return
+    if node[0] in ('column', 'dquote'):
+        columns.append(node[1])
+        return
+    for child in node[1:]:
+        if isinstance(child, list):
+            for item in child:
+                _treeColumns(item, columns)
+        else:
+            _treeColumns(child, columns)
+
+
+def constraintColumns(sqlconstraint):
+    """Find the names of the columns used in a sql constraint (a WHERE clause).
+
+    Double quoted strings are included, as sqlite treats these as column names if there is such a column.
+
+    Parameters
+    ----------
+    sqlconstraint : str or None
+        The sql constraint (minus "WHERE").
+
+    Returns
+    -------
+    list of str
+        The (possible) column names, in order of appearance and without duplicates.
+        Empty if the constraint cannot be evaluated with numpy (see compileConstraint).
+    """
+    if sqlconstraint is None or len(sqlconstraint.strip()) == 0:
+        return []
+    try:
+        tree = _Parser(_tokenize(sqlconstraint)).parse()
+    except ValueError:
+        return []
+    columns = []
+    _treeColumns(tree, columns)
+    names = []
+    for col in columns:
+        if col not in names:
+            names.append(col)
+    return names
+
+
+# Recently compiled constraints (or None, for those which cannot be compiled), keyed by constraint.
+_compiled = OrderedDict()
+_compiledSize = 500
+
+
+def constraintMask(data, sqlconstraint):
+    """Evaluate a sql constraint (a WHERE clause) on a numpy structured array, as a boolean mask.
+
+    Parameters
+    ----------
+    data : numpy.ndarray or dict
+        A numpy structured array, or a dictionary of (equal length) arrays keyed by column name.
+    sqlconstraint : str or None
+        The sql constraint (minus "WHERE"). See compileConstraint for the supported syntax.
+
+    Returns
+    -------
+    numpy.ndarray or None
+        Boolean mask of the rows of data matching the constraint,
+        or None if the constraint cannot be evaluated with numpy (and so should be applied with sql).
+    """
+    if isinstance(data, dict):
+        columns = dict([(col.lower(), data[col]) for col in data])
+        nrows = len(next(iter(data.values()))) if len(data) > 0 else 0
+    else:
+        columns = dict([(col.lower(), data[col]) for col in data.dtype.names])
+        nrows = len(data)
+    if sqlconstraint is None or len(sqlconstraint.strip()) == 0:
+        return np.ones(nrows, dtype=bool)
+    if sqlconstraint not in _compiled:
+        try:
+            _compiled[sqlconstraint] = compileConstraint(sqlconstraint)
+        except ValueError:
+            _compiled[sqlconstraint] = None
+        while len(_compiled) > _compiledSize:
+            _compiled.popitem(last=False)
+    evaluate = _compiled[sqlconstraint]
+    if evaluate is None:
+        return None
+    try:
+        with np.errstate(invalid='ignore'):
+            return evaluate(columns, nrows)
+    except (ValueError, KeyError, TypeError):
+        return None
@@ -1,3 +1,4 @@
 from .metricBundle import *
+from .sliceMemo import *
 from .metricBundleGroup import *
 from .moMetricBundle import *
@@ -1,20 +1,28 @@
 from __future__ import print_function
 from builtins import object
 import os
+import multiprocessing
 import numpy as np
 import numpy.ma as ma
 import matplotlib.pyplot as plt
-from collections import OrderedDict
 
 import lsst.sims.maf.db as db
 import lsst.sims.maf.utils as utils
 from lsst.sims.maf.plots import PlotHandler
+from lsst.sims.maf.stackers import StackerScheduler
 import lsst.sims.maf.maps as maps
+from lsst.sims.maf.slicers import BaseSpatialSlicer
 from .metricBundle import MetricBundle, createEmptyMetricBundle
+from .sliceMemo import SliceMemo
 import warnings
 
 __all__ = ['makeBundlesDictFromList', 'MetricBundleGroup']
 
+# State shared with the worker processes used by MetricBundleGroup when nWorkers > 1.
+# This is set immediately before the worker pool is forked, so the workers inherit simData
+# (and the set up slicer) from the parent process instead of receiving a pickled copy.
+_workerState = {}
+
 
 def makeBundlesDictFromList(bundleList):
     """Utility to convert a list of MetricBundles into a dictionary, keyed by the fileRoot names.
@@ -34,6 +42,108 @@ def makeBundlesDictFromList(bundleList):
     return bDict
 
 
+def _calcMetricValues(simData, slicer, metricList, metricValues, metricMasks, start, stop, memo=None):
+    """Calculate metric values at the slicePoints start:stop of a (set up) slicer.
+
+    Parameters
+    ----------
+    simData : numpy.ndarray
+        The simulated data, including any stacker columns.
+    slicer : BaseSlicer
+        The slicer, after setupSlicer has been run.
+    metricList : List[BaseMetric]
+        The metrics to calculate.
+    metricValues : List[numpy.ndarray]
+        Arrays in which to store the metric values (one per metric, indexed by slicePoint - start).
+    metricMasks : List[numpy.ndarray]
+        Arrays in which to flag slicePoints with no data (one per metric, indexed by slicePoint - start).
+    start : int
+        The first slicePoint to calculate.
+    stop : int
+        One past the last slicePoint to calculate.
+    memo : Optional[SliceMemo]
+        Memo of previous slicePoints, so that metric values can be reused when the same data
+        indexes are returned for a later slicePoint. Default None (no caching).
+    """
+    for i in range(start, stop):
+        slice_i = slicer[i]
+        j = i - start
+        slicedata = simData[slice_i['idxs']]
+        if len(slicedata) == 0:
+            # No data at this slicepoint. Mask data values.
+            for mask in metricMasks:
+                mask[j] = True
+        else:
+            # There is data! Should we use our data cache?
+            if memo is not None:
+                # The memo stores the position of the slicePoint where these data were first seen.
+                key, sortedIdxs, jprev = memo.lookup(slice_i['idxs'])
+                if jprev is not None:
+                    for values in metricValues:
+                        values[j] = values[jprev]
+                else:
+                    for metric, values in zip(metricList, metricValues):
+                        values[j] = metric.run(slicedata, slicePoint=slice_i['slicePoint'])
+                    memo.store(key, sortedIdxs, j)
+
+            # Not using memoize, just calculate things normally
+            else:
+                for metric, values in zip(metricList, metricValues):
+                    values[j] = metric.run(slicedata, slicePoint=slice_i['slicePoint'])
+
+
+def _calcMetricValuesBatch(simData, slicer, metricList, metricValues, metricMasks):
+    """Calculate metric values at all slicePoints of a (set up) slicer, using metric.runBatch.
+
+    Parameters
+    ----------
+    simData : numpy.ndarray
+        The simulated data, including any stacker columns.
+    slicer : BaseSlicer
+        The slicer, after setupSlicer has been run.
+    metricList : List[BaseMetric]
+        The metrics to calculate. All must support runBatch.
+    metricValues : List[numpy.ndarray]
+        Arrays in which to store the metric values (one per metric).
+    metricMasks : List[numpy.ndarray]
+        Arrays in which to flag slicePoints with no data (one per metric).
+    """
+    indexPtr, indices = slicer.getSliceIndex()
+    empty = np.where(np.diff(indexPtr) == 0)[0]
+    for metric, values, mask in zip(metricList, metricValues, metricMasks):
+        values[:] = metric.runBatch(simData, indexPtr, indices, slicePoints=slicer.slicePoints)
+        mask[empty] = True
+
+
+def _runSlicePointChunk(chunk):
+    """Calculate metric values for a chunk of slicePoints, in a worker process.
+
+    Parameters
+    ----------
+    chunk : tuple of int
+        The (start, stop) range of slicePoints to calculate.
+
+    Returns
+    -------
+    tuple
+        (start, stop, list of metric value arrays, list of mask arrays, memo statistics) for the chunk.
+    """
+    start, stop = chunk
+    metricList = _workerState['metricList']
+    metricValues = [np.empty((stop - start,) + v.shape[1:], v.dtype) for v in _workerState['values']]
+    metricMasks = [np.zeros((stop - start,) + m.shape[1:], 'bool') for m in _workerState['masks']]
+    memo = None
+    if _workerState['memoLimits'] is not None:
+        memo = SliceMemo(*_workerState['memoLimits'])
+    _calcMetricValues(_workerState['simData'], _workerState['slicer'], metricList,
+                      metricValues, metricMasks, start, stop, memo=memo)
+    if memo is None:
+        stats = None
+    else:
+        stats = memo.stats()
+    return start, stop, metricValues, metricMasks, stats
+
+
 class MetricBundleGroup(object):
     """The MetricBundleGroup exists to calculate the metric values for a group of
     MetricBundles.
@@ -77,15 +187,51 @@ class MetricBundleGroup(object):
         If False, metric values will only be saved after summary statistics are calculated.
     dbTable : Optional[str]
         The name of the table in the dbObj to query for data.
+    nWorkers : Optional[int]
+        The number of processes to use when calculating metric values.
+        If greater than 1, the slicePoints of each set of compatible MetricBundles are split into
+        chunks which are calculated in a pool of forked worker processes (which share simData with
+        the parent process), and the results are merged back into each MetricBundle.
+        The results are identical to the serial calculation, provided the metrics are deterministic.
+        Default 1 (calculate metric values serially).
+    cacheSize : Optional[int]
+        The number of slicePoints to remember, so that metric values can be reused (rather than
+        recalculated) when a later slicePoint receives exactly the same data. Applies to any slicer.
+        Default None, which uses the slicer's cacheSize (only set by the HealpixSlicer).
+        Caching is always disabled when maps are attached to the slicer, as the metric values may
+        then depend on the slicePoint metadata.
+    cacheBytes : Optional[int]
+        The maximum memory (in bytes) used by the stored slice indexes of the cache.
+        Default None (the cache is only limited by cacheSize).
+    singleQuery : Optional[bool]
+        If True, query the database only once, for the columns needed by all of the MetricBundles
+        (without a constraint), and evaluate each constraint on this data in memory with numpy
+        (see lsst.sims.maf.db.constraintMask). Constraints which cannot be evaluated with numpy
+        are still applied with a sql query. This uses more memory, but avoids repeatedly reading
+        the same rows from the database. Default False.
     """
     def __init__(self, bundleDict, dbObj, outDir='.', resultsDb=None, verbose=True,
-                 saveEarly=True, dbTable=None):
+                 saveEarly=True, dbTable=None, nWorkers=1, cacheSize=None, cacheBytes=None,
+                 singleQuery=False):
         """Set up the MetricBundleGroup.
         """
         # Print occasional messages to screen.
         self.verbose = verbose
         # Save metric results as soon as possible (in case of crash).
         self.saveEarly = saveEarly
+        # Number of processes to use to calculate metric values.
+        self.nWorkers = nWorkers
+        # Limits for the cache of metric values calculated for identical slices.
+        self.cacheSize = cacheSize
+        self.cacheBytes = cacheBytes
+        # Query the database once for all constraints.
+        self.singleQuery = singleQuery
+        self.supersetData = None
+        # Runs the stackers, and tracks which stackers have been run on the current simData.
+        self.stackerScheduler = StackerScheduler()
+        # Slice indexes built by the spatial slicers for the current simData, so that equivalent
+        #  slicers in different compatible lists reuse them.
+        self.sliceIndexCache = {}
         # Check for output directory, create it if needed.
         self.outDir = outDir
         if not os.path.isdir(self.outDir):
@@ -182,7 +328,7 @@ class MetricBundleGroup(object):
                 compatibleLists.append([k, ])
         self.compatibleLists = compatibleLists
 
-    def runAll(self, clearMemory=False, plotNow=False, plotKwargs=None):
+    def runAll(self, clearMemory=False, plotNow=False, plotKwargs=None, nWorkers=None):
         """Runs all the metricBundles in the metricBundleGroup, over all constraints.
 
         Calculates metric values, then runs reduce functions and summary statistics for
@@ -196,13 +342,18 @@ class MetricBundleGroup(object):
             If True, plots the metric values immediately after calculation.
         plotKwargs : Optional[kwargs]
             kwargs to pass to plotCurrent.
+        nWorkers : Optional[int]
+            The number of processes to use to calculate metric values.
+            Default None, which uses self.nWorkers.
         """
         for constraint in self.constraints:
             # Set the 'currentBundleDict' which is a dictionary of the metricBundles which match this
             #  constraint.
             self.setCurrent(constraint)
             self.runCurrent(constraint, clearMemory=clearMemory,
-                            plotNow=plotNow, plotKwargs=plotKwargs)
+                            plotNow=plotNow, plotKwargs=plotKwargs, nWorkers=nWorkers)
+        # Release the data queried for all constraints.
+        self.supersetData = None
 
     def setCurrent(self, constraint):
         """Utility to set the currentBundleDict (i.e. a set of metricBundles with the same SQL constraint).
@@ -221,7 +372,8 @@ class MetricBundleGroup(object):
             if b.constraint == constraint:
                 self.currentBundleDict[k] = b
 
-    def runCurrent(self, constraint, simData=None, clearMemory=False, plotNow=False, plotKwargs=None):
+    def runCurrent(self, constraint, simData=None, clearMemory=False, plotNow=False, plotKwargs=None,
+                   nWorkers=None):
         """Run all the metricBundles which match this constraint in the metricBundleGroup.
 
         Calculates the metric values, then runs reduce functions and summary statistics for
@@ -241,6 +393,9 @@ class MetricBundleGroup(object):
            is to plot after metric values are calculated for all constraints).
         plotKwargs : Optional[kwargs]
            Plotting kwargs to pass to plotCurrent.
+        nWorkers : Optional[int]
+           The number of processes to use to calculate metric values.
+           Default None, which uses self.nWorkers.
         """
         # Build list of all the columns needed from the database.
         self.dbCols = []
@@ -248,6 +403,10 @@ class MetricBundleGroup(object):
             self.dbCols.extend(b.dbCols)
         self.dbCols = list(set(self.dbCols))
 
+        # New simData, so the stackers must be run again (and the slice indexes rebuilt).
+        self.stackerScheduler.reset()
+        self.sliceIndexCache = {}
+
         # Can pass simData directly (if had other method for getting data)
         if simData is not None:
             self.simData = simData
@@ -280,7 +439,7 @@ class MetricBundleGroup(object):
         for compatibleList in self.compatibleLists:
             if self.verbose:
                 print('Running: ', compatibleList)
-            self._runCompatible(compatibleList)
+            self._runCompatible(compatibleList, nWorkers=nWorkers)
             if self.verbose:
                 print('Completed metric generation.')
             for key in compatibleList:
@@ -325,8 +484,12 @@ class MetricBundleGroup(object):
                 print("Querying database %s with constraint %s for columns %s" %
                       (self.dbTable, constraint, self.dbCols))
         # Note that we do NOT run the stackers at this point (this must be done in each 'compatible' group).
-        self.simData = utils.getSimData(self.dbObj, constraint, self.dbCols,
-                                        groupBy='default', tableName=self.dbTable)
+        self.simData = None
+        if self.singleQuery:
+            self.simData = self._getDataFromSuperset(constraint)
+        if self.simData is None:
+            self.simData = utils.getSimData(self.dbObj, constraint, self.dbCols,
+                                            groupBy='default', tableName=self.dbTable)
 
         if self.verbose:
             print("Found %i visits" % (self.simData.size))
@@ -338,7 +501,79 @@ class MetricBundleGroup(object):
         else:
             self.fieldData = None
 
-    def _runCompatible(self, compatibleList):
+    def _getSupersetData(self):
+        """Query the database (once, without a constraint) for the columns needed by all MetricBundles.
+
+        The data is not grouped by the default groupBy column here; this is done after each
+        constraint is applied (as a sql query would), in _getDataFromSuperset.
+        If the query fails, self.supersetData is set to False and each constraint is queried separately.
+        """
+        dbCols = set()
+        for b in self.bundleDict.values():
+            dbCols.update(b.dbCols)
+        # Add the columns used in the constraints, so that the constraints can be evaluated in memory.
+        # (Match these to the table's column names, as sql does not distinguish case in column names).
+        tableCols = {}
+        if hasattr(self.dbObj, 'columnNames'):
+            tableCols = dict([(col.lower(), col) for col in self.dbObj.columnNames.get(self.dbTable, [])])
+        for b in self.bundleDict.values():
+            for col in db.constraintColumns(b.constraint):
+                if col.lower() in tableCols:
+                    dbCols.add(tableCols[col.lower()])
+        # Only opsim databases group by a column by default (the MJD, for the summary table).
+        self.supersetGroupBy = None
+        if self.dbTable == self.dbObj.defaultTable and hasattr(self.dbObj, 'mjdCol'):
+            self.supersetGroupBy = self.dbObj.mjdCol
+            dbCols.add(self.supersetGroupBy)
+        if self.verbose:
+            print('Querying database %s once for all constraints, for columns %s.'
+                  % (self.dbTable, list(dbCols)))
+        try:
+            self.supersetData = self.dbObj.fetchMetricData(list(dbCols), None, groupBy=None,
+                                                           tableName=self.dbTable)
+        except ValueError:
+            warnings.warn('Could not query all columns at once; querying each constraint separately.')
+            self.supersetData = False
+
+    def _getDataFromSuperset(self, constraint):
+        """Select the data matching constraint from self.supersetData.
+
+        Parameters
+        ----------
+        constraint : str
+           The constraint for the currently active set of MetricBundles.
+
+        Returns
+        -------
+        numpy.ndarray or None
+            The data for the columns in self.dbCols, or None if the constraint cannot be evaluated
+            with numpy (and so must be applied with a sql query).
+        """
+        if self.supersetData is None:
+            self._getSupersetData()
+        if self.supersetData is False:
+            return None
+        mask = db.constraintMask(self.supersetData, constraint)
+        if mask is None:
+            if self.verbose:
+                print('Constraint %s cannot be evaluated in memory; querying database.' % (constraint))
+            return None
+        rows = np.where(mask)[0]
+        if self.supersetGroupBy is not None:
+            # Order by the groupBy column and keep one row for each value, as a sql group by would.
+            groupVals = self.supersetData[self.supersetGroupBy]
+            rows = rows[np.argsort(groupVals[rows], kind='mergesort')]
+            uniq, first = np.unique(groupVals[rows], return_index=True)
+            rows = rows[first]
+        if len(rows) == 0:
+            raise UserWarning('No data found matching sqlconstraint %s' % (constraint))
+        dtype = [(col, self.supersetData.dtype[col]) for col in self.dbCols]
+        simData = np.recarray((len(rows),), dtype=dtype)
+        for col in self.dbCols:
+            simData[col] = self.supersetData[col][rows]
+        return simData
+
+    def _runCompatible(self, compatibleList, nWorkers=None):
         """Runs a set of 'compatible' metricbundles in the MetricBundleGroup dictionary,
         identified by 'compatibleList' keys.
 
@@ -348,11 +583,22 @@ class MetricBundleGroup(object):
         slicer, the same maps applied to the slicer, and stackers which do not clobber each other's data.
 
         This is where the work of calculating the metric values is done.
+
+        Parameters
+        ----------
+        compatibleList : List[str]
+            The keys of the compatible MetricBundles in the currentBundleDict.
+        nWorkers : Optional[int]
+            The number of processes to use to calculate metric values.
+            Default None, which uses self.nWorkers.
         """
 
         if len(self.simData) == 0:
             return
 
+        if nWorkers is None:
+            nWorkers = self.nWorkers
+
         # Grab a dictionary representation of this subset of the dictionary, for easier iteration.
         bDict = {key: self.currentBundleDict.get(key) for key in compatibleList}
 
@@ -371,10 +617,9 @@ class MetricBundleGroup(object):
             if m not in uniqMaps:
                 uniqMaps.append(m)
 
-        # Run stackers.
-        for stacker in uniqStackers:
-            # Note that stackers will clobber previously existing rows with the same name.
-            self.simData = stacker.run(self.simData)
+        # Run stackers (skipping any which were already run for a previous compatible list).
+        # Note that stackers will clobber previously existing rows with the same name.
+        self.simData = self.stackerScheduler.run(self.simData, uniqStackers)
 
         # Pull out one of the slicers to use as our 'slicer'.
         # This will be forced back into all of the metricBundles at the end (so that they track
@@ -382,6 +627,8 @@ class MetricBundleGroup(object):
         slicer = list(bDict.values())[0].slicer
         if (slicer.slicerName == 'OpsimFieldSlicer'):
             slicer.setupSlicer(self.simData, self.fieldData, maps=uniqMaps)
+        elif isinstance(slicer, BaseSpatialSlicer):
+            slicer.setupSlicer(self.simData, maps=uniqMaps, sliceIndexCache=self.sliceIndexCache)
         else:
             slicer.setupSlicer(self.simData, maps=uniqMaps)
         # Copy the slicer (after setup) back into the individual metricBundles.
@@ -393,48 +640,24 @@ class MetricBundleGroup(object):
         for b in bDict.values():
             b._setupMetricValues()
 
-        # Set up an ordered dictionary to be the cache if needed:
-        # (Currently using OrderedDict, it might be faster to use 2 regular Dicts instead)
-        if slicer.cacheSize > 0:
-            cacheDict = OrderedDict()
-            cache = True
-        else:
-            cache = False
         # Run through all slicepoints and calculate metrics.
-        for i, slice_i in enumerate(slicer):
-            slicedata = self.simData[slice_i['idxs']]
-            if len(slicedata) == 0:
-                # No data at this slicepoint. Mask data values.
-                for b in bDict.values():
-                    b.metricValues.mask[i] = True
-            else:
-                # There is data! Should we use our data cache?
-                if cache:
-                    # Make the data idxs hashable.
-                    cacheKey = frozenset(slice_i['idxs'])
-                    # If key exists, set flag to use it, otherwise add it
-                    if cacheKey in cacheDict:
-                        useCache = True
-                        cacheVal = cacheDict[cacheKey]
-                        # Move this value to the end of the OrderedDict
-                        del cacheDict[cacheKey]
-                        cacheDict[cacheKey] = cacheVal
-                    else:
-                        cacheDict[cacheKey] = i
-                        useCache = False
-                    for b in bDict.values():
-                        if useCache:
-                            b.metricValues.data[i] = b.metricValues.data[cacheDict[cacheKey]]
-                        else:
-                            b.metricValues.data[i] = b.metric.run(slicedata, slicePoint=slice_i['slicePoint'])
-                    # If we are above the cache size, drop the oldest element from the cache dict.
-                    if len(cacheDict) > slicer.cacheSize:
-                        del cacheDict[list(cacheDict.keys())[0]]
-
-                # Not using memoize, just calculate things normally
-                else:
-                    for b in bDict.values():
-                        b.metricValues.data[i] = b.metric.run(slicedata, slicePoint=slice_i['slicePoint'])
+        metricList = [b.metric for b in bDict.values()]
+        metricValues = [b.metricValues.data for b in bDict.values()]
+        metricMasks = [b.metricValues.mask for b in bDict.values()]
+        memoLimits = self._memoLimits(slicer, uniqMaps)
+        if all([metric.canRunBatch() for metric in metricList]):
+            # All of these metrics can be calculated over all slicePoints at once.
+            _calcMetricValuesBatch(self.simData, slicer, metricList, metricValues, metricMasks)
+        elif nWorkers is not None and nWorkers > 1 and slicer.nslice > 1:
+            self._runParallel(slicer, metricList, metricValues, metricMasks, nWorkers, memoLimits)
+        else:
+            memo = None
+            if memoLimits is not None:
+                memo = SliceMemo(*memoLimits)
+            _calcMetricValues(self.simData, slicer, metricList, metricValues, metricMasks,
+                              0, slicer.nslice, memo=memo)
+            if memo is not None:
+                self._reportMemo(memo.stats())
         # Mask data where metrics could not be computed (according to metric bad value).
         for b in bDict.values():
             if b.metricValues.dtype.name == 'object':
@@ -451,6 +674,78 @@ class MetricBundleGroup(object):
             for b in bDict.values():
                 b.write(outDir=self.outDir, resultsDb=self.resultsDb)
 
+    def _memoLimits(self, slicer, maps):
+        """Return the (maxEntries, maxBytes) limits for the cache of metric values,
+        or None if the cache should not be used."""
+        if len(maps) > 0:
+            return None
+        cacheSize = self.cacheSize
+        if cacheSize is None:
+            cacheSize = slicer.cacheSize
+        if cacheSize <= 0 and self.cacheBytes is None:
+            return None
+        if cacheSize <= 0:
+            cacheSize = None
+        return (cacheSize, self.cacheBytes)
+
+    def _reportMemo(self, stats):
+        """Print the hit/miss statistics of the cache of metric values."""
+        if self.verbose:
+            total = stats['hits'] + stats['misses']
+            if total > 0:
+                print('Cache: reused metric values for %d of %d slicePoints with data (%d hash collisions).'
+                      % (stats['hits'], total, stats['collisions']))
+
+    def _runParallel(self, slicer, metricList, metricValues, metricMasks, nWorkers, memoLimits=None):
+        """Calculate metric values at all slicePoints using a pool of worker processes.
+
+        The slicePoints are split into contiguous chunks (so that the slicer's cache remains useful),
+        the chunks are calculated in forked worker processes which inherit self.simData and the set up
+        slicer, and the results are copied back into metricValues and metricMasks.
+        Falls back to the serial calculation if processes cannot be forked on this platform.
+        """
+        try:
+            ctx = multiprocessing.get_context('fork')
+        except (AttributeError, ValueError):
+            # (multiprocessing.get_context is not available in python 2).
+            warnings.warn('Cannot fork worker processes on this platform; calculating metric values serially.')
+            memo = None
+            if memoLimits is not None:
+                memo = SliceMemo(*memoLimits)
+            _calcMetricValues(self.simData, slicer, metricList, metricValues, metricMasks,
+                              0, slicer.nslice, memo=memo)
+            if memo is not None:
+                self._reportMemo(memo.stats())
+            return
+        # Use a few chunks per worker, to balance the load when some slicePoints have more data than others.
+        nChunks = min(slicer.nslice, nWorkers * 4)
+        edges = np.linspace(0, slicer.nslice, nChunks + 1).astype(int)
+        chunks = [(start, stop) for start, stop in zip(edges[:-1], edges[1:]) if stop > start]
+        _workerState['simData'] = self.simData
+        _workerState['slicer'] = slicer
+        _workerState['metricList'] = metricList
+        _workerState['values'] = metricValues
+        _workerState['masks'] = metricMasks
+        _workerState['memoLimits'] = memoLimits
+        memoStats = {'hits': 0, 'misses': 0, 'collisions': 0}
+        try:
+            pool = ctx.Pool(processes=nWorkers)
+            try:
+                for start, stop, values, masks, stats in pool.imap_unordered(_runSlicePointChunk, chunks):
+                    for v, m, chunkValues, chunkMasks in zip(metricValues, metricMasks, values, masks):
+                        v[start:stop] = chunkValues
+                        m[start:stop] = chunkMasks
+                    if stats is not None:
+                        for k in memoStats:
+                            memoStats[k] += stats[k]
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            _workerState.clear()
+        if memoLimits is not None:
+            self._reportMemo(memoStats)
+
     def reduceAll(self, updateSummaries=True):
         """Run the reduce methods for all metrics in bundleDict.
 
@@ -1,6 +1,8 @@
 from __future__ import print_function
 from builtins import object
 import os
+import multiprocessing
+import warnings
 import numpy as np
 import numpy.ma as ma
 import matplotlib.pyplot as plt
@@ -8,7 +10,7 @@ import matplotlib.pyplot as plt
 from lsst.sims.maf.metrics import BaseMoMetric
 from lsst.sims.maf.metrics import MoCompletenessMetric, ValueAtHMetric
 from lsst.sims.maf.slicers import MoObjSlicer
-from lsst.sims.maf.stackers import BaseMoStacker, MoMagStacker
+from lsst.sims.maf.stackers import BaseMoStacker, MoMagStacker, selectH
 from lsst.sims.maf.plots import PlotHandler
 from lsst.sims.maf.plots import MetricVsH
 
@@ -16,6 +18,35 @@ from .metricBundle import MetricBundle
 
 __all__ = ['MoMetricBundle', 'MoMetricBundleGroup', 'createEmptyMoMetricBundle', 'makeCompletenessBundle']
 
+# State shared with the worker processes used by MoMetricBundleGroup when nWorkers > 1.
+# This is set immediately before the worker pool is forked, so the workers inherit the observations
+# (and the set up metric bundles) from the parent process instead of receiving a pickled copy.
+_workerState = {}
+
+
+def _runOrbitChunk(args):
+    """Calculate the metric values for the orbits orbitIdxs in a worker process.
+
+    Parameters
+    ----------
+    args : tuple
+        (orbitIdxs, seed): the indexes of the orbits to calculate, and the seed for np.random
+        (the forked workers would otherwise all continue the random sequence of the parent process).
+
+    Returns
+    -------
+    tuple
+        (orbitIdxs, list of (metric values, mask) for each parent and child bundle) for these orbits.
+    """
+    orbitIdxs, seed = args
+    np.random.seed(seed)
+    group = _workerState['group']
+    compatibleList = _workerState['compatibleList']
+    group._calcOrbits(compatibleList, _workerState['compatStackers'], orbitIdxs)
+    values = [(b.metricValues.data[orbitIdxs], b.metricValues.mask[orbitIdxs])
+              for b in group._compatibleBundles(compatibleList)]
+    return orbitIdxs, values
+
 
 def createEmptyMoMetricBundle():
     """Create an empty metric bundle.
@@ -249,8 +280,32 @@ class MoMetricBundle(MetricBundle):
 
 
 class MoMetricBundleGroup(object):
-    def __init__(self, bundleDict, outDir='.', resultsDb=None, verbose=True):
+    """Calculate the metric values for a group of MoMetricBundles (which must share the same slicer).
+
+    Parameters
+    ----------
+    bundleDict : dict of MoMetricBundles
+        The metric bundles to calculate.
+    outDir : str, opt
+        The output directory for the metric values. Default '.'.
+    resultsDb : lsst.sims.maf.db.ResultsDb, opt
+        The results database to record the metrics and summary statistics in. Default None.
+    verbose : bool, opt
+        Flag for additional output. Default True.
+    nWorkers : int, opt
+        The number of processes to use when calculating metric values.
+        If greater than 1, the orbits are split into chunks which are calculated in a pool of forked
+        worker processes (which share the observations with the parent process), and the results are
+        merged back into each MoMetricBundle. Note that the visibility of each observation (the vis column)
+        is random, so results only match the serial calculation exactly for metrics using snrLimit.
+        (Each chunk of orbits is calculated with its own random seed, drawn from np.random in this process.)
+        Default 1 (calculate metric values serially).
+        See also runShard/mergeShards, to split the calculation between independent processes.
+    """
+    def __init__(self, bundleDict, outDir='.', resultsDb=None, verbose=True, nWorkers=1):
         self.verbose = verbose
+        # Number of processes to use to calculate metric values.
+        self.nWorkers = nWorkers
         self.bundleDict = bundleDict
         self.outDir = outDir
         if not os.path.isdir(self.outDir):
@@ -335,7 +390,20 @@ class MoMetricBundleGroup(object):
                 compatibleLists.append([k,])
         return compatibleLists
 
-    def runConstraint(self, constraint):
+    def _matchingKeys(self, constraint):
+        """Return the keys of the metricBundles which match this constraint."""
+        return [k for k, b in self.bundleDict.items() if b.constraint == constraint]
+
+    def _compatibleBundles(self, compatibleList):
+        """Return all of the metricBundles for compatibleList, including the child bundles."""
+        bundles = []
+        for k in compatibleList:
+            b = self.bundleDict[k]
+            bundles.append(b)
+            bundles.extend(b.childBundles.values())
+        return bundles
+
+    def runConstraint(self, constraint, nWorkers=None):
         """Calculate the metric values for all the metricBundles which match this constraint in the
         metricBundleGroup. Also calculates child metrics and summary statistics, and writes all to disk.
         (work is actually done in _runCompatible, so that only completely compatible sets of metricBundles
@@ -345,12 +413,12 @@ class MoMetricBundleGroup(object):
         ----------
         constraint : str
             SQL-where or pandas constraint for the metricBundles.
+        nWorkers : int, opt
+            The number of processes to use to calculate the metric values.
+            Default None, which uses self.nWorkers.
         """
         # Find the dict keys of the bundles which match this constraint.
-        keysMatchingConstraint = []
-        for k, b in self.bundleDict.items():
-            if b.constraint == constraint:
-                keysMatchingConstraint.append(k)
+        keysMatchingConstraint = self._matchingKeys(constraint)
         if len(keysMatchingConstraint) == 0:
             return
         # Identify the observations which are relevant for this constraint.
@@ -361,9 +429,9 @@ class MoMetricBundleGroup(object):
 
         # And now run each of those subsets of compatible metricBundles.
         for compatibleList in compatibleLists:
-            self._runCompatible(compatibleList)
+            self._runCompatible(compatibleList, nWorkers=nWorkers)
 
-    def _runCompatible(self, compatibleList):
+    def _runCompatible(self, compatibleList, nWorkers=None):
         """Calculate the metric values for set of (parent and child) bundles, as well as the summary stats,
         and write to disk.
 
@@ -373,7 +441,16 @@ class MoMetricBundleGroup(object):
             List of dictionary keys, of the metricBundles which can be calculated together.
             This means they are 'compatible' and have the same slicer, constraint, and non-conflicting
             mappers and stackers.
+        nWorkers : int, opt
+            The number of processes to use to calculate the metric values.
+            Default None, which uses self.nWorkers.
         """
+        compatStackers = self._setupCompatible(compatibleList)
+        self._calcCompatible(compatibleList, compatStackers, np.arange(self.slicer.nSso), nWorkers=nWorkers)
+        self._finishCompatible(compatibleList)
+
+    def _setupCompatible(self, compatibleList):
+        """Set up the metric values for a set of compatible bundles, and return their stackers."""
         if self.verbose:
             print('Running metrics %s' % compatibleList)
         # Make a list of all the maps and stackers to be run for this set.
@@ -388,18 +465,104 @@ class MoMetricBundleGroup(object):
         if len(compatMaps) > 0:
             print("Got some maps .. that was unexpected at the moment. Can't use them here yet.")
         # Set up all of the metric values, including for the child bundles.
-        for k in compatibleList:
-            b = self.bundleDict[k]
+        for b in self._compatibleBundles(compatibleList):
             b._setupMetricValues()
-            for cb in b.childBundles.values():
-                cb._setupMetricValues()
-        # Calculate the metric values.
-        for i, slicePoint in enumerate(self.slicer):
+        return compatStackers
+
+    def _calcCompatible(self, compatibleList, compatStackers, orbitIdxs, nWorkers=None):
+        """Calculate the metric values of a set of compatible bundles for the orbits orbitIdxs.
+
+        The observations are used one chunk at a time (if the slicer is not reading the observations
+        in chunks, this is all orbits at once). Orbits without any observations are masked.
+        Where possible, if the observations are read in chunks, the stackers are run once on all of the
+        observations in each chunk, rather than for each object.
+        """
+        if nWorkers is None:
+            nWorkers = self.nWorkers
+        todo = np.zeros(self.slicer.nSso, bool)
+        todo[orbitIdxs] = True
+        processed = np.zeros(self.slicer.nSso, bool)
+        for chunkIdxs in self.slicer.iterObsChunks():
+            chunkIdxs = chunkIdxs[todo[chunkIdxs]]
+            stackers = compatStackers
+            # (Only when reading in chunks, as the stacker columns are added for all H values at once).
+            if (self.slicer.chunkSize is not None and len(chunkIdxs) > 0 and len(compatStackers) > 0
+                    and self.slicer.runStackers(compatStackers)):
+                # The observations of each object now include the stacker columns.
+                stackers = []
+            if nWorkers is not None and nWorkers > 1 and len(chunkIdxs) > 1:
+                self._runParallel(compatibleList, stackers, chunkIdxs, nWorkers)
+            else:
+                self._calcOrbits(compatibleList, stackers, chunkIdxs)
+            processed[chunkIdxs] = True
+        # Mask the orbits which did not have any observations in any chunk.
+        unprocessed = todo & ~processed
+        if unprocessed.any():
+            for b in self._compatibleBundles(compatibleList):
+                b.metricValues.mask[unprocessed] = True
+
+    def _runParallel(self, compatibleList, compatStackers, orbitIdxs, nWorkers):
+        """Calculate the metric values for orbitIdxs using a pool of worker processes.
+
+        The orbits are split into contiguous chunks, which are calculated in forked worker processes
+        (which inherit the observations from this process), and the results are copied back into the
+        metric values of each bundle.
+        Falls back to the serial calculation if processes cannot be forked on this platform.
+        """
+        try:
+            ctx = multiprocessing.get_context('fork')
+        except (AttributeError, ValueError):
+            # (multiprocessing.get_context is not available in python 2).
+            warnings.warn('Cannot fork worker processes on this platform; calculating metric values serially.')
+            self._calcOrbits(compatibleList, compatStackers, orbitIdxs)
+            return
+        # Use a few chunks per worker, to balance the load when some objects have more observations.
+        chunks = [c for c in np.array_split(orbitIdxs, min(len(orbitIdxs), nWorkers * 4)) if len(c) > 0]
+        # Each chunk gets its own random seed, drawn here so the results only depend on the parent's seed.
+        seeds = np.random.randint(0, 2**31 - 1, size=len(chunks))
+        bundles = self._compatibleBundles(compatibleList)
+        _workerState['group'] = self
+        _workerState['compatibleList'] = compatibleList
+        _workerState['compatStackers'] = compatStackers
+        try:
+            pool = ctx.Pool(processes=nWorkers)
+            try:
+                for chunk, values in pool.imap_unordered(_runOrbitChunk, zip(chunks, seeds)):
+                    for b, (data, mask) in zip(bundles, values):
+                        b.metricValues.data[chunk] = data
+                        b.metricValues.mask[chunk] = mask
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            _workerState.clear()
+
+    def _calcOrbits(self, compatibleList, compatStackers, orbitIdxs):
+        """Calculate the metric values of a set of compatible bundles for the orbits orbitIdxs
+        (which must all be in the current chunk of observations)."""
+        # If all of the stackers can add their columns for all H values at once (as nObs x nH columns),
+        # run the stackers and parent metrics once per object instead of once per H value.
+        vectorH = True not in [s.colsAddedH is None for s in compatStackers]
+        for i in orbitIdxs:
+            slicePoint = self.slicer[i]
             ssoObs = slicePoint['obs']
-            for j, Hval in enumerate(slicePoint['Hvals']):
-                # Run stackers to add extra columns (that depend on Hval)
+            orb = slicePoint['orbit']
+            Hvals = slicePoint['Hvals']
+            if vectorH and len(ssoObs) > 0:
                 for s in compatStackers:
-                    ssoObs = s.run(ssoObs, slicePoint['orbit']['H'], Hval)
+                    ssoObs = s.run(ssoObs, orb['H'], Hvals)
+                mVals = {}
+                for k in compatibleList:
+                    mVals[k] = self.bundleDict[k].metric.runHvals(ssoObs, orb, Hvals)
+            for j, Hval in enumerate(Hvals):
+                if vectorH:
+                    # A view of the observations with the columns for this H value (for child metrics).
+                    ssoObsH = selectH(ssoObs, j)
+                else:
+                    # Run stackers to add extra columns (that depend on Hval)
+                    for s in compatStackers:
+                        ssoObs = s.run(ssoObs, orb['H'], Hval)
+                    ssoObsH = ssoObs
                 # Run all the parent metrics.
                 for k in compatibleList:
                     b = self.bundleDict[k]
@@ -411,7 +574,10 @@ class MoMetricBundleGroup(object):
                     # Otherwise, calculate the metric value for the parent, and then child.
                     else:
                         # Calculate for the parent.
-                        mVal = b.metric.run(ssoObs, slicePoint['orbit'], Hval)
+                        if vectorH:
+                            mVal = mVals[k][j]
+                        else:
+                            mVal = b.metric.run(ssoObsH, orb, Hval)
                         # Mask if the parent metric returned a bad value.
                         if mVal == b.metric.badval:
                             b.metricValues.mask[i][j] = True
@@ -421,11 +587,14 @@ class MoMetricBundleGroup(object):
                         else:
                             b.metricValues.data[i][j] = mVal
                             for cb in b.childBundles.values():
-                                childVal = cb.metric.run(ssoObs, slicePoint['orbit'], Hval, mVal)
+                                childVal = cb.metric.run(ssoObsH, orb, Hval, mVal)
                                 if childVal == cb.metric.badval:
                                     cb.metricValues.mask[i][j] = True
                                 else:
                                     cb.metricValues.data[i][j] = childVal
+
+    def _finishCompatible(self, compatibleList):
+        """Calculate the summary statistics of a set of compatible bundles, and write them to disk."""
         for k in compatibleList:
             b = self.bundleDict[k]
             b.computeSummaryStats(self.resultsDb)
@@ -436,15 +605,111 @@ class MoMetricBundleGroup(object):
             # Write to disk.
             b.write(outDir=self.outDir, resultsDb=self.resultsDb)
 
-    def runAll(self):
+    def runAll(self, nWorkers=None):
         """
         Run all constraints and metrics for these moMetricBundles.
+
+        Parameters
+        ----------
+        nWorkers : int, opt
+            The number of processes to use to calculate the metric values.
+            Default None, which uses self.nWorkers.
         """
         for constraint in self.constraints:
-            self.runConstraint(constraint)
+            self.runConstraint(constraint, nWorkers=nWorkers)
         if self.verbose:
             print('Calculated and saved all metrics.')
 
+    def _shardFile(self, bundle, shard, nShards):
+        return os.path.join(self.outDir, 'shards', '%s_shard%dof%d.npz' % (bundle.fileRoot, shard, nShards))
+
+    def _shardOrbits(self, shard, nShards):
+        """Return the indexes of the orbits in shard (of nShards)."""
+        if nShards < 1 or shard < 0 or shard >= nShards:
+            raise ValueError('Shard %d of %d does not exist (shards are numbered from 0 to nShards-1).'
+                             % (shard, nShards))
+        return np.array_split(np.arange(self.slicer.nSso), nShards)[shard]
+
+    def runShard(self, shard, nShards, nWorkers=None):
+        """
+        Calculate the metric values for one shard of the orbits, and write these partial metric values
+        (for all constraints and metrics) to the 'shards' directory in outDir.
+
+        The orbits are split into nShards contiguous shards. Each shard can be calculated independently
+        (e.g. by separate processes or on separate machines, sharing outDir); when all shards are done,
+        mergeShards combines them, calculates the summary statistics and writes the usual outputs.
+        np.random is reseeded (from its current state, offset by the first orbit of the shard), so
+        that shards started with the same seed still use different random numbers.
+
+        Parameters
+        ----------
+        shard : int
+            The shard to calculate (from 0 to nShards-1).
+        nShards : int
+            The total number of shards.
+        nWorkers : int, opt
+            The number of processes to use to calculate the metric values of this shard.
+            Default None, which uses self.nWorkers.
+        """
+        orbitIdxs = self._shardOrbits(shard, nShards)
+        # Offset the random seed by the first orbit in this shard, so that shards run with the same seed
+        #  do not all use the same random numbers (e.g. for the visibility of each observation).
+        firstOrbit = int(orbitIdxs[0]) if len(orbitIdxs) > 0 else 0
+        np.random.seed((np.random.randint(0, 2**31 - 1) + firstOrbit) % (2**31 - 1))
+        shardDir = os.path.join(self.outDir, 'shards')
+        if not os.path.isdir(shardDir):
+            os.makedirs(shardDir)
+        for constraint in self.constraints:
+            keysMatchingConstraint = self._matchingKeys(constraint)
+            if len(keysMatchingConstraint) == 0:
+                continue
+            self.slicer.subsetObs(constraint)
+            for compatibleList in self._findCompatible(keysMatchingConstraint):
+                compatStackers = self._setupCompatible(compatibleList)
+                self._calcCompatible(compatibleList, compatStackers, orbitIdxs, nWorkers=nWorkers)
+                for b in self._compatibleBundles(compatibleList):
+                    np.savez(self._shardFile(b, shard, nShards), orbitIdxs=orbitIdxs,
+                             shape=np.array(b.metricValues.shape),
+                             data=b.metricValues.data[orbitIdxs], mask=b.metricValues.mask[orbitIdxs])
+        if self.verbose:
+            print('Calculated and saved metric values for shard %d of %d.' % (shard, nShards))
+
+    def mergeShards(self, nShards):
+        """
+        Combine the partial metric values written by runShard for all nShards shards, then calculate
+        the summary statistics and write the metric values to disk (as runAll would do).
+
+        Parameters
+        ----------
+        nShards : int
+            The total number of shards.
+        """
+        for constraint in self.constraints:
+            keysMatchingConstraint = self._matchingKeys(constraint)
+            if len(keysMatchingConstraint) == 0:
+                continue
+            for b in self._compatibleBundles(keysMatchingConstraint):
+                b._setupMetricValues()
+                done = np.zeros(b.metricValues.shape[0], bool)
+                for shard in range(nShards):
+                    shardFile = self._shardFile(b, shard, nShards)
+                    if not os.path.isfile(shardFile):
+                        raise IOError('Could not find the metric values of %s for shard %d of %d (%s).'
+                                      % (b.metric.name, shard, nShards, shardFile))
+                    with np.load(shardFile, allow_pickle=True) as partial:
+                        if tuple(partial['shape']) != b.metricValues.shape:
+                            raise ValueError('The metric values in %s do not match the shape of %s.'
+                                             % (shardFile, b.metric.name))
+                        orbitIdxs = partial['orbitIdxs']
+                        b.metricValues.data[orbitIdxs] = partial['data']
+                        b.metricValues.mask[orbitIdxs] = partial['mask']
+                    done[orbitIdxs] = True
+                if not done.all():
+                    raise ValueError('The shards of %s do not cover all of the orbits.' % (b.metric.name))
+            self._finishCompatible(keysMatchingConstraint)
+        if self.verbose:
+            print('Merged %d shards, and calculated and saved all metrics.' % (nShards))
+
     def plotCurrent(self, savefig=True, outfileSuffix=None, figformat='pdf', dpi=600, thumbnail=True,
                     closefigs=True):
         plotHandler = PlotHandler(outDir=self.outDir, resultsDb=self.resultsDb,
@@ -0,0 +1,101 @@
+from builtins import object
+from collections import OrderedDict
+import numpy as np
+
+__all__ = ['SliceMemo']
+
+
+class SliceMemo(object):
+    """Least-recently-used memo of results calculated for a slice of simData.
+
+    Neighboring slicePoints frequently receive exactly the same simData indexes (e.g. healpixels
+    within the same opsim field), in which case metric values do not need to be recalculated.
+    Slices are keyed by a 64-bit hash of their sorted simData indexes; the sorted indexes are kept
+    with each entry, so that hash collisions are detected (and treated as misses).
+
+    Parameters
+    ----------
+    maxEntries : Optional[int]
+        Maximum number of slices to remember. Default None (no limit on the number of entries).
+    maxBytes : Optional[int]
+        Maximum size (in bytes) of the stored slice indexes. Default None (no limit on size).
+        At least one of maxEntries or maxBytes should be set.
+    """
+    def __init__(self, maxEntries=None, maxBytes=None):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.memo = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+
+    def __len__(self):
+        return len(self.memo)
+
+    def lookup(self, idxs):
+        """Look up the result stored for the slice of simData identified by idxs.
+
+        Parameters
+        ----------
+        idxs : numpy.ndarray or list
+            The simData indexes of the slice (or a boolean mask).
+
+        Returns
+        -------
+        tuple, numpy.ndarray, object
+            The key and the sorted indexes for this slice (to pass to store on a miss),
+            and the stored result (None if the slice was not found).
+        """
+        idxs = np.asarray(idxs)
+        if idxs.dtype == bool:
+            sortedIdxs = np.where(idxs)[0]
+        else:
+            sortedIdxs = np.sort(idxs)
+        key = (len(sortedIdxs), hash(sortedIdxs.tobytes()))
+        entry = self.memo.get(key)
+        if entry is not None:
+            if np.array_equal(entry[0], sortedIdxs):
+                # Pop and reinsert to mark it most recently used (OrderedDict.move_to_end is python 3 only).
+                self.memo[key] = self.memo.pop(key)
+                self.hits += 1
+                return key, sortedIdxs, entry[1]
+            self.collisions += 1
+        self.misses += 1
+        return key, sortedIdxs, None
+
+    def store(self, key, sortedIdxs, result):
+        """Store the result calculated for a slice, evicting the least recently used slices if needed.
+
+        Parameters
+        ----------
+        key : tuple
+            The key for the slice, from lookup.
+        sortedIdxs : numpy.ndarray
+            The sorted simData indexes for the slice, from lookup.
+        result : object
+            The result to remember for this slice.
+        """
+        if key in self.memo:
+            # Replace a colliding entry.
+            self.nbytes -= self.memo.pop(key)[0].nbytes
+        self.memo[key] = (sortedIdxs, result)
+        self.nbytes += sortedIdxs.nbytes
+        while len(self.memo) > 0 and ((self.maxEntries is not None and len(self.memo) > self.maxEntries) or
+                                      (self.maxBytes is not None and self.nbytes > self.maxBytes)):
+            self.nbytes -= self.memo.popitem(last=False)[1][0].nbytes
+
+    def clear(self):
+        """Forget all stored results (the hit/miss statistics are kept)."""
+        self.memo.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        """Return the hit/miss statistics of the memo.
+
+        Returns
+        -------
+        dict
+            Number of hits, misses, and hash collisions.
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'collisions': self.collisions}
@@ -191,3 +191,41 @@ class BaseMetric(with_metaclass(MetricRegistry, object)):
             The metric value at each slicePoint.
         """
         raise NotImplementedError('Please implement your metric calculation.')
+
+    def runBatch(self, simData, indexPtr, indices, slicePoints=None):
+        """Calculate metric values at all slicePoints at once (optional).
+
+        Metrics which can be calculated with vectorized kernels (such as np.add.reduceat)
+        may implement this method; it is used instead of `run` when every metric in a set of
+        compatible MetricBundles supports it. The data relevant for slicePoint i is
+        simData[indices[indexPtr[i]:indexPtr[i+1]]].
+
+        Parameters
+        ----------
+        simData : numpy.NDarray
+           The full set of simulated data (including stacker columns).
+        indexPtr : numpy.ndarray
+           Offsets into indices for each slicePoint (length nslice + 1).
+        indices : numpy.ndarray
+           The simData indexes for all slicePoints, concatenated in slicePoint order.
+        slicePoints : Dict
+           The slicePoint metadata for all slicePoints.
+
+        Returns
+        -------
+        numpy.ndarray
+            The metric value at each slicePoint. Values at slicePoints without data are ignored.
+        """
+        raise NotImplementedError('This metric does not support batch calculation.')
+
+    def canRunBatch(self):
+        """Return True if the metric implements runBatch, consistently with its run method.
+
+        Returns
+        -------
+        bool
+        """
+        mro = type(self).__mro__
+        runClass = [c for c in mro if 'run' in c.__dict__][0]
+        batchClass = [c for c in mro if 'runBatch' in c.__dict__][0]
+        return (batchClass is not BaseMetric) and issubclass(batchClass, runClass)
@@ -1,6 +1,5 @@
 from .baseMetric import BaseMetric
 from .simpleMetrics import Coaddm5Metric
-from lsst.sims.photUtils import Sed
 
 __all__ = ['ExgalM5']
 
@@ -35,6 +34,7 @@ class ExgalM5(BaseMetric):
         super(ExgalM5, self).__init__(col=[self.m5Col],
                                       maps=maps, units=units, **kwargs)
 
+        from lsst.sims.photUtils import Sed
         testsed = Sed()
         testsed.setFlatSED(wavelen_min = wavelen_min,
                            wavelen_max = wavelen_max, wavelen_step = 1)
@@ -3,6 +3,7 @@ from builtins import range
 import numpy as np
 
 from .baseMetric import BaseMetric
+from lsst.sims.maf.stackers.moStackers import selectH
 
 __all__ = ['BaseMoMetric', 'NObsMetric', 'NObsNoSinglesMetric',
            'NNightsMetric', 'ObsArcMetric',
@@ -87,6 +88,40 @@ class BaseMoMetric(BaseMetric):
         """
         raise NotImplementedError
 
+    def runHvals(self, ssoObs, orb, Hvals):
+        """Calculate the metric value for each of a series of H values.
+
+        By default, this runs the metric for each H value in turn. Metrics which can calculate their
+        values for all H values at once should override this method.
+
+        Parameters
+        ----------
+        ssoObs: np.ndarray
+            The input data to the metric, where the columns which depend on H (such as appMag, SNR and vis)
+            are 2-d (nObs x nH), as added by the moving object stackers when run with an array of H values.
+        orb: np.ndarray
+            The information about the orbit for which the metric is being calculated.
+        Hvals : np.ndarray
+            The H values for which the metric is being calculated.
+
+        Returns
+        -------
+        list
+            The metric value for each H value.
+        """
+        return [self.run(selectH(ssoObs, j), orb, Hval) for j, Hval in enumerate(Hvals)]
+
+    def _visibleH(self, ssoObs, nH):
+        """Return a boolean array (nObs x nH) flagging the observations where the object was visible,
+        for each H value (using self.snrLimit as in the run methods)."""
+        if self.snrLimit is not None:
+            vis = ssoObs[self.snrCol] >= self.snrLimit
+        else:
+            vis = ssoObs[self.visCol] > 0
+        if vis.ndim == 1:
+            vis = np.repeat(vis[:, np.newaxis], nH, axis=1)
+        return vis
+
 
 class BaseChildMetric(BaseMoMetric):
     """Base class for child metrics.
@@ -127,6 +162,22 @@ class BaseChildMetric(BaseMoMetric):
         """
         raise NotImplementedError
 
+    def _visibleSorted(self, ssoObs, metricValues):
+        """Return the indexes of the visible observations in ssoObs, in order of time.
+
+        These are reused from the parent metric if it calculated metricValues from them
+        (as the parent DiscoveryMetric does), and otherwise recalculated using self.snrLimit.
+        """
+        cached = getattr(self.parentMetric, '_cache', {}).get(id(metricValues))
+        if cached is not None and cached[0] is metricValues:
+            return cached[1]
+        if self.snrLimit is not None:
+            vis = ssoObs[self.snrCol] >= self.snrLimit
+        else:
+            vis = ssoObs[self.visCol] > 0
+        order = np.argsort(ssoObs[self.expMJDCol], kind='mergesort')
+        return order[vis[order]]
+
 
 class NObsMetric(BaseMoMetric):
     """
@@ -148,6 +199,9 @@ class NObsMetric(BaseMoMetric):
             vis = np.where(ssoObs[self.visCol] > 0)[0]
             return vis.size
 
+    def runHvals(self, ssoObs, orb, Hvals):
+        return list(self._visibleH(ssoObs, len(Hvals)).sum(axis=0))
+
 
 class NObsNoSinglesMetric(BaseMoMetric):
     """
@@ -210,6 +264,13 @@ class ObsArcMetric(BaseMoMetric):
         arc = ssoObs[self.expMJDCol][vis].max() - ssoObs[self.expMJDCol][vis].min()
         return arc
 
+    def runHvals(self, ssoObs, orb, Hvals):
+        vis = self._visibleH(ssoObs, len(Hvals))
+        times = ssoObs[self.expMJDCol][:, np.newaxis]
+        arc = np.where(vis, times, -np.inf).max(axis=0) - np.where(vis, times, np.inf).min(axis=0)
+        arc = np.where(vis.any(axis=0), arc, 0)
+        return list(arc)
+
 class DiscoveryMetric(BaseMoMetric):
     """Identify the discovery opportunities for an object."""
     def __init__(self, nObsPerNight=2,
@@ -240,66 +301,84 @@ class DiscoveryMetric(BaseMoMetric):
         self.tMax = tMax
         self.nNightsPerWindow = nNightsPerWindow
         self.tWindow = tWindow
+        # The visible observations (in order of time) for each of the most recently returned metric values.
+        self._cache = {}
 
     def run(self, ssoObs, orb, Hval):
         if self.snrLimit is not None:
-            vis = np.where(ssoObs[self.snrCol] >= self.snrLimit)[0]
+            vis = ssoObs[self.snrCol] >= self.snrLimit
         else:
-            vis = np.where(ssoObs[self.visCol] > 0)[0]
-        if len(vis) == 0:
+            vis = ssoObs[self.visCol] > 0
+        order = np.argsort(ssoObs[self.expMJDCol], kind='mergesort')
+        self._cache = {}
+        return self._findDiscoveries(ssoObs, order[vis[order]])
+
+    def runHvals(self, ssoObs, orb, Hvals):
+        visH = self._visibleH(ssoObs, len(Hvals))
+        # Sort the observations by time once, for all H values.
+        order = np.argsort(ssoObs[self.expMJDCol], kind='mergesort')
+        visH = visH[order]
+        self._cache = {}
+        return [self._findDiscoveries(ssoObs, order[visH[:, j]]) for j in range(len(Hvals))]
+
+    def _findDiscoveries(self, ssoObs, obsIdx):
+        """Find the discovery opportunities of an object.
+
+        Parameters
+        ----------
+        ssoObs : np.ndarray
+            The observations of the object.
+        obsIdx : np.ndarray
+            The indexes of the visible observations in ssoObs, in order of time.
+
+        Returns
+        -------
+        dict or badval
+            The indexes (into the visible, time-ordered observations) of the first observation ('start')
+            and last observation ('end') of each discovery opportunity, and the nights of all tracklets.
+        """
+        if len(obsIdx) == 0:
             return self.badval
-        # Identify discovery opportunities.
-        #  Identify visits where the 'night' changes.
-        visSort = np.argsort(ssoObs[self.expMJDCol][vis])
-        nights = ssoObs[self.nightCol][vis][visSort]
-        #print 'all nights', nights
-        n = np.unique(nights)
-        # Identify all the indexes where the night changes in value.
-        nIdx = np.searchsorted(nights, n)
-        #print 'nightchanges', nights[nIdx]
-        # Count the number of observations per night (except last night)
-        obsPerNight = (nIdx - np.roll(nIdx, 1))[1:]
-        # Add the number of observations on the last night.
-        obsLastNight = np.array([len(nights) - nIdx[-1]])
-        obsPerNight = np.concatenate((obsPerNight, obsLastNight))
-        # Find the nights with more than nObsPerNight.
-        nWithXObs = n[np.where(obsPerNight >= self.nObsPerNight)]
-        nIdxMany = np.searchsorted(nights, nWithXObs)
-        nIdxManyEnd = np.searchsorted(nights, nWithXObs, side='right') - 1
-        # Check that nObsPerNight observations are within tMin/tMax
-        timesStart = ssoObs[self.expMJDCol][vis][visSort][nIdxMany]
-        timesEnd = ssoObs[self.expMJDCol][vis][visSort][nIdxManyEnd]
-        # Identify the nights with 'clearly good' observations.
-        good = np.where((timesEnd - timesStart >= self.tMin) & (timesEnd - timesStart <= self.tMax), 1, 0)
-        # Identify the nights where we need more investigation (a subset of the visits may be within the interval).
-        check = np.where((good==0) & (nIdxManyEnd + 1 - nIdxMany > self.nObsPerNight) & (timesEnd-timesStart > self.tMax))[0]
-        for i, j, c in zip(visSort[nIdxMany][check], visSort[nIdxManyEnd][check], check):
-            t = ssoObs[self.expMJDCol][vis][visSort][i:j+1]
-            dtimes = (np.roll(t, 1- self.nObsPerNight) - t)[:-1]
-            tidx = np.where((dtimes >= self.tMin) & (dtimes <= self.tMax))[0]
-            if len(tidx) > 0:
-                good[c] = 1
-        # 'good' provides mask for observations which could count as 'good to make tracklets' against ssoObs[visSort][nIdxMany]
+        times = ssoObs[self.expMJDCol][obsIdx]
+        nights = ssoObs[self.nightCol][obsIdx]
+        # Find the first observation and the number of observations of each night.
+        n, nIdx, obsPerNight = np.unique(nights, return_index=True, return_counts=True)
+        # Find the nights with at least nObsPerNight observations (candidates for tracklets).
+        many = obsPerNight >= self.nObsPerNight
+        nightStart = nIdx[many]
+        nightEnd = nightStart + obsPerNight[many] - 1
+        dt = times[nightEnd] - times[nightStart]
+        # Identify the nights with 'clearly good' observations (the first and last make a tracklet).
+        good = (dt >= self.tMin) & (dt <= self.tMax)
+        # On the nights with more observations spanning more than tMax, a run of nObsPerNight
+        # consecutive observations may make a tracklet.
+        check = ~good & (obsPerNight[many] > self.nObsPerNight) & (dt > self.tMax)
+        if check.any():
+            k = self.nObsPerNight - 1
+            # The time between each observation and the observation k later.
+            dtimes = times[k:] - times[:len(times) - k]
+            inRange = np.concatenate([[0], np.cumsum((dtimes >= self.tMin) & (dtimes <= self.tMax))])
+            # Count the runs starting between nightStart and nightEnd - k (so within the night).
+            nRuns = inRange[nightEnd - k + 1] - inRange[nightStart]
+            good |= check & (nRuns > 0)
         # Now identify tracklets which can make tracks.
-        goodIdx = visSort[nIdxMany][good == 1]
-        goodIdxEnds = visSort[nIdxManyEnd][good == 1]
-        #print 'good tracklets', nights[goodIdx]
-        if len(goodIdx) < self.nNightsPerWindow:
+        trackletStart = nightStart[good]
+        trackletEnd = nightEnd[good]
+        trackletNights = nights[trackletStart]
+        if len(trackletStart) < self.nNightsPerWindow:
             return self.badval
-        deltaNights = np.roll(ssoObs[self.nightCol][vis][goodIdx], 1 - self.nNightsPerWindow) - ssoObs[self.nightCol][vis][goodIdx]
-        # Identify the index in ssoObs[vis][goodIdx] (sorted by expMJD) where the discovery opportunity starts.
+        # Identify the tracklets which start a discovery opportunity
+        # (with nNightsPerWindow tracklets within tWindow).
+        k = self.nNightsPerWindow - 1
+        deltaNights = trackletNights[k:] - trackletNights[:len(trackletNights) - k]
         startIdxs = np.where((deltaNights >= 0) & (deltaNights <= self.tWindow))[0]
-        # Identify the index where the discovery opportunity ends.
-        endIdxs = np.zeros(len(startIdxs), dtype='int')
-        for i, sIdx in enumerate(startIdxs):
-            inWindow = np.where(ssoObs[self.nightCol][vis][goodIdx] - ssoObs[self.nightCol][vis][goodIdx][sIdx] <= self.tWindow)[0]
-            endIdxs[i] = np.array([inWindow.max()])
-        # Convert back to index based on ssoObs[vis] (sorted by expMJD).
-        startIdxs = goodIdx[startIdxs]
-        endIdxs = goodIdxEnds[endIdxs]
-        #print 'start', startIdxs,  nights[startIdxs]#, orb['objId'], Hval
-        #print 'end', endIdxs, nights[endIdxs]#, orb['objId'], Hval
-        return {'start':startIdxs, 'end':endIdxs, 'trackletNights':ssoObs[self.nightCol][vis][goodIdx]}
+        # Identify the last tracklet within tWindow of the start of each discovery opportunity.
+        endIdxs = np.searchsorted(trackletNights, trackletNights[startIdxs] + self.tWindow, side='right') - 1
+        metricValues = {'start': trackletStart[startIdxs], 'end': trackletEnd[endIdxs],
+                        'trackletNights': trackletNights}
+        # Remember the visible observations, for the child metrics.
+        self._cache[id(metricValues)] = (metricValues, obsIdx)
+        return metricValues
 
 
 class Discovery_N_ChancesMetric(BaseChildMetric):
@@ -324,16 +403,12 @@ class Discovery_N_ChancesMetric(BaseChildMetric):
     def run(self, ssoObs, orb, Hval, metricValues):
         """Return the number of different discovery chances we had for each object/H combination.
         """
-        if self.snrLimit is not None:
-            vis = np.where(ssoObs[self.snrCol] >= self.snrLimit)[0]
-        else:
-            vis = np.where(ssoObs[self.visCol] > 0)[0]
-        if len(vis) == 0:
+        obsIdx = self._visibleSorted(ssoObs, metricValues)
+        if len(obsIdx) == 0:
             return self.badval
-        visSort = np.argsort(ssoObs[self.expMJDCol][vis])
-        nights = ssoObs[self.nightCol][vis][visSort]
-        startNights = nights[metricValues['start']]
-        endNights = nights[metricValues['end']]
+        nights = ssoObs[self.nightCol]
+        startNights = nights[obsIdx[metricValues['start']]]
+        endNights = nights[obsIdx[metricValues['end']]]
         if self.nightEnd is None:
             valid = np.where(startNights >= self.nightStart)[0]
         else:
@@ -370,16 +445,11 @@ class Discovery_TimeMetric(BaseChildMetric):
     def run(self, ssoObs, orb, Hval, metricValues):
         if self.i>=len(metricValues['start']):
             return self.badval
-        if self.snrLimit is not None:
-            vis = np.where(ssoObs[self.snrCol] >= self.snrLimit)[0]
-        else:
-            vis = np.where(ssoObs[self.visCol] > 0)[0]
-        if len(vis) == 0:
+        obsIdx = self._visibleSorted(ssoObs, metricValues)
+        if len(obsIdx) == 0:
             return self.badval
-        visSort = np.argsort(ssoObs[self.expMJDCol][vis])
-        times = ssoObs[self.expMJDCol][vis][visSort]
-        startIdx = metricValues['start'][self.i]
-        tDisc = times[startIdx]
+        startIdx = obsIdx[metricValues['start'][self.i]]
+        tDisc = ssoObs[self.expMJDCol][startIdx]
         if self.tStart is not None:
             tDisc = tDisc - self.tStart
         return tDisc
@@ -397,17 +467,11 @@ class Discovery_RADecMetric(BaseChildMetric):
     def run(self, ssoObs, orb, Hval, metricValues):
         if self.i>=len(metricValues['start']):
             return self.badval
-        if self.snrLimit is not None:
-            vis = np.where(ssoObs[self.snrCol] >= self.snrLimit)[0]
-        else:
-            vis = np.where(ssoObs[self.visCol] > 0)[0]
-        if len(vis) == 0:
+        obsIdx = self._visibleSorted(ssoObs, metricValues)
+        if len(obsIdx) == 0:
             return self.badval
-        visSort = np.argsort(ssoObs[self.expMJDCol][vis])
-        ra = ssoObs[self.raCol][vis][visSort]
-        dec = ssoObs[self.decCol][vis][visSort]
-        startIdx = metricValues['start'][self.i]
-        return (ra[startIdx], dec[startIdx])
+        startIdx = obsIdx[metricValues['start'][self.i]]
+        return (ssoObs[self.raCol][startIdx], ssoObs[self.decCol][startIdx])
 
 class Discovery_EcLonLatMetric(BaseChildMetric):
     """Returns the ecliptic lon/lat and solar elongation (in degrees) of the i-th discovery opportunity.
@@ -421,18 +485,11 @@ class Discovery_EcLonLatMetric(BaseChildMetric):
     def run(self, ssoObs, orb, Hval, metricValues):
         if self.i>=len(metricValues['start']):
             return self.badval
-        if self.snrLimit is not None:
-            vis = np.where(ssoObs[self.snrCol] >= self.snrLimit)[0]
-        else:
-            vis = np.where(ssoObs[self.visCol] > 0)[0]
-        if len(vis) == 0:
+        obsIdx = self._visibleSorted(ssoObs, metricValues)
+        if len(obsIdx) == 0:
             return self.badval
-        visSort = np.argsort(ssoObs[self.expMJDCol][vis])
-        ecLon = ssoObs['ecLon'][vis][visSort]
-        ecLat = ssoObs['ecLat'][vis][visSort]
-        solarElong = ssoObs['solarElong'][vis][visSort]
-        startIdx = metricValues['start'][self.i]
-        return (ecLon[startIdx], ecLat[startIdx], solarElong[startIdx])
+        startIdx = obsIdx[metricValues['start'][self.i]]
+        return (ssoObs['ecLon'][startIdx], ssoObs['ecLat'][startIdx], ssoObs['solarElong'][startIdx])
 
 class Discovery_VelocityMetric(BaseChildMetric):
     """Returns the sky velocity of the i-th discovery opportunity.
@@ -445,16 +502,11 @@ class Discovery_VelocityMetric(BaseChildMetric):
     def run(self, ssoObs, orb, Hval, metricValues):
         if self.i>=len(metricValues['start']):
             return self.badval
-        if self.snrLimit is not None:
-            vis = np.where(ssoObs[self.snrCol] >= self.snrLimit)[0]
-        else:
-            vis = np.where(ssoObs[self.visCol] > 0)[0]
-        if len(vis) == 0:
+        obsIdx = self._visibleSorted(ssoObs, metricValues)
+        if len(obsIdx) == 0:
             return self.badval
-        visSort = np.argsort(ssoObs[self.expMJDCol][vis])
-        velocity = ssoObs['velocity'][vis][visSort]
-        startIdx = metricValues['start'][self.i]
-        return velocity[startIdx]
+        startIdx = obsIdx[metricValues['start'][self.i]]
+        return ssoObs['velocity'][startIdx]
 
 class ActivityOverTimeMetric(BaseMoMetric):
     """
@@ -1,11 +1,19 @@
+import hashlib
 import numpy as np
+import numpy.ma as ma
 import warnings
 
 from .moMetrics import BaseMoMetric
 
-__all__ = ['integrateOverH', 'ValueAtHMetric', 'MeanValueAtHMetric',
+__all__ = ['integrateOverH', 'DiscoveryCounts', 'ValueAtHMetric', 'MeanValueAtHMetric',
            'MoCompletenessMetric', 'MoCompletenessAtTimeMetric']
 
+# The most recently used DiscoveryCounts, keyed by the contents of their (filled) metric values,
+# so that summary metrics run on the same metric values (e.g. differential and cumulative completeness,
+# at H or as a function of time) share them. Each holds a sorted copy of the metric values, so it is kept small.
+_countsCache = {}
+_countsCacheSize = 4
+
 
 def integrateOverH(Mvalues, Hvalues, Hindex = 0.3):
     """Function to calculate a metric value integrated over an Hrange, assuming a power-law distribution.
@@ -14,6 +22,7 @@ def integrateOverH(Mvalues, Hvalues, Hindex = 0.3):
     ----------
     Mvalues : numpy.ndarray
         The metric values at each H value.
+        If Mvalues is two-dimensional, each row is integrated (the last axis must match Hvalues).
     Hvalues : numpy.ndarray
         The H values corresponding to each Mvalue (must be the same length).
     Hindex : float, opt
@@ -29,10 +38,70 @@ def integrateOverH(Mvalues, Hvalues, Hindex = 0.3):
     # dndh = differential size distribution (number in this bin)
     dndh = np.power(10., Hindex*(Hvalues-Hvalues.min()))
     # dn = cumulative size distribution (number in this bin and brighter)
-    intVals = np.cumsum(Mvalues*dndh)/np.cumsum(dndh)
+    intVals = np.cumsum(Mvalues*dndh, axis=-1)/np.cumsum(dndh)
     return intVals
 
 
+class DiscoveryCounts(object):
+    """Count the objects 'discovered' at each H value, from the metric values of all objects.
+
+    The metric values (such as the number of discovery chances, or the time of discovery) for each
+    H value are sorted once, so that the counts for any requirement on the number of chances, or for
+    any set of times, are found with binary searches rather than by recounting all of the objects.
+
+    Parameters
+    ----------
+    metricValues : numpy.ma.MaskedArray
+        The metric values, with shape (number of objects, number of H values).
+    fillValue : float, opt
+        The value to use for masked metric values. Default 0.
+    """
+    def __init__(self, metricValues, fillValue=0):
+        self.nSsos = metricValues.shape[0]
+        values = ma.filled(metricValues, fillValue)
+        # Sorted metric values, with shape (number of H values, number of objects).
+        self.sortedValues = np.sort(np.asarray(values, float).swapaxes(0, 1), axis=1)
+
+    def countAtLeast(self, minValue):
+        """Return the number of objects with metric values >= minValue, at each H value."""
+        return np.array([self.nSsos - np.searchsorted(v, minValue, side='left')
+                         for v in self.sortedValues], float)
+
+    def countByTime(self, times):
+        """Return the number of objects with metric values between times[0] and each of times,
+        at each H value (with shape (number of H values, number of times)).
+
+        The counts are the cumulative sums of np.histogram(values, bins=times), so the last time
+        is included, the others are not, and the first count is 0.
+        """
+        times = np.asarray(times, float)
+        counts = np.empty((len(self.sortedValues), len(times)), float)
+        for i, v in enumerate(self.sortedValues):
+            idx = np.searchsorted(v, times, side='left')
+            idx[-1] = np.searchsorted(v, times[-1], side='right')
+            counts[i] = idx - idx[0]
+        counts[:, 0] = 0
+        return counts
+
+
+def _discoveryCounts(metricValues, fillValue=0):
+    """Return the DiscoveryCounts for metricValues, reusing those already calculated if possible.
+
+    The counts are identified by a hash of the metric values (after filling the masked values),
+    so metric values which are changed in place are counted again.
+    """
+    values = np.ascontiguousarray(ma.filled(metricValues, fillValue), float)
+    key = (values.shape, hashlib.sha1(values.view(np.uint8)).hexdigest())
+    counts = _countsCache.get(key)
+    if counts is not None:
+        return counts
+    counts = DiscoveryCounts(values)
+    _countsCache[key] = counts
+    while len(_countsCache) > _countsCacheSize:
+        del _countsCache[next(iter(_countsCache))]
+    return counts
+
+
 class ValueAtHMetric(BaseMoMetric):
     """Return the metric value at a given H value.
 
@@ -141,10 +210,8 @@ class MoCompletenessMetric(BaseMoMetric):
         discoveriesH = discoveryChances.swapaxes(0, 1)
         if nHval == discoveryChances.shape[1]:
             # Hvals array is probably the same as the cloned H array.
-            completeness = np.zeros(len(Hvals), float)
-            for i, H in enumerate(Hvals):
-                completeness[i] = np.where(discoveriesH[i].filled(0) >= self.requiredChances)[0].size
-            completeness = completeness / float(nSsos)
+            counts = _discoveryCounts(discoveryChances, fillValue=0)
+            completeness = counts.countAtLeast(self.requiredChances) / float(nSsos)
         else:
             # The Hvals are spread more randomly among the objects (we probably used one per object).
             hrange = Hvals.max() - Hvals.min()
@@ -162,7 +229,7 @@ class MoCompletenessMetric(BaseMoMetric):
             completeness = np.where(n_all==0, 0, completeness)
         if self.cumulative:
             completenessInt = integrateOverH(completeness, Hvals, self.Hindex)
-            summaryVal = np.empty(len(completenessInt), dtype=[('name', np.str_, S20), ('value', float)])
+            summaryVal = np.empty(len(completenessInt), dtype=[('name', np.str_, 20), ('value', float)])
             summaryVal['value'] = completenessInt
             for i, Hval in enumerate(Hvals):
                 summaryVal['name'][i] = 'H <= %f' % (Hval)
@@ -221,19 +288,15 @@ class MoCompletenessAtTimeMetric(BaseMoMetric):
             warnings.warn("This summary metric expects cloned H distribution. Cannot calculate summary.")
             return
         nSsos = discoveryTimes.shape[0]
-        timesinH = discoveryTimes.swapaxes(0, 1)
-        completenessH = np.empty([len(Hvals), len(self.times)], float)
-        for i, H in enumerate(Hvals):
-            n, b = np.histogram(timesinH[i], bins=self.times)
-            completenessH[i][0] = 0
-            completenessH[i][1:] = n.cumsum()
-        completenessH = completenessH / float(nSsos)
+        # Objects which were not discovered (masked values) are never counted.
+        counts = _discoveryCounts(discoveryTimes, fillValue=np.inf)
+        completenessH = counts.countByTime(self.times) / float(nSsos)
         completeness = completenessH.swapaxes(0, 1)
         if self.cumulative:
-            for i, t in enumerate(self.times):
-                completeness[i] = metrics.integrateOverH(completeness[i], Hvals)
+            completeness = integrateOverH(completeness, Hvals, self.Hindex)
         summaryVal = np.empty(len(completeness), dtype=[('name', np.str_, 20), ('value', float)])
-        summaryVal['value'] = completeness
+        # Interpolate the completeness at each time to self.Hval.
+        summaryVal['value'] = [np.interp(self.Hval, Hvals, c) for c in completeness]
         for i, time in enumerate(self.times):
             summaryVal['name'][i] = '%s @ %.2f' % (self.units, time)
         return summaryVal
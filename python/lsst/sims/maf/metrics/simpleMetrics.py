@@ -13,6 +13,21 @@ __all__ = ['PassMetric', 'Coaddm5Metric', 'MaxMetric', 'AbsMaxMetric', 'MeanMetr
 twopi = 2.0*np.pi
 
 
+def _reduceSlices(ufunc, values, indexPtr):
+    """Private utility for the batch ('runBatch') versions of the metrics below.
+
+    Applies ufunc.reduceat to 'values' (already ordered by slicePoint, i.e. simData[col][indices])
+    within each slicePoint of the slice index 'indexPtr'. SlicePoints without data are set to 0.
+    """
+    counts = np.diff(indexPtr)
+    result = np.zeros(len(counts), dtype=values.dtype)
+    nonempty = np.where(counts > 0)[0]
+    if len(nonempty) > 0:
+        # reduceat runs from each start to the next start, so the empty slices must be dropped.
+        result[nonempty] = ufunc.reduceat(values, indexPtr[nonempty])
+    return result
+
+
 class PassMetric(BaseMetric):
     """
     Just pass the entire array through
@@ -35,12 +50,20 @@ class Coaddm5Metric(BaseMetric):
     def run(self, dataSlice, slicePoint=None):
         return 1.25 * np.log10(np.sum(10.**(.8*dataSlice[self.colname])))
 
+    def runBatch(self, simData, indexPtr, indices, slicePoints=None):
+        flux = _reduceSlices(np.add, 10.**(.8*simData[self.colname][indices]), indexPtr)
+        with np.errstate(divide='ignore'):
+            return 1.25 * np.log10(flux)
+
 class MaxMetric(BaseMetric):
     """Calculate the maximum of a simData column slice.
     """
     def run(self, dataSlice, slicePoint=None):
         return np.max(dataSlice[self.colname])
 
+    def runBatch(self, simData, indexPtr, indices, slicePoints=None):
+        return _reduceSlices(np.maximum, simData[self.colname][indices], indexPtr)
+
 class AbsMaxMetric(BaseMetric):
     """Calculate the max of the absolute value of a simData column slice.
     """
@@ -53,6 +76,10 @@ class MeanMetric(BaseMetric):
     def run(self, dataSlice, slicePoint=None):
         return np.mean(dataSlice[self.colname])
 
+    def runBatch(self, simData, indexPtr, indices, slicePoints=None):
+        total = _reduceSlices(np.add, simData[self.colname][indices].astype(float), indexPtr)
+        return total / np.maximum(np.diff(indexPtr), 1)
+
 class AbsMeanMetric(BaseMetric):
     """Calculate the mean of the absolute value of a simData column slice.
     """
@@ -77,6 +104,9 @@ class MinMetric(BaseMetric):
     def run(self, dataSlice, slicePoint=None):
         return np.min(dataSlice[self.colname])
 
+    def runBatch(self, simData, indexPtr, indices, slicePoints=None):
+        return _reduceSlices(np.minimum, simData[self.colname][indices], indexPtr)
+
 class FullRangeMetric(BaseMetric):
     """Calculate the range of a simData column slice.
     """
@@ -95,6 +125,9 @@ class SumMetric(BaseMetric):
     def run(self, dataSlice, slicePoint=None):
         return np.sum(dataSlice[self.colname])
 
+    def runBatch(self, simData, indexPtr, indices, slicePoints=None):
+        return _reduceSlices(np.add, simData[self.colname][indices], indexPtr)
+
 class CountUniqueMetric(BaseMetric):
     """Return the number of unique values.
     """
@@ -118,6 +151,9 @@ class CountMetric(BaseMetric):
     def run(self, dataSlice, slicePoint=None):
         return len(dataSlice[self.colname])
 
+    def runBatch(self, simData, indexPtr, indices, slicePoints=None):
+        return np.diff(indexPtr)
+
 class CountRatioMetric(BaseMetric):
     """Count the length of a simData column slice, then divide by 'normVal'. 
     """
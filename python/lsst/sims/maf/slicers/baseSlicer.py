@@ -70,9 +70,9 @@ class BaseSlicer(with_metaclass(SlicerRegistry, object)):
         self.verbose = verbose
         self.badval = badval
         # Set cacheSize : each slicer will be able to override if appropriate.
-        # Currently only the healpixSlice actually uses the cache: this is set in 'useCache' flag.
-        #  If other slicers have the ability to use the cache, they should add this flag and set the
-        #  cacheSize in their __init__ methods.
+        # This is the default size of the MetricBundleGroup cache of metric values (see SliceMemo).
+        #  Currently only the healpixSlicer sets this (via its 'useCache' flag); the cache can be
+        #  enabled for any slicer by setting cacheSize in the MetricBundleGroup.
         self.cacheSize = 0
         # Set length of Slicer.
         self.nslice = None
@@ -148,6 +148,32 @@ class BaseSlicer(with_metaclass(SlicerRegistry, object)):
     def __getitem__(self, islice):
         return self._sliceSimData(islice)
 
+    def getSliceIndex(self):
+        """Return the simData indexes for all slicePoints, as a compressed sparse row (CSR) slice index.
+
+        The simData indexes relevant for slicePoint i are indices[indexPtr[i]:indexPtr[i+1]].
+        This generic version steps through every slicePoint; slicers which can build the index
+        more efficiently should override this method.
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray
+            indexPtr (length nslice + 1) and indices.
+        """
+        idxsList = []
+        for islice in range(self.nslice):
+            idxs = np.asarray(self._sliceSimData(islice)['idxs'])
+            if idxs.dtype == bool:
+                idxs = np.where(idxs)[0]
+            idxsList.append(idxs.astype(int))
+        indexPtr = np.zeros(self.nslice + 1, int)
+        indexPtr[1:] = np.cumsum([len(idxs) for idxs in idxsList])
+        if len(idxsList) > 0:
+            indices = np.concatenate(idxsList)
+        else:
+            indices = np.array([], int)
+        return indexPtr, indices
+
     def __eq__(self, otherSlicer):
         """
         Evaluate if two slicers are equivalent.
@@ -6,16 +6,18 @@ from builtins import range
 # The primary things added here are the methods to slice the data (for any spatial slicer)
 #  as this uses a KD-tree built on spatial (RA/Dec type) indexes.
 
+import os
+import glob
 import warnings
+import hashlib
+import itertools
 import numpy as np
 from functools import wraps
 from scipy.spatial import cKDTree as kdtree
 from lsst.sims.maf.plots.spatialPlotters import BaseHistogram, BaseSkyMap
 
 # For the footprint generation and conversion between galactic/equatorial coordinates.
-from lsst.obs.lsstSim import LsstSimMapper
-from lsst.sims.coordUtils import _chipNameFromRaDec
-from lsst.sims.utils import ObservationMetaData
+from lsst.sims.maf.utils.mafUtils import gnomonic_project_toxy
 
 from .baseSlicer import BaseSlicer
 
@@ -60,11 +62,20 @@ class BaseSpatialSlicer(BaseSlicer):
     chipNames : array-like, optional
         List of chips to accept, if useCamera is True. This lets users turn 'on' only a subset of chips.
         Default 'all' - this uses all chips in the camera.
+    indexCacheDir : str, optional
+        Directory in which to save the slice index (as memory-mappable .npy files), so that it can
+        be loaded instead of recalculated in later runs with the same pointings and slicer
+        configuration (e.g. a subdirectory of the MAF outDir). See also clearIndexCache.
+        Default None (slice indexes are not saved to disk).
+    chipMaskResolution : float, optional
+        Resolution (arcseconds) of the rasterized camera footprint, used instead of the full camera
+        model for each pointing when there are many (slicePoint, pointing) matches to check, if useCamera
+        is True. Chip edges are located to about this accuracy. Default 10.
     """
     def __init__(self, lonCol='fieldRA', latCol='fieldDec', latLonDeg=True,
                  verbose=True, badval=-666, leafsize=100, radius=1.75,
                  useCamera=False, rotSkyPosColName='rotSkyPos', mjdColName='observationStartMJD',
-                 chipNames='all'):
+                 chipNames='all', indexCacheDir=None, chipMaskResolution=10.0):
         super(BaseSpatialSlicer, self).__init__(verbose=verbose, badval=badval)
         self.lonCol = lonCol
         self.latCol = latCol
@@ -83,6 +94,8 @@ class BaseSpatialSlicer(BaseSlicer):
         self.leafsize = leafsize
         self.useCamera = useCamera
         self.chipsToUse = chipNames
+        self.indexCacheDir = indexCacheDir
+        self.chipMaskResolution = chipMaskResolution
         # RA and Dec are required slicePoint info for any spatial slicer. Slicepoint RA/Dec are in radians.
         self.slicePoints['sid'] = None
         self.slicePoints['ra'] = None
@@ -91,8 +104,13 @@ class BaseSpatialSlicer(BaseSlicer):
         self.shape = None
         self.plotFuncs = [BaseHistogram, BaseSkyMap]
 
-    def setupSlicer(self, simData, maps=None):
-        """Use simData[self.lonCol] and simData[self.latCol] (in radians) to set up KDTree.
+    def setupSlicer(self, simData, maps=None, sliceIndexCache=None):
+        """Use simData[self.lonCol] and simData[self.latCol] (in radians) to set up the slice index.
+
+        The simData indexes relevant for every slicePoint are found at once (using a KDTree, or the
+        camera footprint if useCamera is True) and stored as compact CSR arrays
+        (self.sliceIndexPtr, self.sliceIndices). Slice indexes are read from (or written to)
+        self.indexCacheDir if set.
 
         Parameters
         -----------
@@ -102,22 +120,31 @@ class BaseSpatialSlicer(BaseSlicer):
             List of maps (such as dust extinction) that will run to build up additional metadata at each
             slicePoint. This additional metadata is available to metrics via the slicePoint dictionary.
             Default None.
+        sliceIndexCache : dict, optional
+            Slice indexes already built for this simData, keyed by slice index key (such as the dictionary
+            held by a MetricBundleGroup for its current simData). An equivalent slicer's slice index is
+            reused from here, and the new slice index is added to it.
+            Default None (the slice index is not shared with other slicers in memory).
         """
         if maps is not None:
-            if self.cacheSize != 0 and len(maps) > 0:
-                warnings.warn('Warning:  Loading maps but cache on.'
-                              'Should probably set useCache=False in slicer.')
+            # Note that the MetricBundleGroup does not cache metric values when maps are used.
             self._runMaps(maps)
         self._setRad(self.radius)
-        if self.useCamera:
-            self._setupLSSTCamera()
-            self._presliceFootprint(simData)
+        key = self._sliceIndexKey(simData)
+        if sliceIndexCache is not None and key in sliceIndexCache:
+            (self.sliceIndexPtr, self.sliceIndices,
+             self.chipIds, self.chipNameList) = sliceIndexCache[key]
         else:
-            if self.latLonDeg:
-                self._buildTree(np.radians(simData[self.lonCol]),
-                                np.radians(simData[self.latCol]), self.leafsize)
-            else:
-                self._buildTree(simData[self.lonCol], simData[self.latCol], self.leafsize)
+            if not self._readSliceIndex(key):
+                if self.useCamera:
+                    self._setupLSSTCamera()
+                    self._presliceFootprint(simData)
+                else:
+                    self._presliceRadius(simData)
+                self._writeSliceIndex(key)
+            if sliceIndexCache is not None:
+                sliceIndexCache[key] = (self.sliceIndexPtr, self.sliceIndices,
+                                        self.chipIds, self.chipNameList)
 
         @wraps(self._sliceSimData)
         def _sliceSimData(islice):
@@ -126,14 +153,10 @@ class BaseSpatialSlicer(BaseSlicer):
 
             # Build dict for slicePoint info
             slicePoint = {}
+            indices = self.sliceIndices[self.sliceIndexPtr[islice]:self.sliceIndexPtr[islice + 1]]
             if self.useCamera:
-                indices = self.sliceLookup[islice]
-                slicePoint['chipNames'] = self.chipNames[islice]
-            else:
-                sx, sy, sz = self._treexyz(self.slicePoints['ra'][islice],
-                                           self.slicePoints['dec'][islice])
-                # Query against tree.
-                indices = self.opsimtree.query_ball_point((sx, sy, sz), self.rad)
+                chipIds = self.chipIds[self.sliceIndexPtr[islice]:self.sliceIndexPtr[islice + 1]]
+                slicePoint['chipNames'] = self.chipNameList[chipIds]
 
             # Loop through all the slicePoint keys. If the first dimension of slicepoint[key] has
             # the same shape as the slicer, assume it is information per slicepoint.
@@ -151,58 +174,377 @@ class BaseSpatialSlicer(BaseSlicer):
             return {'idxs': indices, 'slicePoint': slicePoint}
         setattr(self, '_sliceSimData', _sliceSimData)
 
+    def getSliceIndex(self):
+        """Return the simData indexes for all slicePoints, as a compressed sparse row (CSR) slice index.
+
+        The simData indexes relevant for slicePoint i are indices[indexPtr[i]:indexPtr[i+1]].
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray
+            indexPtr (length nslice + 1) and indices.
+        """
+        if not hasattr(self, 'sliceIndexPtr'):
+            return super(BaseSpatialSlicer, self).getSliceIndex()
+        return self.sliceIndexPtr, self.sliceIndices
+
+    def _sliceIndexKey(self, simData):
+        """Generate a key identifying the slice index that would be built for simData.
+
+        The key depends on the pointing (and, if using the camera, rotation/time) columns of simData,
+        the slicePoint locations and the matching parameters of the slicer.
+        """
+        h = hashlib.sha1()
+        cols = [self.lonCol, self.latCol]
+        if self.useCamera:
+            cols += [self.rotSkyPosColName, self.mjdColName]
+        for col in cols:
+            h.update(np.ascontiguousarray(simData[col]).view(np.uint8))
+        h.update(np.ascontiguousarray(self.slicePoints['ra']).view(np.uint8))
+        h.update(np.ascontiguousarray(self.slicePoints['dec']).view(np.uint8))
+        h.update(repr((self.latLonDeg, self.radius, self.useCamera, self.chipsToUse,
+                       self.chipMaskResolution)).encode('utf-8'))
+        return h.hexdigest()
+
+    def _indexCacheFiles(self, key):
+        """Return the filenames used to save the slice index identified by key."""
+        root = os.path.join(self.indexCacheDir, 'sliceIndex_%s' % key)
+        return {'indexPtr': root + '_indexPtr.npy', 'indices': root + '_indices.npy',
+                'chipIds': root + '_chipIds.npy', 'chipNameList': root + '_chipNameList.npy'}
+
+    def _readSliceIndex(self, key):
+        """Read the slice index identified by key from self.indexCacheDir, if available.
+
+        The arrays are memory-mapped, rather than read into memory.
+
+        Returns
+        -------
+        bool
+            True if the slice index was read.
+        """
+        if self.indexCacheDir is None:
+            return False
+        files = self._indexCacheFiles(key)
+        # The indexPtr file is written last, so its presence indicates a complete slice index.
+        if not os.path.isfile(files['indexPtr']):
+            return False
+        self.sliceIndexPtr = np.load(files['indexPtr'], mmap_mode='r')
+        self.sliceIndices = np.load(files['indices'], mmap_mode='r')
+        if self.useCamera:
+            self.chipIds = np.load(files['chipIds'], mmap_mode='r')
+            self.chipNameList = np.load(files['chipNameList'])
+        else:
+            self.chipIds = None
+            self.chipNameList = None
+        if self.verbose:
+            print('Read slice index from %s' % files['indexPtr'])
+        return True
+
+    def _writeSliceIndex(self, key):
+        """Save the slice index identified by key into self.indexCacheDir (if set)."""
+        if self.indexCacheDir is None:
+            return
+        if not os.path.isdir(self.indexCacheDir):
+            os.makedirs(self.indexCacheDir)
+        files = self._indexCacheFiles(key)
+        arrays = [('indices', self.sliceIndices), ('indexPtr', self.sliceIndexPtr)]
+        if self.useCamera:
+            arrays = [('chipIds', self.chipIds), ('chipNameList', self.chipNameList)] + arrays
+        for name, arr in arrays:
+            # Write to a temporary file and rename, so concurrent runs never read a partial file.
+            tmpfile = files[name] + '.%d.tmp' % os.getpid()
+            with open(tmpfile, 'wb') as f:
+                np.save(f, arr)
+            os.rename(tmpfile, files[name])
+
+    def clearIndexCache(self):
+        """Remove all saved slice indexes from self.indexCacheDir, and forget this slicer's slice index.
+
+        Use this to force the slice index to be recalculated (e.g. after changing the camera model).
+        """
+        if self.indexCacheDir is not None:
+            for filename in glob.glob(os.path.join(self.indexCacheDir, 'sliceIndex_*.npy')):
+                os.remove(filename)
+        for attr in ('sliceIndexPtr', 'sliceIndices', 'chipIds', 'chipNameList'):
+            if hasattr(self, attr):
+                delattr(self, attr)
+
+    def _listsToSliceIndex(self, sliceLists, dtype):
+        """Convert a list of simData indexes per slicePoint into counts per slicePoint and the
+        concatenated indexes."""
+        counts = np.fromiter((len(idxs) for idxs in sliceLists), dtype=np.int64, count=len(sliceLists))
+        indices = np.fromiter(itertools.chain.from_iterable(sliceLists), dtype=dtype, count=counts.sum())
+        return counts, indices
+
+    def _indexDtype(self, nvisits):
+        """Use 32 bit indexes into simData where possible, to keep the slice index compact."""
+        if nvisits < np.iinfo(np.int32).max:
+            return np.int32
+        return np.int64
+
+    def _setSliceIndex(self, counts, indices):
+        """Set the CSR slice index arrays from the number of simData indexes per slicePoint
+        and the concatenated simData indexes."""
+        self.sliceIndexPtr = np.zeros(len(counts) + 1, np.int64)
+        np.cumsum(counts, out=self.sliceIndexPtr[1:])
+        self.sliceIndices = indices
+
+    def _presliceRadius(self, simData, blockSize=10000):
+        """Find the simData pointings within self.rad of every slicePoint, and store as a CSR slice index.
+
+        The kdtree on simData is queried with blocks of slicePoints at a time (rather than once per
+        slicePoint at iteration time).
+        """
+        if self.latLonDeg:
+            self._buildTree(np.radians(simData[self.lonCol]),
+                            np.radians(simData[self.latCol]), self.leafsize)
+        else:
+            self._buildTree(simData[self.lonCol], simData[self.latCol], self.leafsize)
+        dtype = self._indexDtype(len(simData))
+        sx, sy, sz = self._treexyz(self.slicePoints['ra'], self.slicePoints['dec'])
+        sxyz = np.column_stack([sx, sy, sz])
+        counts = []
+        indices = []
+        for start in range(0, self.nslice, blockSize):
+            sliceLists = self.opsimtree.query_ball_point(sxyz[start:start + blockSize], self.rad)
+            c, i = self._listsToSliceIndex(sliceLists, dtype)
+            counts.append(c)
+            indices.append(i)
+        self._setSliceIndex(np.concatenate(counts), np.concatenate(indices))
+        self.chipIds = None
+        self.chipNameList = None
+
     def _setupLSSTCamera(self):
         """If we want to include the camera chip gaps, etc"""
+        # The camera packages are slow to import, so are only imported when they are needed.
+        from lsst.obs.lsstSim import LsstSimMapper
         mapper = LsstSimMapper()
         self.camera = mapper.camera
         self.epoch = 2000.0
 
-    def _presliceFootprint(self, simData):
-        """Loop over each pointing and find which sky points are observed """
-        # Now to make a list of lists for looking up the relevant observations at each slicepoint
-        self.sliceLookup = [[] for dummy in range(self.nslice)]
-        self.chipNames = [[] for dummy in range(self.nslice)]
+    def _chipNamesAt(self, ra, dec, pointingRa, pointingDec, rotSkyPos, mjd, blockSize=100000):
+        """Return the chip names (None if off the camera) for points ra/dec (radians),
+        for a single pointing (pointingRa/pointingDec/rotSkyPos in radians)."""
+        from lsst.sims.coordUtils import _chipNameFromRaDec
+        from lsst.sims.utils import ObservationMetaData
+        obs_metadata = ObservationMetaData(pointingRA=np.degrees(pointingRa),
+                                           pointingDec=np.degrees(pointingDec),
+                                           rotSkyPos=np.degrees(rotSkyPos),
+                                           mjd=mjd)
+        chipNames = []
+        for start in range(0, len(ra), blockSize):
+            chipNames.append(_chipNameFromRaDec(ra[start:start + blockSize], dec[start:start + blockSize],
+                                                epoch=self.epoch, camera=self.camera,
+                                                obs_metadata=obs_metadata))
+        return np.concatenate(chipNames)
+
+    def _gnomonicToRaDec(self, x, y, raCen, decCen):
+        """Invert gnomonic_project_toxy: return the RA/Dec (radians) of gnomonic x/y values
+        in a projection centered at raCen/decCen."""
+        denom = np.cos(decCen) - y * np.sin(decCen)
+        ra = (raCen + np.arctan2(x, denom)) % (2.0 * np.pi)
+        dec = np.arctan2(np.sin(decCen) + y * np.cos(decCen), np.sqrt(x**2 + denom**2))
+        return ra, dec
+
+    def _rasterChipNames(self, halfWidth, step, refRa, refDec, refRot, refMjd):
+        """Return the gnomonic x/y values of a square raster (of half width halfWidth and pixel size step)
+        around a reference pointing, and the chip names at each pixel from the camera model."""
+        nPix = int(np.ceil(2.0 * halfWidth / step))
+        centers = -halfWidth + (np.arange(nPix) + 0.5) * step
+        x, y = np.meshgrid(centers, centers)
+        x = x.ravel()
+        y = y.ravel()
+        ra, dec = self._gnomonicToRaDec(x, y, refRa, refDec)
+        return x, y, self._chipNamesAt(ra, dec, refRa, refDec, refRot, refMjd)
+
+    def _buildChipMask(self, refRa, refDec, refRot, refMjd, coarseResolution=60.0):
+        """Rasterize the camera footprint into a grid of chip ids in gnomonic x/y coordinates.
+
+        The raster is built once, using the full camera model for a reference pointing; the chip
+        for any other pointing is then found by rotating its gnomonic coordinates by the difference
+        in rotSkyPos and looking up the raster (see _lookupChips). This is accurate to about
+        self.chipMaskResolution (arcseconds) at the chip edges, plus the (small) differences in
+        the camera model between the reference pointing/time and the other pointings.
+        The raster only covers the extent of the camera, found from a coarse raster (at
+        coarseResolution arcseconds) within self.radius.
+        """
+        # Find the extent of the camera (for any rotation) from a coarse raster.
+        halfWidth = np.tan(np.radians(self.radius))
+        coarseStep = np.radians(coarseResolution / 3600.0)
+        x, y, chipNames = self._rasterChipNames(halfWidth, coarseStep, refRa, refDec, refRot, refMjd)
+        onChip = np.array([chipName is not None for chipName in chipNames])
+        if not onChip.any():
+            raise ValueError('The camera footprint does not fall within radius %.2f degrees.' % self.radius)
+        halfWidth = min(halfWidth, np.sqrt(x[onChip]**2 + y[onChip]**2).max() + 2.0 * coarseStep)
+        self.chipMaskHalfWidth = halfWidth
+        self.chipMaskStep = np.radians(self.chipMaskResolution / 3600.0)
+        x, y, chipNames = self._rasterChipNames(self.chipMaskHalfWidth, self.chipMaskStep,
+                                                refRa, refDec, refRot, refMjd)
+        nPix = int(np.sqrt(len(x)))
+        # Translate chip names to chip ids (-1 if not on a chip), using all chips for now.
+        onChip = np.array([chipName is not None for chipName in chipNames])
+        self.chipNameList, chipIds = np.unique(chipNames[onChip].astype(str), return_inverse=True)
+        self.chipMask = np.zeros(nPix * nPix, np.int16) - 1
+        self.chipMask[onChip] = chipIds
+        self.chipMask = self.chipMask.reshape(nPix, nPix)
+        self._calibrateChipRotation(x, y, refRa, refDec, refRot, refMjd)
+        # Then turn off the chips which are not in use.
+        if self.chipsToUse != 'all':
+            keep = np.array([chipName in self.chipsToUse for chipName in self.chipNameList])
+            newIds = np.cumsum(keep) - 1
+            newIds[~keep] = -1
+            self.chipMask = np.where(self.chipMask >= 0, newIds[np.maximum(self.chipMask, 0)],
+                                     -1).astype(np.int16)
+            self.chipNameList = self.chipNameList[keep]
+
+    def _calibrateChipRotation(self, x, y, refRa, refDec, refRot, refMjd, nTest=2000, minMatch=0.9):
+        """Determine the sense of the camera rotation with rotSkyPos (self.chipRotSign), by comparing
+        the (all chip) raster lookup against the camera model for a rotated version of the reference pointing.
+
+        Only raster pixels within the circle covered by the raster for any rotation are tested, and
+        only those on a chip in either the lookup or the camera model are compared.
+        Raises a ValueError if neither sense of rotation matches the camera model for at least
+        a fraction minMatch of these test points.
+        """
+        rng = np.random.RandomState(42)
+        candidates = np.where(x**2 + y**2 < self.chipMaskHalfWidth**2)[0]
+        testIdx = rng.choice(candidates, min(nTest, len(candidates)), replace=False)
+        x = x[testIdx]
+        y = y[testIdx]
+        ra, dec = self._gnomonicToRaDec(x, y, refRa, refDec)
+        rotOffset = np.radians(30.0)
+        testNames = self._chipNamesAt(ra, dec, refRa, refDec, refRot + rotOffset, refMjd)
+        testNames = np.array([str(chipName) for chipName in testNames])
+        matches = []
+        for sign in (1.0, -1.0):
+            chipIds = self._lookupChips(x, y, sign * rotOffset)
+            names = np.where(chipIds >= 0, self.chipNameList[np.maximum(chipIds, 0)], 'None')
+            compare = (names != 'None') | (testNames != 'None')
+            matches.append(np.sum(names[compare] == testNames[compare]) / float(max(compare.sum(), 1)))
+        if max(matches) < minMatch:
+            raise ValueError('Could not match the rotation of the rasterized camera footprint to the camera '
+                             'model (matched fractions %.2f and %.2f).' % (matches[0], matches[1]))
+        self.chipRotSign = 1.0 if matches[0] >= matches[1] else -1.0
+
+    def _lookupChips(self, x, y, rotation):
+        """Return the chip ids (-1 if off the camera) at gnomonic x/y, after rotating by 'rotation'
+        (radians) into the frame of the chip mask raster."""
+        cosr = np.cos(rotation)
+        sinr = np.sin(rotation)
+        u = x * cosr - y * sinr
+        v = x * sinr + y * cosr
+        nPix = self.chipMask.shape[0]
+        ix = np.floor((u + self.chipMaskHalfWidth) / self.chipMaskStep).astype(np.int64)
+        iy = np.floor((v + self.chipMaskHalfWidth) / self.chipMaskStep).astype(np.int64)
+        inside = (ix >= 0) & (ix < nPix) & (iy >= 0) & (iy < nPix)
+        chipIds = np.zeros(len(x), np.int16) - 1
+        chipIds[inside] = self.chipMask[iy[inside], ix[inside]]
+        return chipIds
+
+    def _presliceFootprint(self, simData, blockSize=10000, useChipMask=None):
+        """Find which slicePoints fall on a chip in each pointing, and store as a CSR slice index.
+
+        The slicePoints within the field of view of each pointing are found with a kdtree (on the
+        slicePoints). Their chips are found either with the camera model for each pointing
+        (see _footprintCameraModel), or by looking them up in a rasterized chip mask
+        (see _footprintChipMask). The chip mask is used (if useChipMask is None) when the expected
+        number of (slicePoint, pointing) matches is larger than the number of pixels in the chip mask.
+        The chip id of each (slicePoint, pointing) match is stored in self.chipIds, aligned with
+        self.sliceIndices; self.chipNameList translates chip ids to chip names.
+        """
         # Make a kdtree for the _slicepoints_
-        # Using scipy 0.16 or later
         self._buildTree(self.slicePoints['ra'], self.slicePoints['dec'], leafsize=self.leafsize)
-
-        # Loop over each unique pointing position
         if self.latLonDeg:
             lat = np.radians(simData[self.latCol])
             lon = np.radians(simData[self.lonCol])
         else:
             lat = simData[self.latCol]
             lon = simData[self.lonCol]
-        for ind, ra, dec, rotSkyPos, mjd in zip(np.arange(simData.size), lon, lat,
-                                                simData[self.rotSkyPosColName], simData[self.mjdColName]):
-            dx, dy, dz = self._treexyz(ra, dec)
-            # Find healpixels inside the FoV
-            hpIndices = np.array(self.opsimtree.query_ball_point((dx, dy, dz), self.rad))
-            if hpIndices.size > 0:
-                obs_metadata = ObservationMetaData(pointingRA=np.degrees(ra),
-                                                   pointingDec=np.degrees(dec),
-                                                   rotSkyPos=np.degrees(rotSkyPos),
-                                                   mjd=mjd)
-
-                chipNames = _chipNameFromRaDec(self.slicePoints['ra'][hpIndices],
-                                               self.slicePoints['dec'][hpIndices],
-                                               epoch=self.epoch,
-                                               camera=self.camera, obs_metadata=obs_metadata)
-                # If we are using only a subset of chips
-                if self.chipsToUse != 'all':
-                    checkedChipNames = [chipName in self.chipsToUse for chipName in chipNames]
-                    good = np.where(checkedChipNames)[0]
-                    chipNames = chipNames[good]
-                    hpIndices = hpIndices[good]
-                # Find the healpixels that fell on a chip for this pointing
-                good = np.where(chipNames != [None])[0]
-                hpOnChip = hpIndices[good]
-                for i, chipName in zip(hpOnChip, chipNames[good]):
-                    self.sliceLookup[i].append(ind)
-                    self.chipNames[i].append(chipName)
-
+        if useChipMask is None:
+            nMatches = simData.size * self.nslice * (1.0 - np.cos(np.radians(self.radius))) / 2.0
+            nPixels = (2.0 * np.tan(np.radians(self.radius)) / np.radians(self.chipMaskResolution / 3600.0))**2
+            useChipMask = nMatches > nPixels
+        if useChipMask:
+            hps, visits, chips = self._footprintChipMask(simData, lon, lat, blockSize)
+        else:
+            hps, visits, chips = self._footprintCameraModel(simData, lon, lat)
+        # Stable sort on healpixel, so that the pointings remain in order within each slicePoint.
+        order = np.argsort(hps, kind='mergesort')
+        counts = np.bincount(hps, minlength=self.nslice)
+        self._setSliceIndex(counts, visits[order].astype(self._indexDtype(len(simData))))
+        self.chipIds = chips[order]
         if self.verbose:
-            "Created lookup table after checking for chip gaps."
+            print("Created lookup table after checking for chip gaps.")
+
+    def _footprintCameraModel(self, simData, lon, lat):
+        """Find the chip of the slicePoints within the field of view of each pointing, using the
+        camera model for each pointing in turn.
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray, numpy.ndarray
+            The slicePoint, simData index and chip id of each slicePoint on a chip in a pointing.
+        """
+        hps = []
+        visits = []
+        names = []
+        for ind in range(simData.size):
+            dx, dy, dz = self._treexyz(lon[ind], lat[ind])
+            hpIndices = np.array(self.opsimtree.query_ball_point((dx, dy, dz), self.rad), np.int64)
+            if hpIndices.size == 0:
+                continue
+            chipNames = self._chipNamesAt(self.slicePoints['ra'][hpIndices],
+                                          self.slicePoints['dec'][hpIndices],
+                                          lon[ind], lat[ind], simData[self.rotSkyPosColName][ind],
+                                          simData[self.mjdColName][ind])
+            good = np.array([chipName is not None for chipName in chipNames])
+            if self.chipsToUse != 'all':
+                good &= np.array([chipName in self.chipsToUse for chipName in chipNames])
+            hps.append(hpIndices[good])
+            visits.append(np.zeros(good.sum(), np.int64) + ind)
+            names.append(chipNames[good].astype(str))
+        if len(hps) == 0:
+            self.chipNameList = np.array([], str)
+            return np.array([], np.int64), np.array([], np.int64), np.array([], np.int16)
+        self.chipNameList, chips = np.unique(np.concatenate(names), return_inverse=True)
+        return np.concatenate(hps), np.concatenate(visits), chips.astype(np.int16)
+
+    def _footprintChipMask(self, simData, lon, lat, blockSize):
+        """Find the chip of the slicePoints within the field of view of each pointing, using
+        a rasterized chip mask built for the first pointing (see _buildChipMask).
+
+        Pointings are processed in blocks: the slicePoints within the field of view of each pointing
+        are projected into the gnomonic frame of the pointing, and their chip is looked up in the mask.
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray, numpy.ndarray
+            The slicePoint, simData index and chip id of each slicePoint on a chip in a pointing.
+        """
+        rotSkyPos = simData[self.rotSkyPosColName]
+        mjd = simData[self.mjdColName]
+        self._buildChipMask(lon[0], lat[0], rotSkyPos[0], mjd[0])
+        dx, dy, dz = self._treexyz(lon, lat)
+        dxyz = np.column_stack([dx, dy, dz])
+        hps = []
+        visits = []
+        chips = []
+        for start in range(0, simData.size, blockSize):
+            stop = min(start + blockSize, simData.size)
+            # Find healpixels inside the FoV of each pointing in this block.
+            counts, hpIdx = self._listsToSliceIndex(self.opsimtree.query_ball_point(dxyz[start:stop],
+                                                                                    self.rad), np.int64)
+            visitIdx = np.repeat(np.arange(start, stop), counts)
+            x, y = gnomonic_project_toxy(self.slicePoints['ra'][hpIdx], self.slicePoints['dec'][hpIdx],
+                                         lon[visitIdx], lat[visitIdx])
+            chipIds = self._lookupChips(x, y, self.chipRotSign * (rotSkyPos[visitIdx] - rotSkyPos[0]))
+            # Keep the healpixels that fell on a chip for each pointing.
+            good = np.where(chipIds >= 0)[0]
+            hps.append(hpIdx[good])
+            visits.append(visitIdx[good])
+            chips.append(chipIds[good])
+        del self.chipMask
+        return np.concatenate(hps), np.concatenate(visits), np.concatenate(chips)
 
     def _treexyz(self, ra, dec):
         """Calculate x/y/z values for ra/dec points, ra/dec in radians."""
@@ -220,7 +562,7 @@ class BaseSpatialSlicer(BaseSlicer):
         if np.any(np.abs(simDataRa) > np.pi*2.0) or np.any(np.abs(simDataDec) > np.pi*2.0):
             raise ValueError('Expecting RA and Dec values to be in radians.')
         x, y, z = self._treexyz(simDataRa, simDataDec)
-        data = list(zip(x, y, z))
+        data = np.column_stack([x, y, z])
         if np.size(data) > 0:
             try:
                 self.opsimtree = kdtree(data, leafsize=leafsize, balanced_tree=False, compact_nodes=False)
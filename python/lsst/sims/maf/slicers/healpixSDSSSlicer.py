@@ -19,10 +19,11 @@ class HealpixSDSSSlicer(HealpixSlicer):
         self.cornerLables = ['RA1', 'Dec1', 'RA2','Dec2','RA3','Dec3','RA4','Dec4']
         self.plotFuncs = [HealpixSDSSSkyMap,]
 
-    def setupSlicer(self, simData, maps=None):
+    def setupSlicer(self, simData, maps=None, sliceIndexCache=None):
         """
         Use simData[self.lonCol] and simData[self.latCol]
         (in radians) to set up KDTree.
+        (This slicer does not build a slice index, so sliceIndexCache is ignored.)
         """
         self._runMaps(maps)
         self._buildTree(simData[self.lonCol], simData[self.latCol], self.leafsize)
@@ -65,18 +65,26 @@ class HealpixSlicer(BaseSpatialSlicer):
     chipNames : array-like, optional
         List of chips to accept, if useCamera is True. This lets users turn 'on' only a subset of chips.
         Default 'all' - this uses all chips in the camera.
+    indexCacheDir : str, optional
+        Directory in which to save (and from which to reuse) the slice index.
+        Default None (slice indexes are not saved to disk).
+    chipMaskResolution : float, optional
+        Resolution (arcseconds) of the rasterized camera footprint, if useCamera is True. Default 10.
     """
     def __init__(self, nside=128, lonCol ='fieldRA',
                  latCol='fieldDec', latLonDeg=True, verbose=True, badval=hp.UNSEEN,
                  useCache=True, leafsize=100, radius=1.75,
                  useCamera=False, rotSkyPosColName='rotSkyPos',
-                 mjdColName='observationStartMJD', chipNames='all'):
+                 mjdColName='observationStartMJD', chipNames='all', indexCacheDir=None,
+                 chipMaskResolution=10.0):
         """Instantiate and set up healpix slicer object."""
         super(HealpixSlicer, self).__init__(verbose=verbose,
                                             lonCol=lonCol, latCol=latCol,
                                             badval=badval, radius=radius, leafsize=leafsize,
                                             useCamera=useCamera, rotSkyPosColName=rotSkyPosColName,
-                                            mjdColName=mjdColName, chipNames=chipNames, latLonDeg=latLonDeg)
+                                            mjdColName=mjdColName, chipNames=chipNames, latLonDeg=latLonDeg,
+                                            indexCacheDir=indexCacheDir,
+                                            chipMaskResolution=chipMaskResolution)
         # Valid values of nside are powers of 2.
         # nside=64 gives about 1 deg resolution
         # nside=256 gives about 13' resolution (~1 CCD)
@@ -1,3 +1,6 @@
+import os
+import json
+import shutil
 import numpy as np
 import numpy.ma as ma
 import pandas as pd
@@ -20,16 +23,21 @@ class MoObjSlicer(BaseSlicer):
     """
     def __init__(self, verbose=True, badval=0):
         super(MoObjSlicer, self).__init__(verbose=verbose, badval=badval)
+        self.obsIndex = None
+        self.chunkSize = None
         # Set default plotFuncs.
         self.plotFuncs = [MetricVsH(),
                           MetricVsOrbit(xaxis='q', yaxis='e'),
                           MetricVsOrbit(xaxis='q', yaxis='inc')]
 
-    def readOrbits(self, orbitFile, Hrange, delim=None, skiprows=None):
+    def readOrbits(self, orbitFile, Hrange, delim=None, skiprows=None, useCache=False):
         # Use sims_movingObjects to read orbit files.
+        # useCache keeps a binary copy of the validated orbits alongside orbitFile (see Orbits.readOrbits).
         orb = Orbits()
-        orb.readOrbits(orbitFile, delim=delim, skiprows=skiprows)
+        orb.readOrbits(orbitFile, delim=delim, skiprows=skiprows, useCache=useCache)
         self.orbits = orb.orbits
+        # The recarray of orbits gives fast access to the orbit of each object, while slicing.
+        self.orbitArray = orb.orbitArray
         # Then go on as previously. Need to refactor this into 'setupSlicer' style.
         self.nSso = len(self.orbits)
         self.slicePoints = {}
@@ -45,60 +53,330 @@ class MoObjSlicer(BaseSlicer):
             self.slicePoints['H'] = self.orbits['H']
         # Set the rest of the slicePoint information once
         self.nslice = self.shape[0] * self.shape[1]
+        # The observations must be matched to the new orbits.
+        self.obsIndex = None
 
-    def readObs(self, obsfile):
+    def readObs(self, obsfile, chunkSize=None, useSidecar=False):
         """
         Read observations created by moObs.
+
+        Parameters
+        ----------
+        obsfile : str
+            The (whitespace delimited) file of observations.
+        chunkSize : int, opt
+            If None (default), all of the observations are read into memory now.
+            Otherwise, the observations are read later, in chunks of about chunkSize observations,
+            one chunk at a time while the metric values are calculated (see iterObsChunks).
+            This requires the observations of each object to be contiguous in obsfile (as written by moObs).
+        useSidecar : bool, opt
+            If True, a binary copy of the observations is saved alongside obsfile
+            (in the directory '<obsfile>.chunks') the first time it is read, and is read instead of
+            parsing obsfile the next time. The copy is rewritten if obsfile changes.
+            If the copy cannot be written (e.g. in a read-only directory), obsfile is still read.
+            Default False.
         """
-        # For now, just read all the observations (should be able to chunk this though).
         self.obsfile = obsfile
-        self.allObs = pd.read_table(obsfile, delim_whitespace=True)
+        self.chunkSize = chunkSize
+        self.useSidecar = useSidecar
+        if self.chunkSize is None:
+            self.allObs = pd.concat(list(self._readObsChunks()), ignore_index=True)
+        else:
+            self.allObs = None
+        self.subsetObs()
+
+    def _postprocessObs(self, obs):
+        """Fix up the column names and add the columns needed by the moving object metrics."""
         # We may have to rename the first column from '#objId' to 'objId'.
-        if self.allObs.columns.values[0].startswith('#'):
-            newcols = self.allObs.columns.values
+        if obs.columns.values[0].startswith('#'):
+            newcols = obs.columns.values
             newcols[0] = newcols[0].replace('#', '')
-            self.allObs.columns = newcols
-        if 'magFilter' not in self.allObs.columns.values:
-            self.allObs['magFilter'] = self.allObs['magV'] + self.allObs['dmagColor']
-        if 'velocity' not in self.allObs.columns.values:
-            self.allObs['velocity'] = np.sqrt(self.allObs['dradt']**2 + self.allObs['ddecdt']**2)
-        if 'visitExpTime' not in self.allObs.columns.values:
-            self.allObs['visitExpTime'] = np.zeros(len(self.allObs['objId']), float) + 30.0
+            obs.columns = newcols
+        if 'magFilter' not in obs.columns.values:
+            obs['magFilter'] = obs['magV'] + obs['dmagColor']
+        if 'velocity' not in obs.columns.values:
+            obs['velocity'] = np.sqrt(obs['dradt']**2 + obs['ddecdt']**2)
+        if 'visitExpTime' not in obs.columns.values:
+            obs['visitExpTime'] = np.zeros(len(obs['objId']), float) + 30.0
         # If we created intermediate data products by pandas, we may have an inadvertent 'index'
         #  column. Since this creates problems later, drop it here.
-        if 'index' in self.allObs.columns.values:
-            self.allObs.drop('index', axis=1, inplace=True)
-        self.subsetObs()
+        if 'index' in obs.columns.values:
+            obs.drop('index', axis=1, inplace=True)
+        return obs
+
+    def _sidecarDir(self):
+        return self.obsfile + '.chunks'
+
+    def _sidecarSource(self):
+        """Identify the state of obsfile, to detect when the sidecar is stale."""
+        stat = os.stat(self.obsfile)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def _readSidecar(self):
+        """Return the chunk files of the sidecar, or None if it is missing or out of date."""
+        try:
+            with open(os.path.join(self._sidecarDir(), 'manifest.json'), 'r') as f:
+                manifest = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if manifest.get('source') != self._sidecarSource():
+            return None
+        return [os.path.join(self._sidecarDir(), chunkfile) for chunkfile in manifest['chunks']]
+
+    def _toRecords(self, obs):
+        """Convert a DataFrame to a structured array without python objects, so it can be saved."""
+        obsArray = obs.to_records(index=False)
+        dtype = []
+        for name in obsArray.dtype.names:
+            if obsArray.dtype[name] == 'object':
+                dtype.append((name, np.array([str(v) for v in obsArray[name]]).dtype))
+            else:
+                dtype.append((name, obsArray.dtype[name]))
+        return np.array(obsArray, dtype=dtype)
+
+    def _readObsPieces(self, readSize):
+        """
+        Generator of the observations (as DataFrames of up to readSize rows), in the order of obsfile.
+
+        The observations are read from the sidecar if possible; otherwise obsfile is parsed
+        (and the sidecar written as it goes, if useSidecar is True).
+        """
+        chunkfiles = None
+        if self.useSidecar:
+            chunkfiles = self._readSidecar()
+        if chunkfiles is not None:
+            for chunkfile in chunkfiles:
+                obsArray = np.load(chunkfile, mmap_mode='r')
+                for start in range(0, len(obsArray), readSize):
+                    yield pd.DataFrame(np.array(obsArray[start:start + readSize]))
+            return
+        tmpDir = None
+        if self.useSidecar:
+            tmpDir = '%s.tmp%d' % (self._sidecarDir(), os.getpid())
+            chunkfiles = []
+        try:
+            if tmpDir is not None:
+                # (Any leftover directory with this name is from an earlier process with the same pid).
+                shutil.rmtree(tmpDir, ignore_errors=True)
+                tmpDir = self._sidecarWrite(tmpDir, os.makedirs, tmpDir)
+            for obs in pd.read_table(self.obsfile, sep=r'\s+', chunksize=readSize):
+                obs = self._postprocessObs(obs)
+                if tmpDir is not None:
+                    chunkfile = 'chunk%06d.npy' % (len(chunkfiles))
+                    tmpDir = self._sidecarWrite(tmpDir, np.save, os.path.join(tmpDir, chunkfile),
+                                                self._toRecords(obs))
+                    chunkfiles.append(chunkfile)
+                yield obs
+            if tmpDir is not None:
+                # Only a complete sidecar is moved into place.
+                tmpDir = self._sidecarWrite(tmpDir, self._finishSidecar, tmpDir, chunkfiles)
+        finally:
+            # Remove the partial sidecar if reading failed or the generator was abandoned.
+            if tmpDir is not None and os.path.isdir(tmpDir):
+                shutil.rmtree(tmpDir, ignore_errors=True)
+
+    def _sidecarWrite(self, tmpDir, func, *args):
+        """Call func(*args) to write part of the sidecar, returning tmpDir (or None if writing failed)."""
+        try:
+            func(*args)
+        except (IOError, OSError) as e:
+            warnings.warn('Could not write the observations sidecar %s (%s); continuing.'
+                          % (self._sidecarDir(), e))
+            shutil.rmtree(tmpDir, ignore_errors=True)
+            return None
+        return tmpDir
+
+    def _finishSidecar(self, tmpDir, chunkfiles):
+        """Write the manifest of the sidecar in tmpDir and move it into place."""
+        with open(os.path.join(tmpDir, 'manifest.json'), 'w') as f:
+            json.dump({'source': self._sidecarSource(), 'chunks': chunkfiles}, f)
+        if os.path.isdir(self._sidecarDir()):
+            shutil.rmtree(self._sidecarDir())
+        os.rename(tmpDir, self._sidecarDir())
+
+    def _readObsChunks(self, readSize=1000000):
+        """
+        Generator of the observations (as DataFrames), in chunks which are only split where objId changes.
+        """
+        if self.chunkSize is not None:
+            readSize = self.chunkSize
+        carry = None
+        for obs in self._readObsPieces(readSize):
+            if carry is not None:
+                obs = pd.concat([carry, obs], ignore_index=True)
+            # Hold back the observations of the last object, which may continue in the next piece.
+            objIds = obs['objId'].values
+            split = np.where(objIds != objIds[-1])[0]
+            if len(split) == 0:
+                carry = obs
+                continue
+            split = split[-1] + 1
+            carry = obs.iloc[split:].reset_index(drop=True)
+            yield obs.iloc[:split].reset_index(drop=True)
+        if carry is not None:
+            yield carry
 
     def subsetObs(self, pandasConstraint=None):
         """
         Choose a subset of all the observations, such as those in a particular time period.
+
+        If the observations are read in chunks, the constraint is applied to each chunk in iterObsChunks.
         """
-        if pandasConstraint is None:
+        self.obsConstraint = pandasConstraint
+        if self.allObs is None:
+            self.obs = None
+        elif pandasConstraint is None:
             self.obs = self.allObs
         else:
             self.obs = self.allObs.query(pandasConstraint)
+        # The index into the observations is rebuilt (when needed) for the new subset.
+        self.obsIndex = None
+
+    def iterObsChunks(self):
+        """
+        Load each chunk of observations in turn (applying the constraint from subsetObs),
+        yielding the indexes of the orbits which have observations in the chunk.
+
+        If the observations were not read in chunks, all of the orbits are yielded at once.
+
+        Yields
+        ------
+        numpy.ndarray
+            The indexes of the orbits to slice (self[idx]) before the next chunk is loaded.
+        """
+        if self.chunkSize is None:
+            yield np.arange(self.nSso)
+            return
+        seen = set()
+        for chunk in self._readObsChunks():
+            chunkIds = set(chunk['objId'].values.tolist())
+            if len(seen.intersection(chunkIds)) > 0:
+                raise ValueError('The observations of each object must be contiguous in %s '
+                                 'to read it in chunks.' % (self.obsfile))
+            seen.update(chunkIds)
+            self.allObs = chunk
+            self.subsetObs(self.obsConstraint)
+            self._buildObsIndex()
+            yield np.where(self.obsIndex[:, 1] > self.obsIndex[:, 0])[0]
+        self.allObs = None
+        self.subsetObs(self.obsConstraint)
+
+    def _buildObsIndex(self):
+        """
+        Sort the observations by objId into a single recarray (self.obsArray), and find the
+        offsets (start, stop) of the observations matching each orbit in this array (self.obsIndex).
+        """
+        obsArray = self.obs.to_records()
+        # A stable sort keeps the observations of each object in their original order.
+        order = np.argsort(obsArray['objId'], kind='mergesort')
+        self.obsArray = obsArray[order]
+        sortedIds = self.obsArray['objId']
+        # Match the orbit objIds to the observation objIds by their type (as strings or integers).
+        if sortedIds.dtype == 'object':
+            orbIds = np.array([str(objId) for objId in self.orbitArray['objId']], dtype='object')
+        else:
+            orbIds = self.orbitArray['objId'].astype(sortedIds.dtype)
+        start = np.searchsorted(sortedIds, orbIds, side='left')
+        stop = np.searchsorted(sortedIds, orbIds, side='right')
+        self.obsIndex = np.column_stack([start, stop])
+
+    def runStackers(self, stackerList):
+        """
+        Run moving object stackers once on all of the current observations, for all H values.
+
+        The observations returned for each object (self[idx]['obs']) are then views which already
+        include the stacker columns, with the columns which depend on H as 2-d (nObs x nH) columns
+        (use lsst.sims.maf.stackers.selectH to pick out a single H value).
+        As these columns hold nObs x nH values for every observation, the MoMetricBundleGroup only
+        uses this when reading the observations in chunks (see readObs), which limits the memory required.
+
+        Parameters
+        ----------
+        stackerList : list of lsst.sims.maf.stackers.BaseMoStacker
+            The stackers to run.
+
+        Returns
+        -------
+        bool
+            True if the stackers were run. False if they must be run for each object instead:
+            if any of the stackers cannot be run with an array of H values, or if some orbits share
+            their observations (duplicate objIds) and so do not have a unique Href for each observation.
+        """
+        if True in [s.colsAddedH is None for s in stackerList]:
+            return False
+        if self.obsIndex is None:
+            self._buildObsIndex()
+        start = self.obsIndex[:, 0]
+        counts = self.obsIndex[:, 1] - start
+        hasObs = np.where(counts > 0)[0]
+        if len(np.unique(start[hasObs])) != len(hasObs):
+            return False
+        # Find the H value of the orbit of each observation (NaN for observations without an orbit).
+        hasObs = hasObs[np.argsort(start[hasObs])]
+        counts = counts[hasObs]
+        rows = np.arange(counts.sum()) + np.repeat(start[hasObs] - np.cumsum(counts) + counts, counts)
+        Href = np.zeros(len(self.obsArray), float) + np.nan
+        Href[rows] = np.repeat(self.orbitArray['H'][hasObs], counts)
+        if self.Hrange is not None:
+            Hvals = self.Hrange
+        else:
+            # The only H value for each object is the H value of its orbit.
+            Hvals = Href[:, np.newaxis]
+        if len(self.obsArray) == 0:
+            return True
+        Hvals = np.asarray(Hvals, float)
+        self._addStackerColsH(stackerList, np.shape(Hvals)[-1])
+        for s in stackerList:
+            self.obsArray = s._run(self.obsArray, Href, Hvals)
+        return True
+
+    def _addStackerColsH(self, stackerList, nH):
+        """Add the columns of all of the stackers to self.obsArray in a single copy (replacing any
+        existing stacker columns), with the columns which depend on H as 2-d (nObs x nH) columns."""
+        addedCols = []
+        addedDtype = []
+        for s in stackerList:
+            dtypes = getattr(s, 'colsAddedDtypes', None)
+            if dtypes is None:
+                dtypes = [float for col in s.colsAdded]
+            for col, dtype in zip(s.colsAdded, dtypes):
+                if col in addedCols:
+                    continue
+                addedCols.append(col)
+                if col in s.colsAddedH:
+                    addedDtype.append((col, dtype, (nH,)))
+                else:
+                    addedDtype.append((col, dtype))
+        keepCols = [col for col in self.obsArray.dtype.names if col not in addedCols]
+        newdtype = np.dtype([(col, self.obsArray.dtype[col]) for col in keepCols] + addedDtype)
+        # The columns may already be present (e.g. from another set of stackers on this chunk).
+        if newdtype == self.obsArray.dtype:
+            return
+        newData = np.empty(self.obsArray.shape, dtype=newdtype)
+        for col in keepCols:
+            newData[col] = self.obsArray[col]
+        self.obsArray = newData.view(np.recarray)
 
     def _sliceObs(self, idx):
         """
         Return the observations of ssoId.
-        For now this works for any ssoId; in the future, this might only work as ssoId is
-         progressively iterated through the series of ssoIds (so we can 'chunk' the reading).
-        """
-        # Find the matching orbit.
-        orb = self.orbits.iloc[idx]
-        # Find the matching observations.
-        if self.obs['objId'].dtype == 'object':
-            obs = self.obs.query('objId == "%s"' %(orb['objId']))
-        else:
-            obs = self.obs.query('objId == %d' %(orb['objId']))
+        If the observations are read in chunks, this only works for the ssoIds in the current chunk
+        (see iterObsChunks).
+        """
+        if self.obsIndex is None:
+            self._buildObsIndex()
+        # Find the matching orbit (a numpy record, indexed by column name like a pandas Series).
+        orb = self.orbitArray[idx]
+        # Find the matching observations (a view into the sorted observations).
+        start, stop = self.obsIndex[idx]
+        obs = self.obsArray[start:stop]
         # Return the values for H to consider for metric.
         if self.Hrange is not None:
             Hvals = self.Hrange
         else:
             Hvals = np.array([orb['H']], float)
         # Note that ssoObs / obs is a recarray not Dataframe!
-        return {'obs': obs.to_records(),
+        return {'obs': obs,
                 'orbit': orb,
                 'Hvals': Hvals}
 
@@ -152,6 +430,7 @@ class MoObjSlicer(BaseSlicer):
         slicer.slicePoints['H'] = slicer.Hrange
         slicer.shape = [len(df.values), len(slicer.Hrange)]
         slicer.orbits = None
+        slicer.orbitArray = None
         metricValues = ma.MaskedArray(data=df.values,
                                       mask=np.zeros(slicer.shape, 'bool'),
                                       fill_value=slicer.badval)
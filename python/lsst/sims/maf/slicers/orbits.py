@@ -1,3 +1,5 @@
+import os
+import json
 import warnings
 import numpy as np
 import pandas as pd
@@ -7,9 +9,13 @@ __all__ = ['Orbits']
 
 class Orbits(object):
     """Orbits reads and stores orbit parameters for moving objects.
+
+    The orbits are available both as a pandas DataFrame (self.orbits) and as a numpy recarray
+    (self.orbitArray); the recarray gives fast access to the orbit of a single object (self.orbitArray[i]).
     """
     def __init__(self):
         self.orbits = None
+        self.orbitArray = None
         self.format = None
 
         # Specify the required columns/values in the self.orbits dataframe.
@@ -137,6 +143,18 @@ class Orbits(object):
                           ' - was this intended? (continuing).')
         # All is good.
         self.orbits = orbits
+        self.orbitArray = self._toRecords(orbits)
+
+    def _toRecords(self, orbits):
+        """Convert the orbits DataFrame to a recarray, with strings in place of python objects."""
+        orbitArray = orbits.to_records(index=False)
+        dtype = []
+        for name in orbitArray.dtype.names:
+            if orbitArray.dtype[name] == 'object':
+                dtype.append((name, np.array([str(v) for v in orbitArray[name]]).dtype))
+            else:
+                dtype.append((name, orbitArray.dtype[name]))
+        return np.array(orbitArray, dtype=dtype).view(np.recarray)
 
     def assignSed(self, orbits, randomSeed=None):
         """Assign either a C or S type SED, depending on the semi-major axis of the object.
@@ -175,7 +193,47 @@ class Orbits(object):
         sedvals = np.where(chance <= prob_c, 'C.dat', 'S.dat')
         return sedvals
 
-    def readOrbits(self, orbitfile, delim=None, skiprows=None):
+    def _cacheFiles(self, orbitfile):
+        return orbitfile + '.npy', orbitfile + '.npy.json'
+
+    def _cacheSource(self, orbitfile, delim, skiprows):
+        """Identify the state of orbitfile (and how it was read), to detect when the cache is stale."""
+        stat = os.stat(orbitfile)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime, 'delim': delim, 'skiprows': skiprows}
+
+    def _readCache(self, orbitfile, delim, skiprows):
+        """Set the orbits from the cache of orbitfile, returning False if it is missing or out of date."""
+        cachefile, manifestfile = self._cacheFiles(orbitfile)
+        try:
+            with open(manifestfile, 'r') as f:
+                manifest = json.load(f)
+        except (IOError, OSError, ValueError):
+            return False
+        if manifest.get('source') != self._cacheSource(orbitfile, delim, skiprows):
+            return False
+        try:
+            orbitArray = np.load(cachefile)
+        except (IOError, OSError, ValueError):
+            return False
+        self.format = manifest['format']
+        self.orbitArray = orbitArray.view(np.recarray)
+        self.orbits = pd.DataFrame(orbitArray)
+        return True
+
+    def _writeCache(self, orbitfile, delim, skiprows):
+        """Save self.orbitArray alongside orbitfile (the manifest is written last)."""
+        cachefile, manifestfile = self._cacheFiles(orbitfile)
+        try:
+            if os.path.isfile(manifestfile):
+                os.remove(manifestfile)
+            np.save(cachefile, self.orbitArray)
+            manifest = {'source': self._cacheSource(orbitfile, delim, skiprows), 'format': self.format}
+            with open(manifestfile, 'w') as f:
+                json.dump(manifest, f)
+        except (IOError, OSError) as e:
+            warnings.warn('Could not write the orbit cache %s (%s); continuing.' % (cachefile, e))
+
+    def readOrbits(self, orbitfile, delim=None, skiprows=None, useCache=False):
         """Read orbits from a file, generating a pandas dataframe containing columns matching
         dataCols, for the appropriate orbital parameter format (currently accepts COM or KEP formats).
 
@@ -187,10 +245,21 @@ class Orbits(object):
         orbitfile : str
             The name of the input file containing orbital parameter information.
         delim : str, optional
-            The delimiter for the input orbit file -- default = None will use delim_whitespace=True.
+            The delimiter for the input orbit file -- default = None will split on whitespace.
         skiprows : int, optional
             The number of rows to skip before reading the header information for pandas.
+        useCache : bool, optional
+            If True, the validated orbits are saved in binary form alongside orbitfile
+            ('<orbitfile>.npy') the first time it is read, and are read from there the next time
+            (so the file is not parsed). Note that any SEDs assigned by assignSed are then also kept,
+            rather than assigned again. The cache is rewritten if orbitfile changes.
+            If the cache cannot be written (e.g. in a read-only directory), the orbits are still read.
+            Default False.
         """
+        if useCache and self._readCache(orbitfile, delim, skiprows):
+            return
+        # Keep the values passed in, to identify the cache.
+        cacheArgs = (delim, skiprows)
         names = None
         if skiprows is None:
             skiprows = 0
@@ -215,7 +284,7 @@ class Orbits(object):
             # No header; assume it's a typical DES file.
             names = ('objId', 'FORMAT', 'q', 'e', 'i', 'node', 'argperi', 't_p',
                      'H',  'epoch', 'INDEX', 'N_PAR', 'MOID', 'COMPCODE')
-            orbits = pd.read_table(orbitfile, delim_whitespace=True, skiprows=0,
+            orbits = pd.read_table(orbitfile, sep=r'\s+', skiprows=0,
                                    names=names)
 
         else:
@@ -227,7 +296,7 @@ class Orbits(object):
                 skiprows += 1
             # Read the data from disk.
             if delim is None:
-                orbits = pd.read_table(orbitfile, delim_whitespace=True, names=names, skiprows=skiprows)
+                orbits = pd.read_table(orbitfile, sep=r'\s+', names=names, skiprows=skiprows)
             else:
                 orbits = pd.read_table(orbitfile, sep=delim, names=names, skiprows=skiprows)
 
@@ -279,3 +348,5 @@ class Orbits(object):
         orbits.columns = ssoCols
         # Validate and assign orbits to self.
         self.setOrbits(orbits)
+        if useCache:
+            self._writeCache(orbitfile, *cacheArgs)
@@ -46,16 +46,24 @@ class UserPointsSlicer(BaseSpatialSlicer):
     chipNames : array-like, optional
         List of chips to accept, if useCamera is True. This lets users turn 'on' only a subset of chips.
         Default 'all' - this uses all chips in the camera.
+    indexCacheDir : str, optional
+        Directory in which to save (and from which to reuse) the slice index.
+        Default None (slice indexes are not saved to disk).
+    chipMaskResolution : float, optional
+        Resolution (arcseconds) of the rasterized camera footprint, if useCamera is True. Default 10.
     """
     def __init__(self, ra, dec, lonCol='fieldRA', latCol='fieldDec', latLonDeg=True, verbose=True,
                  badval=-666, leafsize=100, radius=1.75,
                  useCamera=False, rotSkyPosColName='rotSkyPos', mjdColName='observationStartMJD',
-                 chipNames='all'):
+                 chipNames='all', indexCacheDir=None,
+                 chipMaskResolution=10.0):
         super(UserPointsSlicer, self).__init__(lonCol=lonCol, latCol=latCol, latLonDeg=latLonDeg,
                                                verbose=verbose,
                                                badval=badval, radius=radius, leafsize=leafsize,
                                                useCamera=useCamera, rotSkyPosColName=rotSkyPosColName,
-                                               mjdColName=mjdColName, chipNames=chipNames)
+                                               mjdColName=mjdColName, chipNames=chipNames,
+                                               indexCacheDir=indexCacheDir,
+                                               chipMaskResolution=chipMaskResolution)
         # check that ra and dec are iterable, if not, they are probably naked numbers, wrap in list
         if not hasattr(ra, '__iter__'):
             ra = [ra]
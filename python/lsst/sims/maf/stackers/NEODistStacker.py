@@ -12,11 +12,17 @@ class NEODistStacker(BaseStacker):
     """
     def __init__(self,
                  stepsize=.001, maxDist=3., minDist=.3, H=22, elongCol='solarElong',
-                 filterCol='filter', sunAzCol='sunAz', azCol='azimuth', m5Col='fiveSigmaDepth'):
+                 filterCol='filter', sunAzCol='sunAz', azCol='azimuth', m5Col='fiveSigmaDepth',
+                 tableStep=0.05):
         """
         stepsize:  The stepsize to use when solving (in AU)
         maxDist: How far out to try and measure (in AU)
         H: Asteroid magnitude
+        tableStep: The spacing (in degrees) of the table of magnitudes vs. elongation and distance.
+            If there are more unique elongations than rows in this table, the max distance is
+            interpolated from the table (falling back to solving directly where the interpolation
+            would not be within one stepsize), rather than solved for each observation.
+            If None, always solve for each observation.
 
         Adds columns:
         MaxGeoDist:  Geocentric distance to the NEO
@@ -50,6 +56,105 @@ class NEODistStacker(BaseStacker):
         self.a2 = 1.87
         self.b2 = 1.22
 
+        self.tableStep = tableStep
+        # Number of (observation, distance) pairs to calculate at a time (to limit the memory used).
+        self._blockSize = 1000000
+
+    def _appMag(self, elongRad):
+        """Apparent magnitude of the NEO at each of self.deltas, for each elongation (radians).
+
+        Returns an array of shape (len(elongRad), len(self.deltas)).
+        """
+        cosElong = np.cos(elongRad)[:, np.newaxis]
+        # Law of cosines:
+        # Heliocentric Radius of the object
+        R = np.sqrt(1.+self.deltas**2-2.*self.deltas*cosElong)
+        # Angle between sun and earth as seen by NEO
+        alphas = np.arccos((1.-R**2-self.deltas**2)/(-2.*self.deltas*R))
+        ta2 = np.tan(alphas/2.)
+        phi1 = np.exp(-self.a1*ta2**self.b1)
+        phi2 = np.exp(-self.a2*ta2**self.b2)
+
+        alpha_term = 2.5*np.log10((1. - self.G)*phi1+self.G*phi2)
+        appmag = self.H+5.*np.log10(R*self.deltas)-alpha_term
+        return appmag
+
+    def _maxGeoDist(self, elongRad, v5):
+        """Find the first of self.deltas at which the NEO is fainter than v5, for each elongation.
+
+        Returns 0 where the NEO is bright enough at all of self.deltas.
+        """
+        maxGeoDist = np.zeros(len(elongRad), float)
+        blockSize = max(self._blockSize // len(self.deltas), 1)
+        for start in range(0, len(elongRad), blockSize):
+            block = slice(start, start + blockSize)
+            # There can be some local minima/maxima when solving, so
+            # need to find the *1st* spot where it is too faint, not the
+            # last spot it is bright enough.
+            tooFaint = self._appMag(elongRad[block]) > v5[block, np.newaxis]
+            first = np.argmax(tooFaint, axis=1)
+            found = tooFaint[np.arange(len(first)), first]
+            maxGeoDist[block] = np.where(found, self.deltas[first], 0)
+        return maxGeoDist
+
+    def _magTable(self, elongRad):
+        """Calculate the running maximum (along self.deltas) of the apparent magnitude of the NEO,
+        for elongations spaced by tableStep over the range of elongRad.
+
+        Returns None, None if tableStep is None or there are fewer unique elongations than table rows.
+        """
+        if self.tableStep is None or len(elongRad) < 2:
+            return None, None
+        step = np.radians(self.tableStep)
+        elongRange = elongRad.max() - elongRad.min()
+        if not np.isfinite(elongRange):
+            return None, None
+        nTable = int(np.ceil(elongRange / step)) + 1
+        if nTable < 2 or nTable >= len(np.unique(elongRad)):
+            return None, None
+        tableElong = elongRad.min() + np.arange(nTable) * step
+        table = np.empty((nTable, len(self.deltas)), float)
+        blockSize = max(self._blockSize // len(self.deltas), 1)
+        for start in range(0, nTable, blockSize):
+            block = slice(start, start + blockSize)
+            appmag = self._appMag(tableElong[block])
+            # Where the magnitude is undefined, the NEO is never too faint (as in _maxGeoDist).
+            appmag = np.where(np.isnan(appmag), -np.inf, appmag)
+            # The running maximum is sorted; searching it for v5 finds the first delta that is too faint.
+            table[block] = np.maximum.accumulate(appmag, axis=1)
+        return tableElong, table
+
+    def _lookupTable(self, rows, v5, table):
+        """Index of the first too faint delta in each (table row, v5) pair (len(self.deltas) if none)."""
+        first = np.zeros(len(rows), int)
+        order = np.argsort(rows, kind='mergesort')
+        uRows, starts = np.unique(rows[order], return_index=True)
+        ends = np.append(starts[1:], len(rows))
+        for row, start, end in zip(uRows, starts, ends):
+            idxs = order[start:end]
+            first[idxs] = np.searchsorted(table[row], v5[idxs], side='right')
+        return first
+
+    def _maxGeoDistTable(self, elongRad, v5, tableElong, table):
+        """Interpolate the max distance between the two nearest rows of the table.
+
+        Where the rows do not agree to within one step in distance (or the NEO is never too faint in
+        either), the distance is calculated exactly.
+        """
+        nDeltas = len(self.deltas)
+        row = np.clip(np.searchsorted(tableElong, elongRad, side='right') - 1, 0, len(tableElong) - 2)
+        frac = (elongRad - tableElong[row]) / (tableElong[row + 1] - tableElong[row])
+        firstLo = self._lookupTable(row, v5, table)
+        firstHi = self._lookupTable(row + 1, v5, table)
+        exact = (firstLo == nDeltas) | (firstHi == nDeltas) | (np.abs(firstHi - firstLo) > 1)
+        firstLo = np.minimum(firstLo, nDeltas - 1)
+        firstHi = np.minimum(firstHi, nDeltas - 1)
+        maxGeoDist = np.where(firstLo == firstHi, self.deltas[firstLo],
+                              self.deltas[firstLo] * (1.0 - frac) + self.deltas[firstHi] * frac)
+        exact = np.where(exact)[0]
+        maxGeoDist[exact] = self._maxGeoDist(elongRad[exact], v5[exact])
+        return maxGeoDist
+
     def _run(self, simData, cols_present=False):
         if cols_present:
             # This is a pretty rare stacker. Assume we need to rerun
@@ -59,28 +164,11 @@ class NEODistStacker(BaseStacker):
         for filterName in self.limitingAdjust:
             fmatch = np.where(simData[self.filterCol] == filterName)
             v5[fmatch] += self.limitingAdjust[filterName]
-        for i, elong in enumerate(elongRad):
-            # Law of cosines:
-            # Heliocentric Radius of the object
-            R = np.sqrt(1.+self.deltas**2-2.*self.deltas*np.cos(elong))
-            # Angle between sun and earth as seen by NEO
-            alphas = np.arccos((1.-R**2-self.deltas**2)/(-2.*self.deltas*R))
-            ta2 = np.tan(alphas/2.)
-            phi1 = np.exp(-self.a1*ta2**self.b1)
-            phi2 = np.exp(-self.a2*ta2**self.b2)
-
-            alpha_term = 2.5*np.log10((1. - self.G)*phi1+self.G*phi2)
-            appmag = self.H+5.*np.log10(R*self.deltas)-alpha_term
-            # There can be some local minima/maxima when solving, so
-            # need to find the *1st* spot where it is too faint, not the
-            # last spot it is bright enough.
-            tooFaint = np.where(appmag > v5[i])
-
-            # Check that there is a minimum
-            if np.size(tooFaint[0]) == 0:
-                simData['MaxGeoDist'][i] = 0
-            else:
-                simData['MaxGeoDist'][i] = np.min(self.deltas[tooFaint])
+        tableElong, table = self._magTable(elongRad)
+        if table is None:
+            simData['MaxGeoDist'] = self._maxGeoDist(elongRad, v5)
+        else:
+            simData['MaxGeoDist'] = self._maxGeoDistTable(elongRad, v5, tableElong, table)
 
         # Make coords in heliocentric
         interior = np.where(elongRad <= np.pi/2.)
@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 from .baseStacker import *
+from .stackerScheduler import *
 from .generalStackers import *
 from .ditherStackers import *
 from .sdssStackers import *
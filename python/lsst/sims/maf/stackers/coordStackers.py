@@ -5,7 +5,11 @@ from lsst.sims.utils import _galacticFromEquatorial, calcLmstLast
 from .baseStacker import BaseStacker
 from .ditherStackers import wrapRA
 
-__all__ = ['mjd2djd', 'raDec2AltAz', 'GalacticStacker', 'EclipticStacker']
+__all__ = ['mjd2djd', 'raDec2AltAz', 'eclipticFromEquatorial', 'sunEclipticLon',
+           'GalacticStacker', 'EclipticStacker']
+
+# The obliquity of the ecliptic at J2000 (radians).
+_obliquityJ2000 = np.radians(23.4392911)
 
 
 def mjd2djd(mjd):
@@ -75,6 +79,60 @@ def raDec2AltAz(ra, dec, lat, lon, mjd, altonly=False):
     return alt, az
 
 
+def eclipticFromEquatorial(ra, dec):
+    """Convert J2000 RA/Dec to J2000 ecliptic longitude/latitude, by rotating about the equinox.
+
+    Parameters
+    ----------
+    ra : numpy.ndarray
+        RA, in radians.
+    dec : numpy.ndarray
+        Dec, in radians.
+
+    Returns
+    -------
+    lon : numpy.ndarray
+        Ecliptic longitude, in radians (0 to 2pi).
+    lat : numpy.ndarray
+        Ecliptic latitude, in radians.
+    """
+    cosDec = np.cos(dec)
+    y = np.sin(ra) * cosDec
+    z = np.sin(dec)
+    cosEps = np.cos(_obliquityJ2000)
+    sinEps = np.sin(_obliquityJ2000)
+    lon = np.arctan2(cosEps * y + sinEps * z, np.cos(ra) * cosDec) % (2.0 * np.pi)
+    lat = np.arcsin(np.clip(-sinEps * y + cosEps * z, -1.0, 1.0))
+    return lon, lat
+
+
+def sunEclipticLon(mjd):
+    """Calculate the (J2000) ecliptic longitude of the sun, using a low precision series.
+
+    This uses the series from Meeus (Astronomical Algorithms, ch. 25), precessed to J2000,
+    and agrees with ephem to better than 0.01 degrees between 1990 and 2040.
+
+    Parameters
+    ----------
+    mjd : float or numpy.ndarray
+        The modified julian date.
+
+    Returns
+    -------
+    float or numpy.ndarray
+        The ecliptic longitude of the sun, in radians (0 to 2pi).
+    """
+    # Julian centuries since J2000.
+    t = (np.asarray(mjd, float) - 51544.5) / 36525.0
+    meanLon = 280.46646 + 36000.76983 * t + 0.0003032 * t * t
+    meanAnomaly = np.radians(357.52911 + 35999.05029 * t - 0.0001537 * t * t)
+    center = ((1.914602 - 0.004817 * t - 0.000014 * t * t) * np.sin(meanAnomaly) +
+              (0.019993 - 0.000101 * t) * np.sin(2.0 * meanAnomaly) + 0.000289 * np.sin(3.0 * meanAnomaly))
+    # Remove the precession of the equinox since J2000.
+    lon = meanLon + center - 1.396971 * t
+    return np.radians(lon) % (2.0 * np.pi)
+
+
 class GalacticStacker(BaseStacker):
     """Add the galactic coordinates of each RA/Dec pointing: gall, galb
 
@@ -121,6 +179,7 @@ class EclipticStacker(BaseStacker):
         Name of the Dec column. Default fieldDec.
     subtractSunLon : bool, opt
         Flag to subtract the sun's ecliptic longitude. Default False.
+        The sun's longitude is calculated with sunEclipticLon (accurate to about 0.01 degrees).
     """
     def __init__(self, mjdCol='observationStartMJD', raCol='fieldRA', decCol='fieldDec', degrees=True,
                  subtractSunLon=False):
@@ -141,23 +200,16 @@ class EclipticStacker(BaseStacker):
         if cols_present:
             # Column already present in data; assume it is correct and does not need recalculating.
             return simData
-        for i in np.arange(simData.size):
-            if self.degrees:
-                coord = ephem.Equatorial(np.radians(simData[self.raCol][i]),
-                                         np.radians(simData[self.decCol][i]), epoch=2000)
-            else:
-                coord = ephem.Equatorial(simData[self.raCol][i],
-                                         simData[self.decCol][i], epoch=2000)
-            ecl = ephem.Ecliptic(coord)
-            simData['eclipLat'][i] = ecl.lat
-            if self.subtractSunLon:
-                djd = mjd2djd(simData[self.mjdCol][i])
-                sun = ephem.Sun(djd)
-                sunEcl = ephem.Ecliptic(sun)
-                lon = wrapRA(ecl.lon - sunEcl.lon)
-                simData['eclipLon'][i] = lon
-            else:
-                simData['eclipLon'][i] = ecl.lon
+        if self.degrees:
+            lon, lat = eclipticFromEquatorial(np.radians(simData[self.raCol]),
+                                              np.radians(simData[self.decCol]))
+        else:
+            lon, lat = eclipticFromEquatorial(simData[self.raCol], simData[self.decCol])
+        simData['eclipLat'] = lat
+        if self.subtractSunLon:
+            simData['eclipLon'] = wrapRA(lon - sunEclipticLon(simData[self.mjdCol]))
+        else:
+            simData['eclipLon'] = lon
         if self.degrees:
             simData['eclipLon'] = np.degrees(simData['eclipLon'])
             simData['eclipLat'] = np.degrees(simData['eclipLat'])
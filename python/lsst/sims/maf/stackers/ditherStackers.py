@@ -70,6 +70,57 @@ def wrapRA(ra):
     return ra
 
 
+def _visitSequence(groupIds):
+    """
+    Number the visits within each group sequentially, in the order they appear in the data.
+
+    Parameters
+    ----------
+    groupIds : numpy.ndarray
+        The group (e.g. fieldId) of each visit.
+
+    Returns
+    -------
+    numpy.ndarray
+        The index of each visit among the visits in its group (0 for the first visit, 1 for the second ..).
+    """
+    groupIdx = np.unique(groupIds, return_inverse=True)[1].ravel()
+    counts = np.bincount(groupIdx)
+    # A stable sort keeps the visits within each group in their original order.
+    order = np.argsort(groupIdx, kind='mergesort')
+    seq = np.empty(len(groupIdx), int)
+    seq[order] = np.arange(len(groupIdx)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return seq
+
+
+def _nightSequence(groupIds, nights):
+    """
+    Number the nights on which each group was observed sequentially.
+
+    Parameters
+    ----------
+    groupIds : numpy.ndarray
+        The group (e.g. fieldId) of each visit.
+    nights : numpy.ndarray
+        The night of each visit.
+
+    Returns
+    -------
+    numpy.ndarray
+        The index of the night of each visit among the (sorted) unique nights on which its group was
+        observed (0 for the first night, 1 for the second ..).
+    """
+    groupIdx = np.unique(groupIds, return_inverse=True)[1].ravel()
+    nightIdx = np.unique(nights, return_inverse=True)[1].ravel()
+    nNights = nightIdx.max() + 1 if len(nightIdx) > 0 else 1
+    # Each unique (group, night) pair, sorted by group and then by night.
+    pairs, pairIdx = np.unique(groupIdx * nNights + nightIdx, return_inverse=True)
+    pairGroup = pairs // nNights
+    # Subtract the index of the first pair belonging to the same group.
+    pairSeq = np.arange(len(pairs)) - np.searchsorted(pairGroup, pairGroup)
+    return pairSeq[pairIdx.ravel()]
+
+
 def inHexagon(xOff, yOff, maxDither):
     """
     Identify dither offsets which fall within the inscribed hexagon.
@@ -300,22 +351,11 @@ class RandomDitherFieldPerNightStacker(RandomDitherFieldPerVisitStacker):
         else:
             ra = simData[self.raCol]
             dec = simData[self.decCol]
-        # counter to ensure new random numbers are chosen every time
-        delta = 0
-        for fieldid in np.unique(simData[self.fieldIdCol]):
-            # Identify observations of this field.
-            match = np.where(simData[self.fieldIdCol] == fieldid)[0]
-            # Apply dithers, increasing each night.
-            nights = simData[self.nightCol][match]
-            vertexIdxs = np.searchsorted(np.unique(nights), nights)
-            vertexIdxs = vertexIdxs % len(self.xOff)
-            # ensure that the same xOff/yOff entries are not chosen
-            delta = delta + len(vertexIdxs)
-            simData['randomDitherFieldPerNightRa'][match] = (ra[match] +
-                                                             self.xOff[vertexIdxs] /
-                                                             np.cos(dec[match]))
-            simData['randomDitherFieldPerNightDec'][match] = (dec[match] +
-                                                              self.yOff[vertexIdxs])
+        # Apply dithers, increasing each night the field is observed.
+        vertexIdxs = _nightSequence(simData[self.fieldIdCol], simData[self.nightCol])
+        vertexIdxs = vertexIdxs % len(self.xOff)
+        simData['randomDitherFieldPerNightRa'] = ra + self.xOff[vertexIdxs] / np.cos(dec)
+        simData['randomDitherFieldPerNightDec'] = dec + self.yOff[vertexIdxs]
         # Wrap into expected range.
         simData['randomDitherFieldPerNightRa'], simData['randomDitherFieldPerNightDec'] = \
             wrapRADec(simData['randomDitherFieldPerNightRa'], simData['randomDitherFieldPerNightDec'])
@@ -386,11 +426,9 @@ class RandomDitherPerNightStacker(RandomDitherFieldPerVisitStacker):
             ra = simData[self.raCol]
             dec = simData[self.decCol]
         # Add to RA and dec values.
-        for n, x, y in zip(nights, self.xOff, self.yOff):
-            match = np.where(simData[self.nightCol] == n)[0]
-            simData['randomDitherPerNightRa'][match] = (ra[match] +
-                                                        x / np.cos(dec[match]))
-            simData['randomDitherPerNightDec'][match] = dec[match] + y
+        vertexIdxs = np.searchsorted(nights, simData[self.nightCol])
+        simData['randomDitherPerNightRa'] = ra + self.xOff[vertexIdxs] / np.cos(dec)
+        simData['randomDitherPerNightDec'] = dec + self.yOff[vertexIdxs]
         # Wrap RA/Dec into expected range.
         simData['randomDitherPerNightRa'], simData['randomDitherPerNightDec'] = \
             wrapRADec(simData['randomDitherPerNightRa'], simData['randomDitherPerNightDec'])
@@ -472,8 +510,7 @@ class SpiralDitherFieldPerVisitStacker(BaseStacker):
         rpts = np.zeros(self.numPoints, float)
         thetapts = np.zeros(self.numPoints, float)
         for i, ap in enumerate(arcpts):
-            diff = np.abs(arc - ap)
-            match = np.where(diff == diff.min())[0]
+            match = np.argmin(np.abs(arc - ap))
             rpts[i] = r[match]
             thetapts[i] = theta[match]
         # Translate these r/theta points into x/y (ra/dec) offsets.
@@ -492,16 +529,11 @@ class SpiralDitherFieldPerVisitStacker(BaseStacker):
         else:
             ra = simData[self.raCol]
             dec = simData[self.decCol]
-        for fieldid in np.unique(simData[self.fieldIdCol]):
-            match = np.where(simData[self.fieldIdCol] == fieldid)[0]
-            # Apply sequential dithers, increasing with each visit.
-            vertexIdxs = np.arange(0, len(match), 1)
-            vertexIdxs = vertexIdxs % self.numPoints
-            simData['spiralDitherFieldPerVisitRa'][match] = (ra[match] +
-                                                             self.xOff[vertexIdxs] /
-                                                             np.cos(dec[match]))
-            simData['spiralDitherFieldPerVisitDec'][match] = (dec[match] +
-                                                              self.yOff[vertexIdxs])
+        # Apply sequential dithers, increasing with each visit to a field.
+        vertexIdxs = _visitSequence(simData[self.fieldIdCol])
+        vertexIdxs = vertexIdxs % self.numPoints
+        simData['spiralDitherFieldPerVisitRa'] = ra + self.xOff[vertexIdxs] / np.cos(dec)
+        simData['spiralDitherFieldPerVisitDec'] = dec + self.yOff[vertexIdxs]
         # Wrap into expected range.
         simData['spiralDitherFieldPerVisitRa'], simData['spiralDitherFieldPerVisitDec'] = \
             wrapRADec(simData['spiralDitherFieldPerVisitRa'], simData['spiralDitherFieldPerVisitDec'])
@@ -572,18 +604,11 @@ class SpiralDitherFieldPerNightStacker(SpiralDitherFieldPerVisitStacker):
         else:
             ra = simData[self.raCol]
             dec = simData[self.decCol]
-        for fieldid in np.unique(simData[self.fieldIdCol]):
-            # Identify observations of this field.
-            match = np.where(simData[self.fieldIdCol] == fieldid)[0]
-            # Apply a sequential dither, increasing each night.
-            nights = simData[self.nightCol][match]
-            vertexIdxs = np.searchsorted(np.unique(nights), nights)
-            vertexIdxs = vertexIdxs % self.numPoints
-            simData['spiralDitherFieldPerNightRa'][match] = (ra[match] +
-                                                             self.xOff[vertexIdxs] /
-                                                             np.cos(dec[match]))
-            simData['spiralDitherFieldPerNightDec'][match] = (dec[match] +
-                                                              self.yOff[vertexIdxs])
+        # Apply a sequential dither, increasing each night the field is observed.
+        vertexIdxs = _nightSequence(simData[self.fieldIdCol], simData[self.nightCol])
+        vertexIdxs = vertexIdxs % self.numPoints
+        simData['spiralDitherFieldPerNightRa'] = ra + self.xOff[vertexIdxs] / np.cos(dec)
+        simData['spiralDitherFieldPerNightDec'] = dec + self.yOff[vertexIdxs]
         # Wrap into expected range.
         simData['spiralDitherFieldPerNightRa'], simData['spiralDitherFieldPerNightDec'] = \
             wrapRADec(simData['spiralDitherFieldPerNightRa'], simData['spiralDitherFieldPerNightDec'])
@@ -759,16 +784,11 @@ class HexDitherFieldPerVisitStacker(BaseStacker):
         else:
             ra = simData[self.raCol]
             dec = simData[self.decCol]
-        for fieldid in np.unique(simData[self.fieldIdCol]):
-            # Identify observations of this field.
-            match = np.where(simData[self.fieldIdCol] == fieldid)[0]
-            # Apply sequential dithers, increasing with each visit.
-            vertexIdxs = np.arange(0, len(match), 1)
-            vertexIdxs = vertexIdxs % self.numPoints
-            simData['hexDitherFieldPerVisitRa'][match] = (ra[match] +
-                                                          self.xOff[vertexIdxs] /
-                                                          np.cos(dec[match]))
-            simData['hexDitherFieldPerVisitDec'][match] = dec[match] + self.yOff[vertexIdxs]
+        # Apply sequential dithers, increasing with each visit to a field.
+        vertexIdxs = _visitSequence(simData[self.fieldIdCol])
+        vertexIdxs = vertexIdxs % self.numPoints
+        simData['hexDitherFieldPerVisitRa'] = ra + self.xOff[vertexIdxs] / np.cos(dec)
+        simData['hexDitherFieldPerVisitDec'] = dec + self.yOff[vertexIdxs]
         # Wrap into expected range.
         simData['hexDitherFieldPerVisitRa'], simData['hexDitherFieldPerVisitDec'] = \
             wrapRADec(simData['hexDitherFieldPerVisitRa'], simData['hexDitherFieldPerVisitDec'])
@@ -832,19 +852,11 @@ class HexDitherFieldPerNightStacker(HexDitherFieldPerVisitStacker):
         else:
             ra = simData[self.raCol]
             dec = simData[self.decCol]
-        for fieldid in np.unique(simData[self.fieldIdCol]):
-            # Identify observations of this field.
-            match = np.where(simData[self.fieldIdCol] == fieldid)[0]
-            # Apply a sequential dither, increasing each night.
-            vertexIdxs = np.arange(0, len(match), 1)
-            nights = simData[self.nightCol][match]
-            vertexIdxs = np.searchsorted(np.unique(nights), nights)
-            vertexIdxs = vertexIdxs % self.numPoints
-            simData['hexDitherFieldPerNightRa'][match] = (ra[match] +
-                                                          self.xOff[vertexIdxs] /
-                                                          np.cos(dec[match]))
-            simData['hexDitherFieldPerNightDec'][match] = (dec[match] +
-                                                           self.yOff[vertexIdxs])
+        # Apply a sequential dither, increasing each night the field is observed.
+        vertexIdxs = _nightSequence(simData[self.fieldIdCol], simData[self.nightCol])
+        vertexIdxs = vertexIdxs % self.numPoints
+        simData['hexDitherFieldPerNightRa'] = ra + self.xOff[vertexIdxs] / np.cos(dec)
+        simData['hexDitherFieldPerNightDec'] = dec + self.yOff[vertexIdxs]
         # Wrap into expected range.
         simData['hexDitherFieldPerNightRa'], simData['hexDitherFieldPerNightDec'] = \
             wrapRADec(simData['hexDitherFieldPerNightRa'], simData['hexDitherFieldPerNightDec'])
@@ -912,14 +924,11 @@ class HexDitherPerNightStacker(HexDitherFieldPerVisitStacker):
         else:
             ra = simData[self.raCol]
             dec = simData[self.decCol]
-        # Add to RA and dec values.
-        vertexID = 0
-        for n in nights:
-            match = np.where(simData[self.nightCol] == n)[0]
-            vertexID = vertexID % self.numPoints
-            simData[self.addedRA][match] = (ra[match] + self.xOff[vertexID] / np.cos(dec[match]))
-            simData[self.addedDec][match] = dec[match] + self.yOff[vertexID]
-            vertexID += 1
+        # Add to RA and dec values, stepping to the next vertex each night.
+        vertexIdxs = np.searchsorted(nights, simData[self.nightCol])
+        vertexIdxs = vertexIdxs % self.numPoints
+        simData[self.addedRA] = ra + self.xOff[vertexIdxs] / np.cos(dec)
+        simData[self.addedDec] = dec + self.yOff[vertexIdxs]
         # Wrap RA/Dec into expected range.
         simData[self.addedRA], simData[self.addedDec] = \
             wrapRADec(simData[self.addedRA], simData[self.addedDec])
@@ -1042,10 +1051,11 @@ class RandomRotDitherPerFilterChangeStacker(BaseStacker):
             # Calculate random offsets between +/- self.maxDither  -- in degrees.
             randomOffsets = np.random.rand(len(changeIdxs)) * 2.0 * self.maxDither - self.maxDither
 
-            rotOffset = np.zeros(len(simData), float)
-            for i, (c, cn) in enumerate(zip(changeIdxs, changeIdxs[1:])):
-                rotOffset[c+1:cn+1] = randomOffsets[i]
-            rotOffset[changeIdxs[-1]+1:] = randomOffsets[-1]
+            # Each visit takes the offset of the most recent filter change (none before the first).
+            segment = np.zeros(len(simData), int)
+            segment[changeIdxs + 1] = 1
+            segment = np.cumsum(segment)
+            rotOffset = np.concatenate([[0.], randomOffsets])[segment]
 
         # Add the random offsets to the RotTelPos values and convert to radians if required.
         if not self.degrees:
@@ -103,8 +103,28 @@ class ZenithDistStacker(BaseStacker):
 
 class ParallaxFactorStacker(BaseStacker):
     """Calculate the parallax factors for each opsim pointing.  Output parallax factor in arcseconds.
+
+    The apparent places are calculated as by palpy.mapqk, but with numpy for all pointings at once.
+    The star-independent parameters (palpy.mappa) are calculated for each unique date, or, if there are
+    more unique dates than points in a table spaced by tableStep days over the range of dates,
+    interpolated from such a table. The default tableStep (0.25 days) gives parallax factors within
+    1e-5 arcseconds of calling palpy.mappa for every pointing.
+
+    Parameters
+    ----------
+    raCol : str, opt
+        Name of the RA column. Default fieldRA.
+    decCol : str, opt
+        Name of the Dec column. Default fieldDec.
+    dateCol : str, opt
+        Name of the date (MJD) column. Default observationStartMJD.
+    degrees : bool, opt
+        Flag indicating whether RA/Dec are in degrees. Default True.
+    tableStep : float, opt
+        The spacing (in days) of the table of palpy.mappa parameters. Default 0.25.
     """
-    def __init__(self, raCol='fieldRA', decCol='fieldDec', dateCol='observationStartMJD', degrees=True):
+    def __init__(self, raCol='fieldRA', decCol='fieldDec', dateCol='observationStartMJD', degrees=True,
+                 tableStep=0.25):
         self.raCol = raCol
         self.decCol = decCol
         self.dateCol = dateCol
@@ -112,6 +132,9 @@ class ParallaxFactorStacker(BaseStacker):
         self.colsAdded = ['ra_pi_amp', 'dec_pi_amp']
         self.colsReq = [raCol, decCol, dateCol]
         self.degrees = degrees
+        self.tableStep = tableStep
+        # Number of pointings to calculate at a time (to limit the memory used).
+        self._blockSize = 100000
 
     def _gnomonic_project_toxy(self, RA1, Dec1, RAcen, Deccen):
         """Calculate x/y projection of RA1/Dec1 in system with center at RAcen, Deccenp.
@@ -123,36 +146,83 @@ class ParallaxFactorStacker(BaseStacker):
         y = (np.cos(Deccen)*np.sin(Dec1) - np.sin(Deccen)*np.cos(Dec1)*np.cos(RA1-RAcen)) / cosc
         return x, y
 
+    def _mappaTable(self, mjd):
+        """Calculate palpy.mappa for each unique mjd, or on a grid spaced by tableStep if that is smaller.
+        """
+        tableMjd = np.unique(mjd)
+        if len(tableMjd) > 1:
+            grid = np.arange(tableMjd[0], tableMjd[-1] + self.tableStep, self.tableStep)
+            if len(grid) < len(tableMjd):
+                tableMjd = grid
+        table = np.array([palpy.mappa(2000., m) for m in tableMjd])
+        return tableMjd, table
+
+    def _mappa(self, mjd, tableMjd, table):
+        """Interpolate the palpy.mappa parameters for each mjd (exact, if mjd is in tableMjd)."""
+        if len(tableMjd) == 1:
+            return np.repeat(table, len(mjd), axis=0)
+        idx = np.clip(np.searchsorted(tableMjd, mjd, side='right') - 1, 0, len(tableMjd) - 2)
+        frac = ((mjd - tableMjd[idx]) / (tableMjd[idx + 1] - tableMjd[idx]))[:, np.newaxis]
+        return table[idx] * (1.0 - frac) + table[idx + 1] * frac
+
+    def _mapqk(self, ra, dec, px, amprms):
+        """Apparent RA/Dec of stars with parallax px (arcsec) and no proper motion or radial velocity,
+        given the palpy.mappa parameters for each star (following palpy.mapqk).
+        """
+        # Barycentric position of the Earth, heliocentric direction of the Earth, light deflection
+        # parameter, barycentric velocity of the Earth (in units of c), sqrt(1-v**2), and the
+        # precession-nutation matrix.
+        eb = amprms[:, 1:4]
+        ehn = amprms[:, 4:7]
+        gr2e = amprms[:, 7]
+        abv = amprms[:, 8:11]
+        ab1 = amprms[:, 11]
+        rnpb = amprms[:, 12:21].reshape(-1, 3, 3)
+        cosDec = np.cos(dec)
+        q = np.column_stack([np.cos(ra) * cosDec, np.sin(ra) * cosDec, np.sin(dec)])
+        # Geocentric direction of the star (normalized).
+        p = q - np.radians(px / 3600.) * eb
+        pn = p / np.sqrt(np.sum(p * p, axis=1))[:, np.newaxis]
+        # Light deflection (restrained within the Sun's disc).
+        pde = np.sum(pn * ehn, axis=1)
+        w = gr2e / np.maximum(pde + 1.0, 1e-5)
+        p1 = pn + w[:, np.newaxis] * (ehn - pde[:, np.newaxis] * pn)
+        # Aberration (normalization omitted).
+        p1dv = np.sum(p1 * abv, axis=1)
+        w = 1.0 + p1dv / (ab1 + 1.0)
+        p2 = ab1[:, np.newaxis] * p1 + w[:, np.newaxis] * abv
+        # Precession and nutation.
+        p3 = np.einsum('nij,nj->ni', rnpb, p2)
+        raApp = np.arctan2(p3[:, 1], p3[:, 0]) % (2.0 * np.pi)
+        decApp = np.arctan2(p3[:, 2], np.sqrt(p3[:, 0]**2 + p3[:, 1]**2))
+        return raApp, decApp
+
     def _run(self, simData, cols_present=False):
         if cols_present:
             # Column already present in data; assume it is correct and does not need recalculating.
             return simData
-        ra_pi_amp = np.zeros(np.size(simData), dtype=[('ra_pi_amp', 'float')])
-        dec_pi_amp = np.zeros(np.size(simData), dtype=[('dec_pi_amp', 'float')])
-        ra_geo1 = np.zeros(np.size(simData), dtype='float')
-        dec_geo1 = np.zeros(np.size(simData), dtype='float')
-        ra_geo = np.zeros(np.size(simData), dtype='float')
-        dec_geo = np.zeros(np.size(simData), dtype='float')
         ra = simData[self.raCol]
         dec = simData[self.decCol]
         if self.degrees:
             ra = np.radians(ra)
             dec = np.radians(dec)
-
-        for i, ack in enumerate(simData):
-            mtoa_params = palpy.mappa(2000., simData[self.dateCol][i])
+        mjd = np.asarray(simData[self.dateCol], float)
+        ra_pi_amp = np.zeros(np.size(simData), dtype='float')
+        dec_pi_amp = np.zeros(np.size(simData), dtype='float')
+        if np.size(simData) > 0:
+            tableMjd, table = self._mappaTable(mjd)
+        for start in range(0, np.size(simData), self._blockSize):
+            block = slice(start, start + self._blockSize)
+            amprms = self._mappa(mjd[block], tableMjd, table)
             # Object with a 1 arcsec parallax
-            ra_geo1[i], dec_geo1[i] = palpy.mapqk(ra[i], dec[i],
-                                                  0., 0., 1., 0., mtoa_params)
+            ra_geo1, dec_geo1 = self._mapqk(ra[block], dec[block], 1., amprms)
             # Object with no parallax
-            ra_geo[i], dec_geo[i] = palpy.mapqk(ra[i], dec[i],
-                                                0., 0., 0., 0., mtoa_params)
-        x_geo1, y_geo1 = self._gnomonic_project_toxy(ra_geo1, dec_geo1,
-                                                     ra, dec)
-        x_geo, y_geo = self._gnomonic_project_toxy(ra_geo, dec_geo, ra, dec)
-        # Return ra_pi_amp and dec_pi_amp in arcseconds.
-        ra_pi_amp[:] = np.degrees(x_geo1-x_geo)*3600.
-        dec_pi_amp[:] = np.degrees(y_geo1-y_geo)*3600.
+            ra_geo, dec_geo = self._mapqk(ra[block], dec[block], 0., amprms)
+            x_geo1, y_geo1 = self._gnomonic_project_toxy(ra_geo1, dec_geo1, ra[block], dec[block])
+            x_geo, y_geo = self._gnomonic_project_toxy(ra_geo, dec_geo, ra[block], dec[block])
+            # Return ra_pi_amp and dec_pi_amp in arcseconds.
+            ra_pi_amp[block] = np.degrees(x_geo1-x_geo)*3600.
+            dec_pi_amp[block] = np.degrees(y_geo1-y_geo)*3600.
         simData['ra_pi_amp'] = ra_pi_amp
         simData['dec_pi_amp'] = dec_pi_amp
         return simData
@@ -10,51 +10,85 @@ class ColInfo(object):
 
     The stacker classes which will generate stacker columns are tracked here, as well as
     some default units for common opsim columns.
+    The columns (and units) added by each registered stacker class are found the first time they are
+    needed, and are kept in a registry shared by all ColInfo objects, so that each stacker class is only
+    instantiated once (and creating a ColInfo object is cheap).
 
     Inspect ColInfo.unitDict for more information."""
+    # Registry of stacker class : list of (column, units) added by the stacker class.
+    stackerCols = {}
+
     def __init__(self):
         self.defaultDataSource = None
         self.defaultUnit = ''
-        self.unitDict = {'fieldId': '#',
-                         'filter': 'filter',
-                         'seqnNum': '#',
-                         'expMJD': 'MJD',
-                         'observationStartMJD': 'MJD',
-                         'observationStartLST': 'deg',
-                         'visitExposureTime': 's',
-                         'slewTime': 's',
-                         'slewDist': 'rad',
-                         'rotSkyPos': 'deg',
-                         'rotTelPos': 'deg',
-                         'rawSeeing': 'arcsec',
-                         'finSeeing': 'arcsec',
-                         'FWHMeff': 'arcsec',
-                         'FWHMgeom': 'arcsec',
-                         'seeingFwhmEff': 'arcsec',
-                         'seeingFwhmGeom': 'arcsec',
-                         'seeingFwhm500': 'arcsec',
-                         'seeing': 'arcsec',
-                         'airmass': 'X',
-                         'night': 'days',
-                         'moonRA': 'rad',
-                         'moonDec': 'rad',
-                         'moonAlt': 'rad',
-                         'dist2Moon': 'rad',
-                         'filtSkyBrightness': 'mag/sq arcsec',
-                         'skyBrightness': 'mag/sq arcsec',
-                         'fiveSigmaDepth': 'mag',
-                         'solarElong': 'degrees'}
+        self.defaultUnitDict = {'fieldId': '#',
+                                'filter': 'filter',
+                                'seqnNum': '#',
+                                'expMJD': 'MJD',
+                                'observationStartMJD': 'MJD',
+                                'observationStartLST': 'deg',
+                                'visitExposureTime': 's',
+                                'slewTime': 's',
+                                'slewDist': 'rad',
+                                'rotSkyPos': 'deg',
+                                'rotTelPos': 'deg',
+                                'rawSeeing': 'arcsec',
+                                'finSeeing': 'arcsec',
+                                'FWHMeff': 'arcsec',
+                                'FWHMgeom': 'arcsec',
+                                'seeingFwhmEff': 'arcsec',
+                                'seeingFwhmGeom': 'arcsec',
+                                'seeingFwhm500': 'arcsec',
+                                'seeing': 'arcsec',
+                                'airmass': 'X',
+                                'night': 'days',
+                                'moonRA': 'rad',
+                                'moonDec': 'rad',
+                                'moonAlt': 'rad',
+                                'dist2Moon': 'rad',
+                                'filtSkyBrightness': 'mag/sq arcsec',
+                                'skyBrightness': 'mag/sq arcsec',
+                                'fiveSigmaDepth': 'mag',
+                                'solarElong': 'degrees'}
+        self._unitDict = None
+        self._sourceDict = None
+        # The registry of stacker classes (a copy) when unitDict and sourceDict were built.
+        self._registry = None
+
+    @classmethod
+    def stackerColumns(cls, stackerClass):
+        """Return the list of (column, units) added by stackerClass (instantiating it only once)."""
+        if stackerClass not in cls.stackerCols:
+            stacker = stackerClass()
+            cls.stackerCols[stackerClass] = list(zip(stacker.colsAdded, stacker.units))
+        return cls.stackerCols[stackerClass]
+
+    def _update(self):
+        """Build unitDict and sourceDict, if the registered stacker classes changed since they were built."""
+        if self._registry == BaseStacker.registry:
+            return
+        self._unitDict = dict(self.defaultUnitDict)
+        self._sourceDict = {}
         # Go through the available stackers and add any units, and identify their
         #   source methods.
-        self.sourceDict = {}
-        for stackerClass in BaseStacker.registry.values():
-            stacker = stackerClass()
-            for col, units in zip(stacker.colsAdded, stacker.units):
-                self.sourceDict[col] = stackerClass
-                self.unitDict[col] = units
+        for stackerClass in list(BaseStacker.registry.values()):
+            for col, units in self.stackerColumns(stackerClass):
+                self._sourceDict[col] = stackerClass
+                self._unitDict[col] = units
+        self._registry = dict(BaseStacker.registry)
         # Note that a 'unique' list of methods should be built from the resulting returned
         #  methods, at whatever point the derived data columns will be calculated. (i.e. in the driver)
 
+    @property
+    def unitDict(self):
+        self._update()
+        return self._unitDict
+
+    @property
+    def sourceDict(self):
+        self._update()
+        return self._sourceDict
+
     def getUnits(self, colName):
         """Return the appropriate units for colName.
 
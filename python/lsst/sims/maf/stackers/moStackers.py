@@ -2,19 +2,65 @@ import numpy as np
 from .baseStacker import BaseStacker
 import warnings
 
-__all__ = ['BaseMoStacker', 'MoMagStacker', 'EclStacker']
+__all__ = ['selectH', 'BaseMoStacker', 'MoMagStacker', 'EclStacker']
+
+
+def selectH(ssoObs, j):
+    """Return a view of ssoObs for a single H value.
+
+    When the moving object stackers are run with an array of H values, the columns which depend on H
+    (such as appMag, SNR and vis) are 2-d (nObs x nH). This returns a view (not a copy) of ssoObs in which
+    these columns hold only the values for the j-th H value, so it can be used with the single-H metrics.
+
+    Parameters
+    ----------
+    ssoObs : np.ndarray
+        The observations of an object (a numpy structured array).
+    j : int
+        The index of the H value.
+
+    Returns
+    -------
+    np.recarray
+    """
+    names = ssoObs.dtype.names
+    formats = []
+    offsets = []
+    for name in names:
+        dtype, offset = ssoObs.dtype.fields[name][:2]
+        if dtype.subdtype is not None:
+            dtype = dtype.subdtype[0]
+            offset += j * dtype.itemsize
+        formats.append(dtype)
+        offsets.append(offset)
+    dtype = np.dtype({'names': names, 'formats': formats, 'offsets': offsets,
+                      'itemsize': ssoObs.dtype.itemsize})
+    return ssoObs.view(dtype=dtype, type=np.recarray)
 
 
 class BaseMoStacker(BaseStacker):
     """Base class for moving object stackers.
 
-    Provided to add moving-object specific API for 'run' method of moving object stackers."""
+    Provided to add moving-object specific API for 'run' method of moving object stackers.
+
+    Stackers which can calculate their columns for many H values at once should set colsAddedH to the
+    list of the colsAdded which depend on H (possibly empty); these columns are added as 2-d (nObs x nH)
+    columns when the stacker is run with an array of H values.
+    Such stackers should also accept an array of Href values (one per observation), with Hval as either
+    a 1-d array of H values or a 2-d (nObs x nH) array, so that they can be run once on the
+    observations of many objects (see MoObjSlicer.runStackers).
+    """
+    colsAddedH = None
+
     def run(self, ssoObs, Href, Hval=None):
         # Redefine this here, as the API does not match BaseStacker.
         if Hval is None:
             Hval = Href
         if len(ssoObs) == 0:
             return ssoObs
+        if np.ndim(Hval) > 0:
+            ssoObs = self._addStackerColsH(ssoObs, np.shape(Hval)[-1])
+            return self._run(ssoObs, Href, np.asarray(Hval, float))
         # Add the columns.
         with warnings.catch_warnings():
             warnings.simplefilter('ignore')
@@ -23,6 +69,26 @@ class BaseMoStacker(BaseStacker):
         # columns anymore (for different H values).
         return self._run(ssoObs, Href, Hval)
 
+    def _addStackerColsH(self, ssoObs, nH):
+        """Add the stacker columns to ssoObs, with the columns which depend on H as 2-d (nObs x nH)."""
+        if self.colsAddedH is None:
+            raise ValueError('Stacker %s cannot be run with an array of H values.'
+                             % (self.__class__.__name__))
+        if not hasattr(self, 'colsAddedDtypes') or self.colsAddedDtypes is None:
+            self.colsAddedDtypes = [float for col in self.colsAdded]
+        # Existing columns are replaced, as they may have been added with a different number of H values.
+        newdtype = [(col, ssoObs.dtype[col]) for col in ssoObs.dtype.names if col not in self.colsAdded]
+        for col, dtype in zip(self.colsAdded, self.colsAddedDtypes):
+            if col in self.colsAddedH:
+                newdtype.append((col, dtype, (nH,)))
+            else:
+                newdtype.append((col, dtype))
+        newData = np.empty(ssoObs.shape, dtype=newdtype)
+        for col in ssoObs.dtype.names:
+            if col not in self.colsAdded:
+                newData[col] = ssoObs[col]
+        return newData
+
 
 class MoMagStacker(BaseMoStacker):
     """Add columns relevant to moving object apparent magnitudes and visibility to the slicer ssoObs
@@ -65,15 +131,31 @@ class MoMagStacker(BaseMoStacker):
         self.sigma = sigma
         self.colsReq = [self.magFilterCol, self.m5Col, self.lossCol]
         self.colsAdded = ['appMagV', 'appMag', 'SNR', 'vis']
+        self.colsAddedH = ['appMagV', 'appMag', 'SNR', 'vis']
         self.units = ['mag', 'mag', 'SNR', '']
 
     def _run(self, ssoObs, Href, Hval):
-        ssoObs['appMagV'] = ssoObs[self.vMagCol] + Hval - Href + ssoObs[self.lossCol]
-        ssoObs['appMag'] = ssoObs[self.magFilterCol] + Hval - Href + ssoObs[self.lossCol]
-        xval = np.power(10, 0.5 * (ssoObs['appMag'] - ssoObs[self.m5Col]))
+        magV = ssoObs[self.vMagCol]
+        magFilter = ssoObs[self.magFilterCol]
+        loss = ssoObs[self.lossCol]
+        m5 = ssoObs[self.m5Col]
+        if np.ndim(Hval) > 0:
+            # Calculate the values for all of the H values at once, as nObs x nH arrays.
+            # Href may be the H value of the object of each observation.
+            dH = np.atleast_2d(Hval) - np.reshape(Href, (-1, 1))
+            magV = magV[:, np.newaxis]
+            magFilter = magFilter[:, np.newaxis]
+            loss = loss[:, np.newaxis]
+            m5 = m5[:, np.newaxis]
+        else:
+            dH = Hval - Href
+        ssoObs['appMagV'] = magV + dH + loss
+        appMag = magFilter + dH + loss
+        ssoObs['appMag'] = appMag
+        xval = np.power(10, 0.5 * (appMag - m5))
         ssoObs['SNR'] = 1.0 / np.sqrt((0.04 - self.gamma) * xval + self.gamma * xval * xval)
-        completeness = 1.0 / (1 + np.exp((ssoObs['appMag'] - ssoObs[self.m5Col])/self.sigma))
-        probability = np.random.random_sample(len(ssoObs['appMag']))
+        completeness = 1.0 / (1 + np.exp((appMag - m5)/self.sigma))
+        probability = np.random.random_sample(appMag.shape)
         ssoObs['vis'] = np.where(probability <= completeness, 1, 0)
         return ssoObs
 
@@ -97,9 +179,12 @@ class EclStacker(BaseMoStacker):
         self.inDeg = inDeg
         self.colsReq = [self.raCol, self.decCol]
         self.colsAdded = ['ecLat', 'ecLon']
+        self.colsAddedH = []
         self.units = ['deg', 'deg']
         self.ecnode = 0.0
         self.ecinc = np.radians(23.439291)
+        self._cosEcinc = np.cos(self.ecinc)
+        self._sinEcinc = np.sin(self.ecinc)
 
     def _run(self, ssoObs, Href, Hval):
         ra = ssoObs[self.raCol]
@@ -107,13 +192,13 @@ class EclStacker(BaseMoStacker):
         if self.inDeg:
             ra = np.radians(ra)
             dec = np.radians(dec)
-        x = np.cos(ra) * np.cos(dec)
-        y = np.sin(ra) * np.cos(dec)
+        cosDec = np.cos(dec)
+        x = np.cos(ra) * cosDec
+        y = np.sin(ra) * cosDec
         z = np.sin(dec)
         xp = x
-        yp = np.cos(self.ecinc)*y + np.sin(self.ecinc)*z
-        zp = -np.sin(self.ecinc)*y + np.cos(self.ecinc)*z
+        yp = self._cosEcinc*y + self._sinEcinc*z
+        zp = -self._sinEcinc*y + self._cosEcinc*z
         ssoObs['ecLat'] = np.degrees(np.arcsin(zp))
-        ssoObs['ecLon'] = np.degrees(np.arctan2(yp, xp))
-        ssoObs['ecLon'] = ssoObs['ecLon'] % 360
+        ssoObs['ecLon'] = np.degrees(np.arctan2(yp, xp)) % 360
         return ssoObs
@@ -1,7 +1,7 @@
 from builtins import zip
 import numpy as np
+from lsst.sims.utils import calcLmstLast
 from .baseStacker import BaseStacker
-from .coordStackers import raDec2AltAz
 
 __all__ = ['findTelescopes', 'NFollowStacker']
 
@@ -133,6 +133,8 @@ class NFollowStacker(BaseStacker):
         self.airmassLimit = airmassLimit
         self.timeSteps = timeSteps
         self.telescopes = findTelescopes(minSize = minSize)
+        # Number of visits to calculate at a time (to limit the memory used).
+        self._blockSize = 50000
 
     def _run(self, simData, cols_present=False):
         if cols_present:
@@ -143,20 +145,27 @@ class NFollowStacker(BaseStacker):
         else:
             ra = simData[self.raCol]
             dec = simData[self.decCol]
-        for obs in self.telescopes:
-            obsGotIt = np.zeros(len(simData[self.raCol]), int)
-            obsLon = np.radians(obs['lon'])
-            obsLat = np.radians(obs['lat'])
-            for step in self.timeSteps:
-                alt, az = raDec2AltAz(ra, dec, obsLon, obsLat,
-                                      simData[self.mjdCol] + step / 24.0,
-                                      altonly=True)
-                airmass = 1. / (np.cos(np.pi / 2. - alt))
-                followed = np.where((airmass <= self.airmassLimit) & (airmass >= 1.))
-                # If the observatory got an observation, save this into obsGotIt.
-                # obsGotIt will be 1 if ANY of the times got an observation.
-                obsGotIt[followed] = 1
-            # If an observatory got an observation, count it in nObservatories.
-            simData['nObservatories'] += obsGotIt
+        # Telescopes at the same site can follow up the same visits, so check each site only once.
+        sites, nScopes = np.unique(np.array([self.telescopes['lat'], self.telescopes['lon']]).T, axis=0,
+                                   return_counts=True)
+        siteLon = np.radians(sites[:, 1])
+        sinLat = np.sin(np.radians(sites[:, 0]))
+        cosLat = np.cos(np.radians(sites[:, 0]))
+        # The airmass (1/sin(alt)) must be between 1 and airmassLimit.
+        minSinAlt = 1. / self.airmassLimit
+        timeSteps = np.atleast_1d(self.timeSteps) / 24.0
+        for start in range(0, len(simData), self._blockSize):
+            block = slice(start, start + self._blockSize)
+            # The local sidereal time at longitude 0, for each visit (axis 0) and time step (axis 1).
+            lmst, last = calcLmstLast((simData[self.mjdCol][block, np.newaxis] + timeSteps).ravel(), 0.)
+            lmst = np.reshape(lmst / 12. * np.pi, (-1, len(timeSteps)))
+            # Hour angle (and altitude) at each site (axis 2).
+            ha = lmst[:, :, np.newaxis] + siteLon - ra[block, np.newaxis, np.newaxis]
+            sinalt = (np.sin(dec[block])[:, np.newaxis, np.newaxis] * sinLat +
+                      np.cos(dec[block])[:, np.newaxis, np.newaxis] * cosLat * np.cos(ha))
+            # A site can follow up the visit if it is within the airmass limit at ANY of the times.
+            followed = np.any(sinalt >= minSinAlt, axis=1)
+            # Count each telescope at the sites which could follow up the visit.
+            simData['nObservatories'][block] = np.dot(followed, nScopes)
 
         return simData
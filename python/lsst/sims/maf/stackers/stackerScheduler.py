@@ -0,0 +1,149 @@
+from builtins import zip
+from builtins import object
+import warnings
+import numpy as np
+from .baseStacker import BaseStacker
+
+__all__ = ['StackerScheduler']
+
+
+class StackerScheduler(object):
+    """Run stackers on a simData array, sharing the results between sets of stackers.
+
+    The stackers are run in order of their dependencies (a stacker which requires a column added by
+    another stacker is run after it), and the columns added by all of the stackers are allocated at once,
+    in a single copy of simData. The scheduler remembers which stacker calculated each column, so that
+    a later, equivalent stacker (according to BaseStacker.__eq__) is not run again; a stacker with
+    a different configuration recalculates (overwrites) the columns.
+
+    The scheduler should be reset (or a new scheduler used) whenever simData is replaced with new data.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget which stackers have been run."""
+        # Dictionary of column name : the stacker which calculated the column.
+        self.colSource = {}
+
+    def _colsAddedDtypes(self, stacker):
+        dtypes = getattr(stacker, 'colsAddedDtypes', None)
+        if dtypes is None:
+            dtypes = [float for col in stacker.colsAdded]
+        return dtypes
+
+    def _isDone(self, stacker):
+        """Check if the columns of stacker were calculated by an equivalent stacker."""
+        for col in stacker.colsAdded:
+            if col not in self.colSource:
+                return False
+            # Compare in this order, so that only the (configuration) attributes of the stacker which
+            # has not yet been run are considered.
+            if not stacker == self.colSource[col]:
+                return False
+        return True
+
+    def order(self, stackerList):
+        """Order stackers so that each stacker runs after the stackers which add the columns it requires.
+
+        Parameters
+        ----------
+        stackerList : list of lsst.sims.maf.stackers.BaseStacker
+            The stackers to order.
+
+        Returns
+        -------
+        list of lsst.sims.maf.stackers.BaseStacker
+            The stackers, in an order consistent with their dependencies (and otherwise in their
+            original order). If the dependencies are circular, the original order is returned.
+        """
+        nstackers = len(stackerList)
+        dependsOn = []
+        for s in stackerList:
+            colsReq = set(s.colsReq)
+            dependsOn.append(set([j for j, t in enumerate(stackerList)
+                                  if t is not s and len(colsReq.intersection(t.colsAdded)) > 0]))
+        ordered = []
+        done = set()
+        while len(ordered) < nstackers:
+            ready = [i for i in range(nstackers) if i not in done and dependsOn[i].issubset(done)]
+            if len(ready) == 0:
+                warnings.warn('Could not determine the order of stackers %s (circular dependency); '
+                              'running them in the order given.'
+                              % ([s.__class__.__name__ for s in stackerList]))
+                return list(stackerList)
+            # Take the first stacker which is ready, to keep the original order where possible.
+            done.add(ready[0])
+            ordered.append(stackerList[ready[0]])
+        return ordered
+
+    def run(self, simData, stackerList):
+        """Add the columns of the stackers in stackerList to simData, running only the stackers needed.
+
+        Parameters
+        ----------
+        simData : numpy.ndarray
+            The simulated data (a numpy structured array).
+        stackerList : list of lsst.sims.maf.stackers.BaseStacker
+            The stackers to run.
+
+        Returns
+        -------
+        numpy.ndarray
+            simData, including the columns added by the stackers.
+        """
+        if len(simData) == 0:
+            return simData
+        toRun = []
+        for s in stackerList:
+            if self._isDone(s):
+                continue
+            if True in [s is t or s == t for t in toRun]:
+                continue
+            toRun.append(s)
+        if len(toRun) == 0:
+            return simData
+        toRun = self.order(toRun)
+        # Columns which were present in simData before any stacker was run (e.g. from the database).
+        inputCols = set([col for col in simData.dtype.names if col not in self.colSource])
+        # Allocate all new columns at once.
+        newdtype = simData.dtype.descr
+        newCols = set()
+        for s in toRun:
+            for col, dtype in zip(s.colsAdded, self._colsAddedDtypes(s)):
+                if col not in simData.dtype.names and col not in newCols:
+                    newdtype += [(col, dtype)]
+                    newCols.add(col)
+        if len(newCols) > 0:
+            newData = np.empty(simData.shape, dtype=newdtype)
+            for col in simData.dtype.names:
+                newData[col] = simData[col]
+            simData = newData
+        for s in toRun:
+            runClass = [c for c in type(s).__mro__ if 'run' in c.__dict__][0]
+            if runClass is not BaseStacker:
+                # This stacker defines its own run method, so just use it.
+                simData = s.run(simData)
+            else:
+                simData = self._runStacker(s, simData, inputCols)
+            for col in s.colsAdded:
+                self.colSource[col] = s
+        return simData
+
+    def _runStacker(self, stacker, simData, inputCols):
+        # As in BaseStacker._addStackerCols, the stacker may choose not to recalculate columns
+        # which were already present in the input simData.
+        colsPresent = [col in inputCols and simData[col][0] is not None for col in stacker.colsAdded]
+        for col, present in zip(stacker.colsAdded, colsPresent):
+            if present:
+                warnings.warn('Warning - column %s already present in simData, may be overwritten '
+                              '(depending on stacker).' % (col))
+        colsPresent = (sum(colsPresent) == len(stacker.colsAdded))
+        try:
+            return stacker._run(simData, colsPresent)
+        except TypeError:
+            warnings.warn('Please update the stacker %s so that the _run method matches the current API. '
+                          'This will give you the option to skip re-running stackers if the columns are '
+                          'already present.'
+                          % (stacker.__class__.__name__))
+            return stacker._run(simData)
@@ -0,0 +1,205 @@
+import os
+import hashlib
+import warnings
+import numpy as np
+from lsst.sims.utils import Site
+
+__all__ = ['defaultEphemerisCacheDir', 'NightEphemeris']
+
+# The default directory in which to save ephemeris tables between runs: the SIMS_MAF_CACHE_DIR
+#  environment variable if set, otherwise None (the tables are not saved to disk).
+defaultEphemerisCacheDir = os.environ.get('SIMS_MAF_CACHE_DIR')
+
+# Ephemeris tables already calculated (or read) in this process, keyed by NightEphemeris._tableKey.
+# The tables only grow, as more nights are requested.
+_ephemerisTables = {}
+
+# Increment if the contents of the table change, so that tables saved on disk are recalculated.
+_tableVersion = 1
+
+# The setting and rising columns of the table, with the sun altitude (degrees) of each.
+_horizons = [('sunset', 'sunrise', '0'), ('twi6_set', 'twi6_rise', '-6'),
+             ('twi12_set', 'twi12_rise', '-12'), ('twi18_set', 'twi18_rise', '-18')]
+_columns = ['night', 'midnight'] + [col for h in _horizons for col in h[:2]] + ['moonPhase']
+
+
+class NightEphemeris(object):
+    """Sun and moon ephemeris for each night at a site, calculated with pyephem once and then looked up.
+
+    Each night of the table is identified by its local midnight (the antitransit of the sun), and gives
+    the preceding sunset / evening twilights and following sunrise / morning twilights (all using the
+    center of the sun, with a horizon of 0, -6, -12 and -18 degrees), and the moon phase (percent
+    illuminated) at midnight. All times are MJD.
+    The table is extended as required to cover the dates requested, and is shared between all
+    NightEphemeris objects for the same site (and saved in cacheDir, for later runs).
+
+    Parameters
+    ----------
+    site : lsst.sims.utils.Site, optional
+        The site of the observatory. Default None uses Site(name='LSST').
+    cacheDir : str, optional
+        Directory in which to save the ephemeris table for each site, so that it can be read rather
+        than recalculated in later runs. None saves nothing to disk.
+        Default defaultEphemerisCacheDir ($SIMS_MAF_CACHE_DIR if set, otherwise None).
+    """
+    def __init__(self, site=None, cacheDir=defaultEphemerisCacheDir):
+        if site is None:
+            site = Site(name='LSST')
+        self.latitude = site.latitude_rad
+        self.longitude = site.longitude_rad
+        self.elevation = site.height
+        self.cacheDir = cacheDir
+
+    def _tableKey(self):
+        """Generate a key identifying the ephemeris table for this site."""
+        h = hashlib.sha1()
+        h.update(repr((self.latitude, self.longitude, self.elevation, _tableVersion)).encode('utf-8'))
+        return h.hexdigest()
+
+    def _cacheFile(self):
+        return os.path.join(self.cacheDir, 'nightEphemeris_%s.npy' % self._tableKey())
+
+    def _nightIds(self, mjd):
+        """The night identifier for each MJD: the integer MJD nearest to local midnight."""
+        return np.round(np.asarray(mjd, float) + self.longitude / (2.0 * np.pi)).astype(int)
+
+    def _calcNights(self, nightIds):
+        """Calculate the ephemeris table rows for nightIds, using pyephem."""
+        import ephem
+        # pyephem uses 1899 as it's zero-day, and MJD has Nov 17 1858 as zero-day.
+        doff = ephem.Date(0) - ephem.Date('1858/11/17')
+        observers = []
+        for setCol, riseCol, horizon in _horizons:
+            obs = ephem.Observer()
+            obs.lat, obs.lon, obs.elevation = self.latitude, self.longitude, self.elevation
+            obs.horizon = horizon
+            observers.append((setCol, riseCol, obs))
+        sun = ephem.Sun()
+        moon = ephem.Moon()
+        table = np.zeros(len(nightIds), dtype=list(zip(_columns, [int] + [float] * (len(_columns) - 1))))
+        table['night'] = nightIds
+        for i, night in enumerate(nightIds):
+            # Local midnight falls within about 20 minutes of this (at the night's integer MJD).
+            start = night - self.longitude / (2.0 * np.pi) - 0.5 - doff
+            midnight = observers[0][2].next_antitransit(sun, start=start)
+            table['midnight'][i] = midnight + doff
+            moon.compute(midnight)
+            table['moonPhase'][i] = moon.phase
+            for setCol, riseCol, obs in observers:
+                try:
+                    table[setCol][i] = obs.previous_setting(sun, start=midnight, use_center=True) + doff
+                    table[riseCol][i] = obs.next_rising(sun, start=midnight, use_center=True) + doff
+                except ephem.CircumpolarError:
+                    # The sun does not cross this horizon tonight (only at high latitudes).
+                    table[setCol][i] = np.nan
+                    table[riseCol][i] = np.nan
+        return table
+
+    def _readTable(self):
+        """Read the ephemeris table for this site from cacheDir, if available (and readable)."""
+        if self.cacheDir is None or not os.path.isfile(self._cacheFile()):
+            return None
+        try:
+            table = np.load(self._cacheFile())
+        except (IOError, OSError, ValueError, EOFError) as e:
+            warnings.warn('Could not read ephemeris table %s (%s); recalculating.' % (self._cacheFile(), e))
+            return None
+        if table.dtype.names is None or list(table.dtype.names) != _columns:
+            warnings.warn('Ephemeris table %s has unexpected columns; recalculating.' % (self._cacheFile()))
+            return None
+        return table
+
+    def _writeTable(self, table):
+        """Save the ephemeris table for this site into cacheDir (if set)."""
+        if self.cacheDir is None:
+            return
+        try:
+            if not os.path.isdir(self.cacheDir):
+                os.makedirs(self.cacheDir)
+            # Write to a temporary file and rename, so concurrent runs never read a partial file.
+            tmpfile = self._cacheFile() + '.%d.tmp' % os.getpid()
+            with open(tmpfile, 'wb') as f:
+                np.save(f, table)
+            os.rename(tmpfile, self._cacheFile())
+        except (IOError, OSError) as e:
+            warnings.warn('Could not save ephemeris table to %s: %s' % (self.cacheDir, e))
+
+    def _getTable(self, mjdMin, mjdMax):
+        """Return the ephemeris table for this site, covering at least the nights from mjdMin to mjdMax."""
+        key = self._tableKey()
+        table = _ephemerisTables.get(key)
+        if table is None:
+            table = self._readTable()
+        # Pad by a night either side, so that nearest midnights can always be found.
+        first, last = self._nightIds([mjdMin, mjdMax]) + np.array([-1, 1])
+        if table is None or len(table) == 0:
+            table = self._calcNights(np.arange(first, last + 1))
+            self._writeTable(table)
+        elif first < table['night'][0] or last > table['night'][-1]:
+            before = self._calcNights(np.arange(first, table['night'][0]))
+            after = self._calcNights(np.arange(table['night'][-1] + 1, last + 1))
+            table = np.concatenate([before, table, after])
+            self._writeTable(table)
+        _ephemerisTables[key] = table
+        return table
+
+    def getNights(self, mjdStart, mjdEnd):
+        """Return the ephemeris for each night with local midnight between mjdStart and mjdEnd.
+
+        Parameters
+        ----------
+        mjdStart : float
+            The earliest local midnight (MJD).
+        mjdEnd : float
+            The latest local midnight (MJD).
+
+        Returns
+        -------
+        numpy.ndarray
+            The ephemeris table rows, with columns night, midnight, sunset, sunrise, twi6_set, twi6_rise,
+            twi12_set, twi12_rise, twi18_set, twi18_rise and moonPhase.
+        """
+        table = self._getTable(mjdStart, mjdEnd)
+        left = np.searchsorted(table['midnight'], mjdStart, side='left')
+        right = np.searchsorted(table['midnight'], mjdEnd, side='right')
+        return table[left:right]
+
+    def nearestNight(self, mjd):
+        """Return the ephemeris of the night with local midnight nearest to each mjd.
+
+        Parameters
+        ----------
+        mjd : numpy.ndarray
+            The times (MJD).
+
+        Returns
+        -------
+        numpy.ndarray
+            The ephemeris table row for each mjd (see getNights).
+        """
+        mjd = np.asarray(mjd, float)
+        if mjd.size == 0:
+            return self._calcNights([])
+        table = self._getTable(mjd.min(), mjd.max())
+        idx = np.clip(np.searchsorted(table['midnight'], mjd), 1, len(table) - 1)
+        earlier = (mjd - table['midnight'][idx - 1]) <= (table['midnight'][idx] - mjd)
+        return table[idx - earlier]
+
+    def moonPhase(self, mjd):
+        """Return the moon phase (percent illuminated) at each mjd, interpolated between midnights.
+
+        Parameters
+        ----------
+        mjd : numpy.ndarray
+            The times (MJD).
+
+        Returns
+        -------
+        numpy.ndarray
+            The moon phase at each mjd (within about 0.3 percent).
+        """
+        mjd = np.asarray(mjd, float)
+        if mjd.size == 0:
+            return np.zeros(0, float)
+        table = self._getTable(mjd.min(), mjd.max())
+        return np.interp(mjd, table['midnight'], table['moonPhase'])
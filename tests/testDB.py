@@ -45,6 +45,18 @@ class TestDb(unittest.TestCase):
         self.assertEqual(data.dtype.names, ('fieldId', 'ra', 'dec'))
         self.assertEqual(len(data), 3)
 
+    def testQueryColumnsChunks(self):
+        """Test chunked queries return the same data as a single fetch."""
+        basedb = db.Database(database=self.database, driver=self.driver)
+        cols = ['fieldId', 'ra', 'dec']
+        data = basedb.query_columns('Field', colnames=cols, sqlconstraint='dec > 0', chunksize=None)
+        chunked = basedb.query_columns('Field', colnames=cols, sqlconstraint='dec > 0', chunksize=100)
+        np.testing.assert_array_equal(data, chunked)
+        chunks = list(basedb.query_columns_chunks('Field', colnames=cols, sqlconstraint='dec > 0',
+                                                  chunksize=100))
+        self.assertTrue(max([len(c) for c in chunks]) <= 100)
+        np.testing.assert_array_equal(data, np.concatenate(chunks))
+
     def testSqliteFileNotExists(self):
         """Test that db gives useful error message if db file doesn't exist."""
         self.assertRaises(IOError, db.Database, 'thisdatabasedoesntexist_sqlite.db')
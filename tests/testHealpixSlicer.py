@@ -5,6 +5,9 @@ import numpy as np
 import numpy.lib.recfunctions as rfn
 import numpy.ma as ma
 import unittest
+import os
+import shutil
+import tempfile
 import healpy as hp
 from lsst.sims.maf.slicers.healpixSlicer import HealpixSlicer
 import lsst.utils.tests
@@ -191,6 +194,53 @@ class TestHealpixSlicerSlicing(unittest.TestCase):
                 sidxs = np.sort(sidxs)
                 np.testing.assert_equal(self.dv['testdata'][didxs], self.dv['testdata'][sidxs])
 
+    def testSliceIndex(self):
+        """Test the CSR slice index matches the slices, and is reused by an equivalent slicer."""
+        sliceIndexCache = {}
+        self.testslicer.setupSlicer(self.dv, sliceIndexCache=sliceIndexCache)
+        self.assertEqual(len(sliceIndexCache), 1)
+        indexPtr, indices = self.testslicer.getSliceIndex()
+        self.assertEqual(len(indexPtr), len(self.testslicer) + 1)
+        self.assertEqual(indexPtr[-1], len(indices))
+        for i, s in enumerate(self.testslicer):
+            np.testing.assert_equal(np.sort(s['idxs']), np.sort(indices[indexPtr[i]:indexPtr[i+1]]))
+        otherslicer = HealpixSlicer(nside=self.nside, verbose=False,
+                                    lonCol='ra', latCol='dec', latLonDeg=False,
+                                    radius=self.radius)
+        otherslicer.setupSlicer(self.dv, sliceIndexCache=sliceIndexCache)
+        self.assertIs(otherslicer.getSliceIndex()[1], indices)
+        # Without the shared cache, the slice index is rebuilt (and nothing is held elsewhere in memory).
+        otherslicer.setupSlicer(self.dv)
+        self.assertIsNot(otherslicer.getSliceIndex()[1], indices)
+        np.testing.assert_equal(otherslicer.getSliceIndex()[1], indices)
+        # A slicer with different matching parameters does not reuse it.
+        otherslicer = HealpixSlicer(nside=self.nside, verbose=False,
+                                    lonCol='ra', latCol='dec', latLonDeg=False,
+                                    radius=self.radius / 2.)
+        otherslicer.setupSlicer(self.dv, sliceIndexCache=sliceIndexCache)
+        self.assertEqual(len(sliceIndexCache), 2)
+        self.assertLess(len(otherslicer.getSliceIndex()[1]), len(indices))
+
+    def testIndexCacheDir(self):
+        """Test the slice index can be saved to disk, reused, and cleared."""
+        cacheDir = tempfile.mkdtemp(prefix='TSI')
+        slicer = HealpixSlicer(nside=self.nside, verbose=False, lonCol='ra', latCol='dec',
+                               latLonDeg=False, radius=self.radius, indexCacheDir=cacheDir)
+        slicer.clearIndexCache()
+        slicer.setupSlicer(self.dv)
+        indexPtr, indices = slicer.getSliceIndex()
+        self.assertEqual(len(os.listdir(cacheDir)), 2)
+        # An equivalent slicer reads the slice index from disk.
+        slicer2 = HealpixSlicer(nside=self.nside, verbose=False, lonCol='ra', latCol='dec',
+                                latLonDeg=False, radius=self.radius, indexCacheDir=cacheDir)
+        slicer2.setupSlicer(self.dv)
+        indexPtr2, indices2 = slicer2.getSliceIndex()
+        np.testing.assert_equal(indexPtr, indexPtr2)
+        np.testing.assert_equal(indices, indices2)
+        slicer2.clearIndexCache()
+        self.assertEqual(len(os.listdir(cacheDir)), 0)
+        shutil.rmtree(cacheDir)
+
 
 class TestHealpixChipGap(unittest.TestCase):
     # Note that this is really testing baseSpatialSlicer, as slicing is done there for healpix grid
@@ -229,6 +279,31 @@ class TestHealpixChipGap(unittest.TestCase):
                 for indx in sidxs:
                     self.assertTrue(self.dv['testdata'][indx] in self.dv['testdata'][didxs])
 
+    def testChipMask(self):
+        """Test the rasterized chip mask matches the camera model for each pointing."""
+        dv = makeDataValues(size=300, minval=0., maxval=1., ramin=0, ramax=np.pi/4.,
+                            decmin=-np.pi/2., decmax=-np.pi/4., random=True)
+        for chipNames in ('all', ['R:1,1 S:1,1', 'R:2,2 S:1,1']):
+            slicer = HealpixSlicer(nside=64, verbose=False, lonCol='ra', latCol='dec', latLonDeg=False,
+                                   radius=self.radius, useCamera=True, chipNames=chipNames,
+                                   chipMaskResolution=30.)
+            slicer._setRad(slicer.radius)
+            slicer._setupLSSTCamera()
+            found = []
+            for useChipMask in (False, True):
+                slicer._presliceFootprint(dv, useChipMask=useChipMask)
+                hps = np.repeat(np.arange(slicer.nslice), np.diff(slicer.sliceIndexPtr))
+                found.append(dict(zip(zip(hps, slicer.sliceIndices),
+                                      slicer.chipNameList[slicer.chipIds])))
+            self.assertGreater(len(found[0]), 0)
+            if chipNames != 'all':
+                self.assertTrue(set(found[1].values()).issubset(set(chipNames)))
+            # Allow for differences at the chip edges.
+            common = [pair for pair in found[0] if pair in found[1]]
+            self.assertGreater(len(common), 0.95 * len(set(found[0]) | set(found[1])))
+            sameChip = [pair for pair in common if found[0][pair] == found[1][pair]]
+            self.assertGreater(len(sameChip), 0.95 * len(common))
+
 
 class TestHealpixSlicerPlotting(unittest.TestCase):
 
@@ -1,9 +1,17 @@
 from builtins import zip
 import matplotlib
 matplotlib.use("Agg")
+import os
+import shutil
+import tempfile
+import warnings
 import numpy as np
 import unittest
+import ephem
 import lsst.sims.maf.metrics as metrics
+import lsst.sims.maf.utils as utils
+import lsst.sims.maf.utils.nightEphemeris as nightEphemeris
+from lsst.sims.utils import Site
 import lsst.utils.tests
 
 
@@ -33,6 +41,78 @@ class TestHourglassmetric(unittest.TestCase):
         # Check that the format is right at least
         assert(len(pernight.dtype.names) == 9)
 
+    def testNightEphemeris(self):
+        """Test the night ephemeris table against pyephem, and that it is saved and extended."""
+        cacheDir = tempfile.mkdtemp()
+        try:
+            site = Site(name='LSST')
+            ephemeris = utils.NightEphemeris(site=site, cacheDir=cacheDir)
+            mjds = np.array([59580.1, 59600.3, 59650.9])
+            nights = ephemeris.nearestNight(mjds)
+            self.assertEqual(len(os.listdir(cacheDir)), 1)
+            doff = ephem.Date(0) - ephem.Date('1858/11/17')
+            obs = ephem.Observer()
+            obs.lat, obs.lon, obs.elevation = site.latitude_rad, site.longitude_rad, site.height
+            obs.horizon = '-12'
+            sun = ephem.Sun()
+            for mjd, night in zip(mjds, nights):
+                midnights = np.array([obs.previous_antitransit(sun, start=mjd - doff),
+                                      obs.next_antitransit(sun, start=mjd - doff)]) + doff
+                midnight = midnights[np.argmin(np.abs(midnights - mjd))]
+                self.assertAlmostEqual(night['midnight'], midnight, places=6)
+                start = midnight - doff
+                twiSet = obs.previous_setting(sun, start=start, use_center=True) + doff
+                twiRise = obs.next_rising(sun, start=start, use_center=True) + doff
+                self.assertAlmostEqual(night['twi12_set'], twiSet, places=6)
+                self.assertAlmostEqual(night['twi12_rise'], twiRise, places=6)
+                self.assertLess(night['sunset'], night['twi12_set'])
+                self.assertGreater(night['sunrise'], night['twi12_rise'])
+                moon = ephem.Moon(mjd - doff)
+                self.assertAlmostEqual(ephemeris.moonPhase([mjd])[0], moon.phase, delta=0.5)
+            # Each night in the range is in the table once.
+            nights = ephemeris.getNights(59580., 59650.)
+            self.assertEqual(len(nights), 70)
+            np.testing.assert_array_equal(np.diff(nights['night']), 1)
+            # Extending the table to earlier nights also updates the saved table.
+            ephemeris = utils.NightEphemeris(site=site, cacheDir=cacheDir)
+            nights = ephemeris.getNights(59570., 59650.)
+            self.assertEqual(len(nights), 80)
+            saved = np.load(os.path.join(cacheDir, os.listdir(cacheDir)[0]))
+            self.assertLessEqual(saved['midnight'][0], 59570.)
+        finally:
+            shutil.rmtree(cacheDir)
+
+    def testNightEphemerisCache(self):
+        """Test that an unreadable saved ephemeris table is recalculated, and nothing is saved by default."""
+        site = Site(name='LSST')
+        if 'SIMS_MAF_CACHE_DIR' not in os.environ:
+            self.assertIsNone(utils.NightEphemeris(site=site).cacheDir)
+        self.assertIsNone(utils.NightEphemeris(site=site, cacheDir=None)._readTable())
+        cacheDir = tempfile.mkdtemp()
+        try:
+            ephemeris = utils.NightEphemeris(site=site, cacheDir=cacheDir)
+            expected = ephemeris.getNights(59580., 59590.)
+            cacheFile = os.path.join(cacheDir, os.listdir(cacheDir)[0])
+            wrongColumns = np.zeros(3, dtype=[('night', int)])
+            for badTable in ('not an npy file', wrongColumns):
+                if isinstance(badTable, str):
+                    with open(cacheFile, 'w') as f:
+                        f.write(badTable)
+                else:
+                    np.save(cacheFile, badTable)
+                # Forget the tables held in memory, so the saved table is read.
+                nightEphemeris._ephemerisTables.clear()
+                ephemeris = utils.NightEphemeris(site=site, cacheDir=cacheDir)
+                with warnings.catch_warnings(record=True) as w:
+                    warnings.simplefilter('always')
+                    nights = ephemeris.getNights(59580., 59590.)
+                self.assertEqual(len(w), 1)
+                np.testing.assert_array_equal(nights, expected)
+                # The recalculated table replaces the unreadable one.
+                self.assertEqual(np.load(cacheFile).dtype, expected.dtype)
+        finally:
+            shutil.rmtree(cacheDir)
+
 
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
@@ -1,4 +1,5 @@
 import unittest
+import numpy as np
 import matplotlib
 matplotlib.use("Agg")
 
@@ -11,6 +12,8 @@ import lsst.sims.maf.db as db
 import glob
 import os
 import tempfile
+import multiprocessing
+import warnings
 import shutil
 import lsst.utils.tests
 from lsst.utils import getPackageDir
@@ -61,6 +64,119 @@ class TestMetricBundle(unittest.TestCase):
         assert(len(outPdf) == 3)
         assert(len(outNpz) == 1)
 
+    def testSingleQuery(self):
+        """Test evaluating constraints in memory gives the same results as querying for each one."""
+        database = os.path.join(getPackageDir('sims_data'), 'OpSimData', 'astro-lsst-01_2014.db')
+        opsdb = db.OpsimDatabaseV4(database=database)
+        sqls = ['filter="r"', 'filter="g" and night < 100',
+                '(filter = "i" or filter = "z") and proposalId = 1', 'filter like "y"']
+        # Count the database queries, to check the constraints are evaluated in memory.
+        nQueries = [0]
+        fetchMetricData = opsdb.fetchMetricData
+
+        def countingFetch(*args, **kwargs):
+            nQueries[0] += 1
+            return fetchMetricData(*args, **kwargs)
+        opsdb.fetchMetricData = countingFetch
+        results = {}
+        queries = {}
+        for singleQuery in (False, True):
+            nQueries[0] = 0
+            bundleDict = {}
+            for i, sql in enumerate(sqls):
+                slicer = slicers.HealpixSlicer(nside=8)
+                metric = metrics.CountMetric(col='observationStartMJD')
+                bundleDict[i] = metricBundles.MetricBundle(metric, slicer, sql)
+            bgroup = metricBundles.MetricBundleGroup(bundleDict, opsdb, outDir=self.outDir,
+                                                     saveEarly=False, verbose=False,
+                                                     singleQuery=singleQuery)
+            bgroup.runAll()
+            results[singleQuery] = bundleDict
+            queries[singleQuery] = nQueries[0]
+        opsdb.close()
+        self.assertEqual(queries[False], len(sqls))
+        # One query for all columns, plus one for the constraint using 'like' (not evaluated with numpy).
+        self.assertEqual(queries[True], 2)
+        for i in range(len(sqls)):
+            np.testing.assert_array_equal(results[False][i].metricValues.filled(0),
+                                          results[True][i].metricValues.filled(0))
+
+    def tearDown(self):
+        if os.path.isdir(self.outDir):
+            shutil.rmtree(self.outDir)
+
+
+class TestMetricBundleGroupParallel(unittest.TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        sims_clean_up()
+
+    def setUp(self):
+        self.outDir = tempfile.mkdtemp(prefix='TMBG')
+        rng = np.random.RandomState(42)
+        self.simData = np.zeros(2000, dtype=list(zip(['fieldRA', 'fieldDec', 'fiveSigmaDepth', 'airmass'],
+                                                     [float, float, float, float])))
+        self.simData['fieldRA'] = rng.rand(2000) * 360.
+        self.simData['fieldDec'] = np.degrees(np.arcsin(rng.rand(2000) * 2. - 1.))
+        self.simData['fiveSigmaDepth'] = rng.rand(2000) + 24.
+        self.simData['airmass'] = rng.rand(2000) + 1.
+
+    def _runGroup(self, nWorkers):
+        slicer = slicers.HealpixSlicer(nside=8, verbose=False)
+        bundleList = [metricBundles.MetricBundle(metrics.MeanMetric(col='airmass'), slicer, ''),
+                      metricBundles.MetricBundle(metrics.CountMetric(col='airmass'), slicer, ''),
+                      metricBundles.MetricBundle(metrics.Coaddm5Metric(), slicer, ''),
+                      metricBundles.MetricBundle(metrics.MedianMetric(col='airmass'), slicer, '')]
+        bundleDict = metricBundles.makeBundlesDictFromList(bundleList)
+        bgroup = metricBundles.MetricBundleGroup(bundleDict, None, outDir=self.outDir,
+                                                 saveEarly=False, verbose=False)
+        bgroup.setCurrent('')
+        bgroup.runCurrent('', simData=self.simData, nWorkers=nWorkers)
+        return bundleDict
+
+    def testParallelMatchesSerial(self):
+        """
+        Check that calculating metric values with a pool of workers gives the serial results.
+        """
+        serial = self._runGroup(nWorkers=1)
+        parallel = self._runGroup(nWorkers=3)
+        for k in serial:
+            np.testing.assert_array_equal(serial[k].metricValues.mask, parallel[k].metricValues.mask)
+            np.testing.assert_array_equal(serial[k].metricValues.filled(), parallel[k].metricValues.filled())
+
+    def testParallelFallback(self):
+        """
+        Check that the metric values are calculated serially when worker processes cannot be forked.
+        """
+        serial = self._runGroup(nWorkers=1)
+        # As in python 2, where multiprocessing.get_context does not exist.
+        getContext = multiprocessing.get_context
+        del multiprocessing.get_context
+        try:
+            with warnings.catch_warnings(record=True) as w:
+                warnings.simplefilter('always')
+                fallback = self._runGroup(nWorkers=3)
+        finally:
+            multiprocessing.get_context = getContext
+        self.assertTrue(any('serially' in str(warning.message) for warning in w))
+        for k in serial:
+            np.testing.assert_array_equal(serial[k].metricValues.mask, fallback[k].metricValues.mask)
+            np.testing.assert_array_equal(serial[k].metricValues.filled(), fallback[k].metricValues.filled())
+
+    def testBatchMatchesSerial(self):
+        """
+        Check that metrics calculated with runBatch match the per-slicePoint calculation.
+        """
+        slicer = slicers.HealpixSlicer(nside=8, verbose=False)
+        slicer.setupSlicer(self.simData)
+        indexPtr, indices = slicer.getSliceIndex()
+        for metric in [metrics.MeanMetric(col='airmass'), metrics.Coaddm5Metric()]:
+            batch = metric.runBatch(self.simData, indexPtr, indices, slicePoints=slicer.slicePoints)
+            for i, slice_i in enumerate(slicer):
+                if len(slice_i['idxs']) > 0:
+                    self.assertAlmostEqual(batch[i], metric.run(self.simData[slice_i['idxs']]))
+
     def tearDown(self):
         if os.path.isdir(self.outDir):
             shutil.rmtree(self.outDir)
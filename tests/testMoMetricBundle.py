@@ -0,0 +1,121 @@
+from __future__ import print_function
+import matplotlib
+matplotlib.use("Agg")
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import lsst.sims.maf.metrics as metrics
+import lsst.sims.maf.slicers as slicers
+import lsst.sims.maf.metricBundles as metricBundles
+import lsst.utils.tests
+
+
+def writeMoFiles(outDir, nObj=20, nObsPerObj=30, seed=42, duplicateIds=()):
+    """Write a simple orbit file (COM format) and a file of observations of these orbits (as from moObs).
+    The orbits of duplicateIds are written twice (with different H values)."""
+    rng = np.random.RandomState(seed)
+    orbitFile = os.path.join(outDir, 'orbits.txt')
+    with open(orbitFile, 'w') as f:
+        print('objId q e inc Omega argPeri tPeri epoch H g sed_filename', file=f)
+        for i in list(range(nObj)) + list(duplicateIds):
+            print('%d %f %f %f %f %f %f %f %f %f %s'
+                  % (i, rng.uniform(1, 3), rng.uniform(0, 0.5), rng.uniform(0, 30), rng.uniform(0, 360),
+                     rng.uniform(0, 360), 54800 + rng.uniform(0, 100), 54800.0, rng.uniform(15, 22),
+                     0.15, 'C.dat'), file=f)
+    obsFile = os.path.join(outDir, 'obs.txt')
+    with open(obsFile, 'w') as f:
+        print('objId time expMJD night ra dec magV dmagColor dradt ddecdt fiveSigmaDepth dmagDetect filter',
+              file=f)
+        for i in range(nObj):
+            # Not every object has observations.
+            if i % 7 == 3:
+                continue
+            times = np.sort(rng.uniform(59580, 59680, nObsPerObj))
+            for t in times:
+                print('%d %f %f %d %f %f %f %f %f %f %f %f %s'
+                      % (i, t, t, int(t - 59580), rng.uniform(0, 360), rng.uniform(-60, 0),
+                         rng.uniform(18, 24), -0.2, rng.uniform(-1, 1), rng.uniform(-1, 1),
+                         rng.uniform(23, 25), 0.0, 'r'), file=f)
+    return orbitFile, obsFile
+
+
+class TestMoMetricBundleGroup(unittest.TestCase):
+
+    def setUp(self):
+        self.outDir = tempfile.mkdtemp(prefix='TMMB')
+        self.orbitFile, self.obsFile = writeMoFiles(self.outDir)
+        self.Hrange = np.arange(15, 22, 1.0)
+
+    def tearDown(self):
+        shutil.rmtree(self.outDir)
+
+    def _makeGroup(self, metric, outDir, chunkSize=None, Hrange='default'):
+        slicer = slicers.MoObjSlicer(verbose=False)
+        slicer.readOrbits(self.orbitFile, Hrange=self.Hrange if Hrange == 'default' else Hrange)
+        slicer.readObs(self.obsFile, chunkSize=chunkSize)
+        bundle = metricBundles.MoMetricBundle(metric, slicer, None, runName='test')
+        group = metricBundles.MoMetricBundleGroup({'b': bundle}, outDir=outDir, verbose=False)
+        return group, bundle
+
+    def testMergeShards(self):
+        """Test that merging shards reproduces the serial calculation."""
+        group, serial = self._makeGroup(metrics.NObsMetric(snrLimit=5), os.path.join(self.outDir, 'serial'))
+        group.runAll()
+        shardDir = os.path.join(self.outDir, 'sharded')
+        nShards = 3
+        for shard in range(nShards):
+            group, sharded = self._makeGroup(metrics.NObsMetric(snrLimit=5), shardDir)
+            group.runShard(shard, nShards)
+        group, sharded = self._makeGroup(metrics.NObsMetric(snrLimit=5), shardDir)
+        group.mergeShards(nShards)
+        np.testing.assert_array_equal(serial.metricValues.mask, sharded.metricValues.mask)
+        np.testing.assert_array_equal(serial.metricValues.filled(0), sharded.metricValues.filled(0))
+        # A missing shard is an error.
+        os.remove(group._shardFile(sharded, 1, nShards))
+        self.assertRaises(IOError, group.mergeShards, nShards)
+
+    def testChunks(self):
+        """Test reading observations in chunks (and running the stackers per chunk) gives the same results."""
+        # Include orbits with duplicate objIds, whose stackers must still be run per orbit.
+        self.orbitFile, self.obsFile = writeMoFiles(self.outDir, duplicateIds=[2, 5])
+        for Hrange in ('default', None):
+            group, serial = self._makeGroup(metrics.NObsMetric(snrLimit=5), os.path.join(self.outDir, 'all'),
+                                            Hrange=Hrange)
+            group.runAll()
+            group, chunked = self._makeGroup(metrics.NObsMetric(snrLimit=5), os.path.join(self.outDir, 'ch'),
+                                             chunkSize=100, Hrange=Hrange)
+            group.runAll()
+            np.testing.assert_array_equal(serial.metricValues.mask, chunked.metricValues.mask)
+            np.testing.assert_array_equal(serial.metricValues.filled(0), chunked.metricValues.filled(0))
+
+    def testParallel(self):
+        """Test calculating metric values with worker processes."""
+        group, serial = self._makeGroup(metrics.NObsMetric(snrLimit=5), os.path.join(self.outDir, 'serial'))
+        group.runAll()
+        group, parallel = self._makeGroup(metrics.NObsMetric(snrLimit=5), os.path.join(self.outDir, 'par'))
+        group.runAll(nWorkers=2)
+        np.testing.assert_array_equal(serial.metricValues.mask, parallel.metricValues.mask)
+        np.testing.assert_array_equal(serial.metricValues.filled(0), parallel.metricValues.filled(0))
+        # With random visibility, the results are reproducible from the seed of the parent process.
+        results = []
+        for i in range(2):
+            group, parallel = self._makeGroup(metrics.NObsMetric(), os.path.join(self.outDir, 'par'))
+            np.random.seed(42)
+            group.runAll(nWorkers=2)
+            results.append(parallel.metricValues.filled(0))
+        np.testing.assert_array_equal(results[0], results[1])
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -2,6 +2,7 @@ import numpy as np
 import pandas as pd
 import unittest
 import lsst.sims.maf.metrics as metrics
+import lsst.sims.maf.stackers as stackers
 
 
 class TestMoMetrics1(unittest.TestCase):
@@ -74,6 +75,30 @@ class TestMoMetrics1(unittest.TestCase):
         arc = arcMetric.run(self.ssoObs, self.orb, self.Hval)
         self.assertEqual(arc, self.ssoObs['expMJD'][-1] - self.ssoObs['expMJD'][5])
 
+    def testRunHvals(self):
+        # Make ssoObs with 2-d SNR and vis columns (as for 3 H values), as the stackers do.
+        Hvals = np.array([8.0, 9.0, 10.0])
+        dtype = [(name, '<f8', (len(Hvals),)) if name in ('SNR', 'vis') else (name, '<f8')
+                 for name in self.ssoObs.dtype.names]
+        ssoObs = np.recarray([len(self.ssoObs)], dtype=dtype)
+        for name in self.ssoObs.dtype.names:
+            if name in ('SNR', 'vis'):
+                ssoObs[name] = self.ssoObs[name][:, np.newaxis]
+            else:
+                ssoObs[name] = self.ssoObs[name]
+        ssoObs['SNR'][:, 1] = 3.0
+        ssoObs['vis'][:, 1] = 0
+        ssoObs['vis'][9:, 2] = 0
+        for metric in [metrics.NObsMetric(snrLimit=5), metrics.NObsMetric(snrLimit=None),
+                       metrics.ObsArcMetric(snrLimit=5), metrics.ObsArcMetric(snrLimit=None),
+                       metrics.NNightsMetric(snrLimit=None)]:
+            mVals = metric.runHvals(ssoObs, self.orb, Hvals)
+            self.assertEqual(len(mVals), len(Hvals))
+            for j, Hval in enumerate(Hvals):
+                ssoObsH = stackers.selectH(ssoObs, j)
+                np.testing.assert_array_equal(ssoObsH['vis'], ssoObs['vis'][:, j])
+                self.assertEqual(mVals[j], metric.run(ssoObsH, self.orb, Hval))
+
     def tearDown(self):
         del self.ssoObs
         del self.orb
@@ -175,6 +200,23 @@ class TestDiscoveryMetrics(unittest.TestCase):
         magic = discMetric3.run(self.ssoObs, self.orb, self.Hval)
         self.assertEqual(magic, 6)
 
+    def testDiscoveryChildrenUnsorted(self):
+        # The discovery opportunities should not depend on the order of the observations,
+        # and the child metrics should give the same values whether or not they reuse the parent's cache.
+        discMetric = metrics.DiscoveryMetric(nObsPerNight=2, tMin=0.0, tMax=0.3,
+                                             nNightsPerWindow=3, tWindow=9, snrLimit=5)
+        metricValue = discMetric.run(self.ssoObs, self.orb, self.Hval)
+        shuffled = self.ssoObs[np.random.permutation(len(self.ssoObs))]
+        shuffledValue = discMetric.run(shuffled, self.orb, self.Hval)
+        for k in metricValue:
+            np.testing.assert_array_equal(metricValue[k], shuffledValue[k])
+        for child in [metrics.Discovery_N_ChancesMetric(discMetric),
+                      metrics.Discovery_TimeMetric(discMetric, i=1),
+                      metrics.Discovery_RADecMetric(discMetric, i=1)]:
+            cached = child.run(shuffled, self.orb, self.Hval, shuffledValue)
+            uncached = child.run(shuffled, self.orb, self.Hval, dict(shuffledValue))
+            self.assertEqual(cached, uncached)
+            self.assertEqual(cached, child.run(self.ssoObs, self.orb, self.Hval, dict(metricValue)))
 
     def testHighVelocityMetric(self):
         velMetric = metrics.HighVelocityMetric(psfFactor=1.0, snrLimit=5)
@@ -197,5 +239,54 @@ class TestDiscoveryMetrics(unittest.TestCase):
         self.assertEqual(metricValue, 1)
 
 
+class TestMoCompletenessMetrics(unittest.TestCase):
+
+    def setUp(self):
+        # Discovery chances and discovery times for 100 objects, cloned over 4 H values.
+        np.random.seed(42)
+        self.Hvals = np.array([18.0, 19.0, 20.0, 21.0])
+        chances = np.random.randint(0, 4, size=(100, len(self.Hvals)))
+        self.chances = np.ma.MaskedArray(data=chances, mask=(chances == 0), fill_value=0)
+        times = np.random.uniform(0, 10, size=(100, len(self.Hvals)))
+        self.discoveryTimes = np.ma.MaskedArray(data=times, mask=(chances == 0), fill_value=0)
+        self.times = np.arange(0, 11, 2.0)
+
+    def testCompleteness(self):
+        for requiredChances in (1, 2, 3):
+            expected = (self.chances.filled(0) >= requiredChances).sum(axis=0) / 100.0
+            metric = metrics.MoCompletenessMetric(requiredChances=requiredChances, cumulative=False)
+            np.testing.assert_array_almost_equal(metric.run(self.chances, self.Hvals)['value'], expected)
+            metric = metrics.MoCompletenessMetric(requiredChances=requiredChances, cumulative=True)
+            np.testing.assert_array_almost_equal(metric.run(self.chances, self.Hvals)['value'],
+                                                 metrics.integrateOverH(expected, self.Hvals))
+
+    def testCompletenessInPlaceChange(self):
+        """Test completeness is recalculated when the metric values are changed in place."""
+        metric = metrics.MoCompletenessMetric(requiredChances=1, cumulative=False)
+        before = metric.run(self.chances, self.Hvals)['value']
+        self.chances.mask[:50] = True
+        expected = (self.chances.filled(0) >= 1).sum(axis=0) / 100.0
+        after = metric.run(self.chances, self.Hvals)['value']
+        np.testing.assert_array_almost_equal(after, expected)
+        self.assertTrue(np.all(after < before))
+        self.chances.data[50:] = 3
+        self.chances.mask[50:] = False
+        np.testing.assert_array_almost_equal(metric.run(self.chances, self.Hvals)['value'], 0.5)
+
+    def testCompletenessAtTime(self):
+        completeness = np.zeros((len(self.times), len(self.Hvals)), float)
+        for j in range(len(self.Hvals)):
+            n, b = np.histogram(self.discoveryTimes[:, j].compressed(), bins=self.times)
+            completeness[1:, j] = n.cumsum() / 100.0
+        metric = metrics.MoCompletenessAtTimeMetric(self.times, Hval=19.5, cumulative=False)
+        summaryVal = metric.run(self.discoveryTimes, self.Hvals)
+        np.testing.assert_array_almost_equal(summaryVal['value'],
+                                             completeness[:, 1:3].mean(axis=1))
+        metric = metrics.MoCompletenessAtTimeMetric(self.times, Hval=20, cumulative=True)
+        summaryVal = metric.run(self.discoveryTimes, self.Hvals)
+        np.testing.assert_array_almost_equal(summaryVal['value'],
+                                             [metrics.integrateOverH(c, self.Hvals)[2] for c in completeness])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,288 @@
+from __future__ import print_function
+import matplotlib
+matplotlib.use("Agg")
+import os
+import shutil
+import tempfile
+import warnings
+import unittest
+import numpy as np
+import lsst.sims.maf.slicers as slicers
+import lsst.sims.maf.stackers as stackers
+from lsst.sims.maf.slicers.orbits import Orbits
+import lsst.utils.tests
+
+
+def writeOrbits(filename, objIds, seed=42):
+    """Write a simple orbit file (COM format) for the objects objIds."""
+    rng = np.random.RandomState(seed)
+    with open(filename, 'w') as f:
+        print('objId q e inc Omega argPeri tPeri epoch H g sed_filename', file=f)
+        for objId in objIds:
+            print('%s %f %f %f %f %f %f %f %f %f %s'
+                  % (objId, rng.uniform(1, 3), rng.uniform(0, 0.5), rng.uniform(0, 30), rng.uniform(0, 360),
+                     rng.uniform(0, 360), 54800 + rng.uniform(0, 100), 54800.0, rng.uniform(15, 22),
+                     0.15, 'C.dat'), file=f)
+
+
+def writeObs(filename, objIds, nObsPerObj=10, seed=42):
+    """Write a file of observations (as from moObs) of the objects objIds, in that order."""
+    rng = np.random.RandomState(seed)
+    with open(filename, 'w') as f:
+        print('objId time expMJD night ra dec magV dmagColor dradt ddecdt fiveSigmaDepth dmagDetect filter',
+              file=f)
+        for objId in objIds:
+            times = np.sort(rng.uniform(59580, 59680, nObsPerObj))
+            for t in times:
+                print('%s %f %f %d %f %f %f %f %f %f %f %f %s'
+                      % (objId, t, t, int(t - 59580), rng.uniform(0, 360), rng.uniform(-60, 0),
+                         rng.uniform(18, 24), -0.2, rng.uniform(-1, 1), rng.uniform(-1, 1),
+                         rng.uniform(23, 25), 0.0, 'r'), file=f)
+
+
+class TestMoObjSlicerReadObs(unittest.TestCase):
+
+    def setUp(self):
+        self.outDir = tempfile.mkdtemp(prefix='TMOS')
+        self.orbitFile = os.path.join(self.outDir, 'orbits.txt')
+        self.obsFile = os.path.join(self.outDir, 'obs.txt')
+        writeOrbits(self.orbitFile, np.arange(20))
+        # Objects 3, 10 and 17 have no observations.
+        writeObs(self.obsFile, [i for i in range(20) if i % 7 != 3], nObsPerObj=15)
+
+    def tearDown(self):
+        shutil.rmtree(self.outDir)
+
+    def _readSlicer(self, **kwargs):
+        slicer = slicers.MoObjSlicer(verbose=False)
+        slicer.readOrbits(self.orbitFile, Hrange=None)
+        slicer.readObs(self.obsFile, **kwargs)
+        return slicer
+
+    def _sidecarFiles(self):
+        return sorted([f for f in os.listdir(self.outDir) if f.startswith('obs.txt.')])
+
+    def _chunkedObs(self, slicer):
+        """Return the observations of each object, read one chunk at a time."""
+        obs = {}
+        for idxs in slicer.iterObsChunks():
+            for i in idxs:
+                obs[i] = np.array(slicer[i]['obs'])
+        return obs
+
+    def testChunks(self):
+        """Test reading the observations in chunks gives the same observations for each object."""
+        slicer = self._readSlicer()
+        expected = dict([(i, np.array(slicer[i]['obs'])) for i in range(slicer.nSso)])
+        for chunkSize in (7, 50, 1000):
+            chunked = self._chunkedObs(self._readSlicer(chunkSize=chunkSize))
+            self.assertEqual(sorted(chunked.keys()), [i for i in range(20) if i % 7 != 3])
+            for i in chunked:
+                np.testing.assert_array_equal(chunked[i]['time'], expected[i]['time'])
+                np.testing.assert_array_equal(chunked[i]['magFilter'], expected[i]['magFilter'])
+        for i in (3, 10, 17):
+            self.assertEqual(len(expected[i]), 0)
+
+    def testSidecar(self):
+        """Test the binary sidecar of the observations is only written if requested, and is reused."""
+        sidecarDir = self.obsFile + '.chunks'
+        slicer = self._readSlicer()
+        expected = self._chunkedObs(self._readSlicer(chunkSize=50))
+        self.assertFalse(os.path.exists(sidecarDir))
+        self._readSlicer(useSidecar=True)
+        self.assertTrue(os.path.isfile(os.path.join(sidecarDir, 'manifest.json')))
+        # Reading in chunks from the sidecar gives the same observations.
+        slicer = self._readSlicer(chunkSize=50, useSidecar=True)
+        self.assertIsNotNone(slicer._readSidecar())
+        chunked = self._chunkedObs(slicer)
+        for i in expected:
+            np.testing.assert_array_equal(chunked[i]['time'], expected[i]['time'])
+            np.testing.assert_array_equal(chunked[i]['objId'], expected[i]['objId'])
+        # The sidecar is not used once the observations file changes.
+        writeObs(self.obsFile, [0, 1], nObsPerObj=3, seed=1)
+        slicer = self._readSlicer(useSidecar=True)
+        self.assertEqual(len(slicer.allObs), 6)
+        self.assertEqual(self._sidecarFiles(), ['obs.txt.chunks'])
+
+    def testSidecarCleanup(self):
+        """Test partial sidecars are removed, and reading works when the sidecar cannot be written."""
+        slicer = self._readSlicer(chunkSize=50, useSidecar=True)
+        # Abandon reading the chunks part way through.
+        chunks = slicer._readObsChunks()
+        next(chunks)
+        chunks.close()
+        self.assertEqual(self._sidecarFiles(), [])
+        # Block the sidecar from being written.
+        with open(self.obsFile + '.chunks.tmp%d' % os.getpid(), 'w') as f:
+            print('blocked', file=f)
+        with warnings.catch_warnings(record=True):
+            warnings.simplefilter('always')
+            slicer = self._readSlicer(useSidecar=True)
+        self.assertEqual(len(slicer.allObs), 17 * 15)
+        self.assertEqual(self._sidecarFiles(), ['obs.txt.chunks.tmp%d' % os.getpid()])
+
+
+class TestOrbitsCache(unittest.TestCase):
+
+    def setUp(self):
+        self.outDir = tempfile.mkdtemp(prefix='TMOS')
+        self.orbitFile = os.path.join(self.outDir, 'orbits.txt')
+        writeOrbits(self.orbitFile, np.arange(15))
+
+    def tearDown(self):
+        shutil.rmtree(self.outDir)
+
+    def _cacheFiles(self):
+        return sorted([f for f in os.listdir(self.outDir) if f.startswith('orbits.txt.')])
+
+    def _checkEqual(self, orbits1, orbits2):
+        np.testing.assert_array_equal(orbits1.orbitArray, orbits2.orbitArray)
+        self.assertEqual(orbits1.format, orbits2.format)
+        self.assertEqual(list(orbits1.orbits.columns), list(orbits2.orbits.columns))
+        for col in orbits1.orbits.columns:
+            np.testing.assert_array_equal(orbits1.orbits[col].values, orbits2.orbits[col].values)
+
+    def testCache(self):
+        """Test reading orbits from the cache gives the same orbits as parsing the file."""
+        fresh = Orbits()
+        fresh.readOrbits(self.orbitFile)
+        self.assertEqual(self._cacheFiles(), [])
+        first = Orbits()
+        first.readOrbits(self.orbitFile, useCache=True)
+        self.assertEqual(self._cacheFiles(), ['orbits.txt.npy', 'orbits.txt.npy.json'])
+        cached = Orbits()
+        self.assertTrue(cached._readCache(self.orbitFile, None, None))
+        cached = Orbits()
+        cached.readOrbits(self.orbitFile, useCache=True)
+        self._checkEqual(fresh, first)
+        self._checkEqual(fresh, cached)
+        # The orbit of a single object (as given to the metrics) can be indexed like a row of the DataFrame.
+        for col in ('objId', 'H', 'q', 'sed_filename'):
+            self.assertEqual(cached.orbitArray[4][col], fresh.orbits.iloc[4][col])
+
+    def testCacheInvalidated(self):
+        """Test the cache is not used once the orbit file changes, or if it is read differently."""
+        orbits = Orbits()
+        orbits.readOrbits(self.orbitFile, useCache=True)
+        writeOrbits(self.orbitFile, np.arange(4), seed=1)
+        self.assertFalse(Orbits()._readCache(self.orbitFile, None, None))
+        fresh = Orbits()
+        fresh.readOrbits(self.orbitFile)
+        cached = Orbits()
+        cached.readOrbits(self.orbitFile, useCache=True)
+        self.assertEqual(len(cached), 4)
+        self._checkEqual(fresh, cached)
+        self.assertFalse(Orbits()._readCache(self.orbitFile, None, 0))
+
+
+class TestMoObjSlicerIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.outDir = tempfile.mkdtemp(prefix='TMOS')
+        self.orbitFile = os.path.join(self.outDir, 'orbits.txt')
+        self.obsFile = os.path.join(self.outDir, 'obs.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.outDir)
+
+    def _checkSlices(self, orbitIds, obsIds):
+        writeOrbits(self.orbitFile, orbitIds)
+        # Write one observation at a time, so the observations of each object are not contiguous.
+        writeObs(self.obsFile, obsIds, nObsPerObj=1)
+        slicer = slicers.MoObjSlicer(verbose=False)
+        slicer.readOrbits(self.orbitFile, Hrange=None)
+        slicer.readObs(self.obsFile)
+        self.assertEqual(slicer.nSso, len(orbitIds))
+        for i in range(slicer.nSso):
+            # Compare against selecting the observations matching the objId of the orbit.
+            objId = slicer.orbits['objId'].iloc[i]
+            if slicer.obs['objId'].dtype == 'object':
+                expected = slicer.obs.query('objId == "%s"' % (objId)).to_records()
+            else:
+                expected = slicer.obs.query('objId == %d' % (objId)).to_records()
+            obs = slicer[i]['obs']
+            self.assertEqual(len(obs), len(expected))
+            np.testing.assert_array_equal(obs['time'], expected['time'])
+            np.testing.assert_array_equal(obs['index'], expected['index'])
+            self.assertEqual(slicer[i]['orbit']['objId'], objId)
+
+    def testSliceObs(self):
+        """Test the observations of each orbit match selecting them by objId."""
+        rng = np.random.RandomState(42)
+        # Unsorted and duplicate orbit objIds, some of which (6, 11 and 15) have no observations.
+        orbitIds = [9, 3, 12, 0, 6, 3, 1, 11, 7, 2, 15, 4, 9]
+        obsIds = rng.choice([0, 1, 2, 3, 4, 5, 7, 8, 9, 12], size=200)
+        self._checkSlices(orbitIds, obsIds)
+
+    def testSliceObsStrings(self):
+        """Test matching observations to orbits with string objIds."""
+        rng = np.random.RandomState(42)
+        orbitIds = ['b9', 'a3', 'c1', 'a3', 'z0']
+        obsIds = rng.choice(['a3', 'b9', 'c1', 'd4'], size=80)
+        self._checkSlices(orbitIds, obsIds)
+
+
+class TestMoObjSlicerStackers(unittest.TestCase):
+
+    def setUp(self):
+        self.outDir = tempfile.mkdtemp(prefix='TMOS')
+        self.orbitFile = os.path.join(self.outDir, 'orbits.txt')
+        self.obsFile = os.path.join(self.outDir, 'obs.txt')
+        writeObs(self.obsFile, [i for i in range(10) if i != 4], nObsPerObj=12)
+
+    def tearDown(self):
+        shutil.rmtree(self.outDir)
+
+    def _perObject(self, slicer, stacker, i):
+        """Run the stacker on the observations of object i alone (without the stacker columns)."""
+        slicePoint = slicer[i]
+        obs = np.array(slicePoint['obs'])
+        cols = [col for col in obs.dtype.names if col not in stacker.colsAdded]
+        obs = np.array(obs[cols]).view(np.recarray)
+        return stacker.run(obs, slicePoint['orbit']['H'], slicePoint['Hvals'])
+
+    def _checkStackers(self, objIds, Hrange):
+        writeOrbits(self.orbitFile, objIds)
+        slicer = slicers.MoObjSlicer(verbose=False)
+        slicer.readOrbits(self.orbitFile, Hrange=Hrange)
+        slicer.readObs(self.obsFile, chunkSize=20)
+        stacker = stackers.MoMagStacker()
+        ran = []
+        for idxs in slicer.iterObsChunks():
+            ran.append(slicer.runStackers([stacker]))
+            for i in idxs:
+                expected = self._perObject(slicer, stacker, i)
+                obs = slicer[i]['obs']
+                if ran[-1]:
+                    self.assertEqual(obs['appMag'].shape, expected['appMag'].shape)
+                    for col in ('appMagV', 'appMag', 'SNR'):
+                        np.testing.assert_allclose(obs[col], expected[col])
+                    # The observations of the other H values are a view of the same observations.
+                    np.testing.assert_array_equal(stackers.selectH(obs, 0)['time'], obs['time'])
+                else:
+                    self.assertFalse('appMag' in obs.dtype.names)
+        return ran
+
+    def testRunStackers(self):
+        """Test stackers run on all observations at once give the values of per-object stacking."""
+        for Hrange in (None, np.arange(15, 20, 0.5)):
+            ran = self._checkStackers(np.arange(12), Hrange)
+            self.assertTrue(all(ran))
+
+    def testRunStackersDuplicates(self):
+        """Test stackers are run per object when orbits share objIds (and so observations)."""
+        ran = self._checkStackers([0, 1, 2, 2, 3, 5, 6, 7, 8, 8, 9], None)
+        self.assertFalse(all(ran))
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -1,6 +1,8 @@
 import matplotlib
 matplotlib.use("Agg")
 import os
+import shutil
+import tempfile
 import unittest
 import numpy as np
 import lsst.sims.maf.db as db
@@ -40,6 +42,36 @@ class TestOpsimDb(unittest.TestCase):
         self.assertEqual(data.dtype.names, ('seeingFwhmEff',))
         self.assertTrue(data['seeingFwhmEff'].max() <= 1.0)
 
+    def testOpsimDbColumnStore(self):
+        """Test queries served from the column store match the sql queries."""
+        storeDir = tempfile.mkdtemp(prefix='columnStore')
+        try:
+            oo = db.OpsimDatabaseV4(database=self.database, columnStore=True, columnStoreDir=storeDir)
+            cols = ['observationStartMJD', 'night', 'filter', 'fiveSigmaDepth']
+            for constraint in [None, 'filter="r" and night < 100', 'night between 20 and 30',
+                               '(filter = "g" or filter = "i") and proposalId = 1']:
+                data = oo.fetchMetricData(cols, constraint)
+                expected = self.oo.fetchMetricData(cols, constraint)
+                np.testing.assert_array_equal(data, expected)
+            self.assertTrue(os.path.isfile(os.path.join(storeDir, 'manifest.json')))
+            # Constraints which cannot be evaluated with numpy fall back to sql.
+            self.assertIsNone(oo.columnStore.fetch(cols, 'filter like "r"'))
+            data = oo.fetchMetricData(cols, 'filter like "r"')
+            self.assertEqual(set(np.unique(data['filter'])), set(['r']))
+            # Rebuilding the store replaces the column files, rather than overwriting columns
+            #  which are already memory-mapped.
+            night = oo.columnStore.columns['night']
+            expected = np.array(night)
+            store = db.ColumnStore(oo, oo.defaultTable, storeDir=storeDir)
+            store._write()
+            np.testing.assert_array_equal(night, expected)
+            self.assertEqual([f for f in os.listdir(storeDir) if f.endswith('.tmp')], [])
+            store.load()
+            np.testing.assert_array_equal(store.columns['night'], expected)
+            oo.close()
+        finally:
+            shutil.rmtree(storeDir)
+
     def testOpsimDbPropID(self):
         """Test queries for prop ID"""
         propids, propTags = self.oo.fetchPropInfo()
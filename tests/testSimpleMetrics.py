@@ -163,6 +163,28 @@ class TestSimpleMetrics(unittest.TestCase):
         result = result
         self.assertGreater(result, 355)
 
+    def testRunBatch(self):
+        """Test that the batch calculation matches running the metric at each slicePoint."""
+        rng = np.random.RandomState(42)
+        data = np.array(list(zip(rng.rand(100) + 24.)), dtype=[('testdata', 'float')])
+        # Build a slice index with some empty slicePoints.
+        counts = rng.randint(0, 6, 30)
+        counts[0] = 0
+        counts[-1] = 0
+        indexPtr = np.concatenate([[0], np.cumsum(counts)])
+        indices = rng.randint(0, len(data), indexPtr[-1])
+        testmetrics = [metrics.CountMetric('testdata'), metrics.Coaddm5Metric(m5Col='testdata'),
+                       metrics.MeanMetric('testdata'), metrics.SumMetric('testdata'),
+                       metrics.MaxMetric('testdata'), metrics.MinMetric('testdata')]
+        for testmetric in testmetrics:
+            self.assertTrue(testmetric.canRunBatch())
+            result = testmetric.runBatch(data, indexPtr, indices)
+            self.assertEqual(len(result), len(counts))
+            for i in np.where(counts > 0)[0]:
+                dataSlice = data[indices[indexPtr[i]:indexPtr[i+1]]]
+                self.assertAlmostEqual(result[i], testmetric.run(dataSlice))
+        self.assertFalse(metrics.MedianMetric('testdata').canRunBatch())
+
 
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
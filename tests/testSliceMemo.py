@@ -0,0 +1,63 @@
+import numpy as np
+import unittest
+from lsst.sims.maf.metricBundles import SliceMemo
+import lsst.utils.tests
+
+
+class TestSliceMemo(unittest.TestCase):
+
+    def testLookupStore(self):
+        """Test that results are found for the same slice indexes, in any order."""
+        memo = SliceMemo(maxEntries=10)
+        key, sortedIdxs, result = memo.lookup([3, 1, 2])
+        self.assertIsNone(result)
+        memo.store(key, sortedIdxs, 'a')
+        key, sortedIdxs, result = memo.lookup(np.array([1, 2, 3]))
+        self.assertEqual(result, 'a')
+        key, sortedIdxs, result = memo.lookup([1, 2])
+        self.assertIsNone(result)
+        self.assertEqual(memo.stats(), {'hits': 1, 'misses': 2, 'collisions': 0})
+
+    def testEviction(self):
+        """Test that the least recently used slices are evicted, by entries or bytes."""
+        memo = SliceMemo(maxEntries=2)
+        for idxs in ([1], [2]):
+            key, sortedIdxs, result = memo.lookup(idxs)
+            memo.store(key, sortedIdxs, idxs[0])
+        # Use [1], so that [2] is the least recently used.
+        self.assertEqual(memo.lookup([1])[2], 1)
+        key, sortedIdxs, result = memo.lookup([3])
+        memo.store(key, sortedIdxs, 3)
+        self.assertEqual(len(memo), 2)
+        self.assertIsNone(memo.lookup([2])[2])
+        self.assertEqual(memo.lookup([1])[2], 1)
+        idxs = np.arange(10)
+        memo = SliceMemo(maxBytes=2 * idxs.nbytes)
+        for i in range(5):
+            key, sortedIdxs, result = memo.lookup(idxs + i)
+            memo.store(key, sortedIdxs, i)
+        self.assertEqual(len(memo), 2)
+        self.assertLessEqual(memo.nbytes, 2 * idxs.nbytes)
+
+    def testCollision(self):
+        """Test that a hash collision is detected and treated as a miss."""
+        memo = SliceMemo(maxEntries=10)
+        key, sortedIdxs, result = memo.lookup([7, 8])
+        # Store a different slice under the same key, to mimic a hash collision.
+        memo.store(key, np.array([1, 2]), 'wrong')
+        key, sortedIdxs, result = memo.lookup([7, 8])
+        self.assertIsNone(result)
+        self.assertEqual(memo.stats()['collisions'], 1)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+import sqlite3
+import numpy as np
+import lsst.sims.maf.db as db
+import lsst.utils.tests
+
+
+class TestSqlConstraint(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        n = 1000
+        filters = np.array(['u', 'g', 'r', 'i', 'z', 'y'])
+        self.data = np.zeros(n, dtype=[('obsId', int), ('night', int), ('filter', (np.str_, 1)),
+                                       ('proposalId', int), ('altitude', float)])
+        self.data['obsId'] = np.arange(n)
+        self.data['night'] = np.arange(n) // 10
+        self.data['filter'] = filters[rng.randint(0, 6, n)]
+        self.data['proposalId'] = rng.randint(1, 5, n)
+        self.data['altitude'] = rng.uniform(-10, 90, n)
+        # Use sqlite to find the expected results.
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute('create table obs '
+                          '(obsId int, night int, filter text, proposalId int, altitude real)')
+        self.conn.executemany('insert into obs values (?, ?, ?, ?, ?)',
+                              [(int(d['obsId']), int(d['night']), str(d['filter']), int(d['proposalId']),
+                                float(d['altitude'])) for d in self.data])
+
+    def tearDown(self):
+        self.conn.close()
+
+    def _sqlResult(self, constraint):
+        query = 'select obsId from obs where %s' % (constraint)
+        return np.array([x[0] for x in self.conn.execute(query).fetchall()], int)
+
+    def testConstraintMask(self):
+        """Test constraints evaluated with numpy match sqlite."""
+        constraints = ['filter = "r"', "filter='r' or filter='g'",
+                       'night < 10 and (proposalId = 2 or proposalId=3)',
+                       'not filter = "u"', 'proposalId in (1, 3)', 'proposalId not in (1, 3)',
+                       'night between 3 and 7', 'night not between 3 and 7',
+                       'altitude > 30.5 and filter in ("r", "i")',
+                       'night % 2 = 0', 'night / 3 = 2', 'night * 2 - 1 >= 13', '-altitude < -20',
+                       'filter != "y" AND NOT (night > 20 OR proposalId = 4)', 'filter <> "z" and night >= 5',
+                       'altitude / 2 > 10', "filter >= 'i'", 'Night <= 50']
+        for constraint in constraints:
+            mask = db.constraintMask(self.data, constraint)
+            self.assertIsNotNone(mask, constraint)
+            np.testing.assert_array_equal(self.data['obsId'][mask], self._sqlResult(constraint), constraint)
+        # A dictionary of columns can also be used.
+        columns = {'night': self.data['night'], 'filter': self.data['filter']}
+        constraint = 'filter = "r" and night > 10'
+        mask = db.constraintMask(columns, constraint)
+        np.testing.assert_array_equal(self.data['obsId'][mask], self._sqlResult(constraint))
+        # No constraint selects everything.
+        self.assertTrue(db.constraintMask(self.data, None).all())
+        self.assertTrue(db.constraintMask(self.data, '').all())
+
+    def testUnsupported(self):
+        """Test constraints which cannot be evaluated with numpy return None."""
+        for constraint in ['filter like "r%"', 'night is null', 'filter = 1', 'abs(altitude) > 3',
+                           'notAColumn = 2', 'night = ', 'night / 0 = 1']:
+            self.assertIsNone(db.constraintMask(self.data, constraint), constraint)
+        self.assertRaises(ValueError, db.compileConstraint, 'filter like "r%"')
+
+    def testFloatModulo(self):
+        """Test modulo with a float operand (which sqlite evaluates with integers) is left to sqlite."""
+        # sqlite truncates altitude before the modulo, so every row matches (numpy's fmod would give ~half).
+        self.assertEqual(len(self._sqlResult('altitude % 1 < 0.5')), len(self.data))
+        # x % 0.5 is x % 0 in sqlite, which is NULL.
+        self.assertEqual(len(self._sqlResult('night % 0.5 = 0')), 0)
+        for constraint in ['altitude % 1 < 0.5', 'altitude % 2 = 1', 'night % 0.5 = 0', 'night % 2.5 = 1']:
+            self.assertIsNone(db.constraintMask(self.data, constraint), constraint)
+        # Integer modulo still matches sqlite.
+        for constraint in ['night % 3 = 1', '-night % 4 = -1']:
+            mask = db.constraintMask(self.data, constraint)
+            np.testing.assert_array_equal(self.data['obsId'][mask], self._sqlResult(constraint), constraint)
+
+    def testConstraintColumns(self):
+        """Test finding the columns used in a constraint."""
+        self.assertEqual(db.constraintColumns('filter = "r"'), ['filter', 'r'])
+        self.assertEqual(db.constraintColumns('night < 10 and (proposalId in (1, 2) or night > 20)'),
+                         ['night', 'proposalId'])
+        self.assertEqual(db.constraintColumns("altitude between -night and 2*night"), ['altitude', 'night'])
+        self.assertEqual(db.constraintColumns('filter like "r%"'), [])
+        self.assertEqual(db.constraintColumns(''), [])
+        # The data fetched for these columns is enough to evaluate the constraint.
+        constraint = '(filter = "i" or filter = "z") and proposalId = 1'
+        cols = [c for c in db.constraintColumns(constraint) if c in self.data.dtype.names]
+        np.testing.assert_array_equal(db.constraintMask(self.data[cols], constraint),
+                                      db.constraintMask(self.data, constraint))
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -6,6 +6,8 @@ import matplotlib
 import warnings
 import unittest
 import lsst.utils.tests
+import ephem
+import palpy
 import lsst.sims.maf.stackers as stackers
 from lsst.sims.utils import _galacticFromEquatorial, calcLmstLast, Site, _altAzPaFromRaDec, \
     ObservationMetaData
@@ -56,6 +58,40 @@ class TestStackerClasses(unittest.TestCase):
         s2 = stackers.RandomDitherFieldPerVisitStacker(decCol='blah')
         assert(s1 != s2)
 
+    def testStackerScheduler(self):
+        """Test that the stacker scheduler orders stackers by dependency and skips repeated stackers.
+        """
+        rng = np.random.RandomState(42)
+        data = np.zeros(100, dtype=list(zip(['fieldRA', 'fieldDec', 'alt'], [float] * 3)))
+        data['fieldRA'] = rng.rand(100) * 360.
+        data['fieldDec'] = rng.rand(100) * 90. - 90.
+        data['alt'] = rng.rand(100) * 90.
+        galStacker = stackers.GalacticStacker(raCol='randomDitherFieldPerVisitRa',
+                                              decCol='randomDitherFieldPerVisitDec')
+        ditherStacker = stackers.RandomDitherFieldPerVisitStacker(randomSeed=42)
+        zStacker = stackers.ZenithDistStacker(altCol='alt', degrees=True)
+        # The galactic stacker requires the dithered columns, so must run after the dither stacker.
+        scheduler = stackers.StackerScheduler()
+        self.assertEqual(scheduler.order([galStacker, ditherStacker, zStacker]),
+                         [ditherStacker, galStacker, zStacker])
+        newData = scheduler.run(data, [galStacker, ditherStacker, zStacker])
+        expected = data
+        for s in [stackers.RandomDitherFieldPerVisitStacker(randomSeed=42),
+                  stackers.GalacticStacker(raCol='randomDitherFieldPerVisitRa',
+                                           decCol='randomDitherFieldPerVisitDec'),
+                  stackers.ZenithDistStacker(altCol='alt', degrees=True)]:
+            expected = s.run(expected)
+        self.assertEqual(set(newData.dtype.names), set(expected.dtype.names))
+        for col in expected.dtype.names:
+            np.testing.assert_array_equal(newData[col], expected[col])
+        # Equivalent stackers do not run again.
+        sameData = scheduler.run(newData, [stackers.RandomDitherFieldPerVisitStacker(randomSeed=42)])
+        self.assertTrue(sameData is newData)
+        # But a stacker with a different configuration recalculates the columns.
+        otherData = scheduler.run(newData, [stackers.RandomDitherFieldPerVisitStacker(randomSeed=43)])
+        self.assertFalse(np.all(otherData['randomDitherFieldPerVisitRa'] ==
+                                expected['randomDitherFieldPerVisitRa']))
+
     def testNormAirmass(self):
         """
         Test the normalized airmass stacker.
@@ -90,6 +126,39 @@ class TestStackerClasses(unittest.TestCase):
         self.assertGreater(min(np.abs(data['ra_pi_amp'])), 0.)
         self.assertGreater(min(np.abs(data['dec_pi_amp'])), 0.)
 
+    def testParallaxFactorPalpy(self):
+        """
+        Test the parallax factors against calculating palpy.mappa and palpy.mapqk for each pointing.
+        """
+        np.random.seed(42)
+        data = np.zeros(2000, dtype=list(zip(['fieldRA', 'fieldDec', 'observationStartMJD'],
+                                             [float, float, float])))
+        data['fieldRA'] = np.random.rand(data.size) * 360.
+        data['fieldDec'] = np.degrees(np.arcsin(np.random.rand(data.size) * 1.8 - 0.9))
+        data['observationStartMJD'] = np.random.rand(data.size) * 365. + 59580.
+        stacker = stackers.ParallaxFactorStacker(degrees=True)
+        ra = np.radians(data['fieldRA'])
+        dec = np.radians(data['fieldDec'])
+        expectedRa = np.zeros(data.size, float)
+        expectedDec = np.zeros(data.size, float)
+        for i in np.arange(data.size):
+            mtoa_params = palpy.mappa(2000., data['observationStartMJD'][i])
+            ra_geo1, dec_geo1 = palpy.mapqk(ra[i], dec[i], 0., 0., 1., 0., mtoa_params)
+            ra_geo, dec_geo = palpy.mapqk(ra[i], dec[i], 0., 0., 0., 0., mtoa_params)
+            x_geo1, y_geo1 = stacker._gnomonic_project_toxy(ra_geo1, dec_geo1, ra[i], dec[i])
+            x_geo, y_geo = stacker._gnomonic_project_toxy(ra_geo, dec_geo, ra[i], dec[i])
+            expectedRa[i] = np.degrees(x_geo1 - x_geo) * 3600.
+            expectedDec[i] = np.degrees(y_geo1 - y_geo) * 3600.
+        # With more pointings than table entries, the palpy.mappa parameters are interpolated.
+        newData = stacker.run(data.copy())
+        np.testing.assert_allclose(newData['ra_pi_amp'], expectedRa, rtol=0, atol=1e-5)
+        np.testing.assert_allclose(newData['dec_pi_amp'], expectedDec, rtol=0, atol=1e-5)
+        # Otherwise, they are calculated for each date.
+        stacker = stackers.ParallaxFactorStacker(degrees=True, tableStep=0.01)
+        newData = stacker.run(data.copy())
+        np.testing.assert_allclose(newData['ra_pi_amp'], expectedRa, rtol=0, atol=1e-8)
+        np.testing.assert_allclose(newData['dec_pi_amp'], expectedDec, rtol=0, atol=1e-8)
+
     def _tDitherRange(self, diffsra, diffsdec, ra, dec, maxDither):
         self.assertTrue(np.all(np.abs(diffsra) <= maxDither))
         self.assertTrue(np.all(np.abs(diffsdec) <= maxDither))
@@ -219,6 +288,29 @@ class TestStackerClasses(unittest.TestCase):
         self._tDitherPerNight(diffsra, diffsdec, data['fieldRA'],
                               data['fieldDec'], data['night'])
 
+    def testHexDitherFieldSequence(self):
+        """
+        Test that the per-field hex dithers step through the vertices field by field.
+        """
+        ndata = 1000
+        # Set seed so the test is stable
+        np.random.seed(42)
+        data = np.zeros(ndata, dtype=list(zip(
+            ['fieldRA', 'fieldDec', 'fieldId', 'night'], [float, float, int, int])))
+        data['fieldRA'] = 90.
+        data['fieldId'] = np.floor(np.random.rand(ndata) * 10)
+        data['night'] = np.sort(np.floor(np.random.rand(ndata) * 400)).astype('int')
+        perVisit = stackers.HexDitherFieldPerVisitStacker(degrees=False)
+        perNight = stackers.HexDitherFieldPerNightStacker(degrees=False)
+        data = perNight.run(perVisit.run(data))
+        for fieldId in np.unique(data['fieldId']):
+            match = np.where(data['fieldId'] == fieldId)[0]
+            visitIdxs = np.arange(len(match)) % perVisit.numPoints
+            np.testing.assert_allclose(data['hexDitherFieldPerVisitDec'][match], perVisit.yOff[visitIdxs])
+            nights = data['night'][match]
+            nightIdxs = np.searchsorted(np.unique(nights), nights) % perNight.numPoints
+            np.testing.assert_allclose(data['hexDitherFieldPerNightDec'][match], perNight.yOff[nightIdxs])
+
     def testRandomRotDitherPerFilterChangeStacker(self):
         """
         Test the rotational dither stacker.
@@ -345,6 +437,123 @@ class TestStackerClasses(unittest.TestCase):
         assert(q3.size > 0)
         assert(q4.size > 0)
 
+    def testEclipticStacker(self):
+        """
+        Test the ecliptic coordinate stacker against ephem.
+        """
+        np.random.seed(42)
+        data = np.zeros(500, dtype=list(zip(['ra', 'dec', 'mjd'], [float] * 3)))
+        data['ra'] = np.random.rand(data.size) * 360.
+        data['dec'] = np.degrees(np.arcsin(np.random.rand(data.size) * 2. - 1.))
+        data['mjd'] = np.random.rand(data.size) * 3650. + 59580.
+        expectedLon = np.zeros(data.size, float)
+        expectedLat = np.zeros(data.size, float)
+        sunLon = np.zeros(data.size, float)
+        for i in np.arange(data.size):
+            ecl = ephem.Ecliptic(ephem.Equatorial(np.radians(data['ra'][i]), np.radians(data['dec'][i]),
+                                                  epoch=ephem.J2000))
+            expectedLon[i] = ecl.lon
+            expectedLat[i] = ecl.lat
+            sunLon[i] = ephem.Ecliptic(ephem.Sun(stackers.mjd2djd(data['mjd'][i]))).lon
+        s = stackers.EclipticStacker(mjdCol='mjd', raCol='ra', decCol='dec', degrees=True)
+        newData = s.run(data.copy())
+        radData = data.copy()
+        radData['ra'] = np.radians(radData['ra'])
+        radData['dec'] = np.radians(radData['dec'])
+        s = stackers.EclipticStacker(mjdCol='mjd', raCol='ra', decCol='dec', degrees=False)
+        radData = s.run(radData)
+        np.testing.assert_allclose(np.radians(newData['eclipLon']), radData['eclipLon'])
+        np.testing.assert_allclose(np.radians(newData['eclipLat']), radData['eclipLat'])
+        dLon = (np.radians(newData['eclipLon']) - expectedLon + np.pi) % (2. * np.pi) - np.pi
+        self.assertLess(np.abs(dLon).max(), 1e-6)
+        np.testing.assert_allclose(np.radians(newData['eclipLat']), expectedLat, rtol=0, atol=1e-6)
+        # The sun's longitude is calculated with a low precision series (good to about 0.01 degrees).
+        s = stackers.EclipticStacker(mjdCol='mjd', raCol='ra', decCol='dec', degrees=True,
+                                     subtractSunLon=True)
+        newData = s.run(data.copy())
+        dLon = (np.radians(newData['eclipLon']) - (expectedLon - sunLon) + np.pi) % (2. * np.pi) - np.pi
+        self.assertLess(np.abs(dLon).max(), np.radians(0.01))
+        self.assertTrue(np.all((newData['eclipLon'] >= 0) & (newData['eclipLon'] < 360.)))
+
+    def testNFollowStacker(self):
+        """
+        Test the number of follow up telescopes against the alt/az of each telescope at each time step.
+        """
+        np.random.seed(42)
+        data = np.zeros(500, dtype=list(zip(['observationStartMJD', 'fieldRA', 'fieldDec'], [float] * 3)))
+        data['observationStartMJD'] = np.random.rand(data.size) * 3650. + 59580.
+        data['fieldRA'] = np.random.rand(data.size) * 360.
+        data['fieldDec'] = np.degrees(np.arcsin(np.random.rand(data.size) * 1.6 - 1.))
+        s = stackers.NFollowStacker(airmassLimit=2.0, timeSteps=[0., 4.])
+        s._blockSize = 77
+        newData = s.run(data.copy())
+        expected = np.zeros(data.size, int)
+        for scope in s.telescopes:
+            gotIt = np.zeros(data.size, bool)
+            for step in s.timeSteps:
+                alt, az = stackers.raDec2AltAz(np.radians(data['fieldRA']), np.radians(data['fieldDec']),
+                                               np.radians(scope['lat']), np.radians(scope['lon']),
+                                               data['observationStartMJD'] + step / 24., altonly=True)
+                gotIt |= (1. / np.sin(alt) <= 2.0) & (alt > 0)
+            expected += gotIt
+        np.testing.assert_array_equal(newData['nObservatories'], expected)
+        self.assertGreater(expected.max(), 0)
+        self.assertLess(expected.min(), len(s.telescopes))
+
+    def testNEODistStacker(self):
+        """
+        Test the NEO distance stacker lookup table against solving for each visit.
+        """
+        np.random.seed(42)
+        data = np.zeros(2000, dtype=list(zip(['solarElong', 'filter', 'sunAz', 'azimuth', 'fiveSigmaDepth'],
+                                             [float, (np.str_, 1), float, float, float])))
+        data['solarElong'] = np.random.rand(data.size) * 180.
+        data['filter'] = np.random.choice(['u', 'g', 'r', 'i', 'z', 'y'], data.size)
+        data['sunAz'] = np.random.rand(data.size) * 360.
+        data['azimuth'] = np.random.rand(data.size) * 360.
+        data['fiveSigmaDepth'] = np.random.rand(data.size) * 6. + 19.
+        s = stackers.NEODistStacker(tableStep=None)
+        exact = s.run(data.copy())
+        self.assertTrue(np.all(exact['MaxGeoDist'] >= 0.3))
+        for i in np.arange(0, data.size, 100):
+            appmag = s._appMag(np.radians(data['solarElong'][i:i + 1]))[0]
+            v5 = data['fiveSigmaDepth'][i] + s.limitingAdjust[data['filter'][i]]
+            self.assertEqual(exact['MaxGeoDist'][i], s.deltas[np.where(appmag > v5)[0].min()])
+        # With more unique elongations than rows in the table, the distances are interpolated.
+        s = stackers.NEODistStacker(tableStep=0.25)
+        newData = s.run(data.copy())
+        np.testing.assert_allclose(newData['MaxGeoDist'], exact['MaxGeoDist'], rtol=0,
+                                   atol=s.deltas[1] - s.deltas[0])
+
+    def testColInfoRegistry(self):
+        """
+        Test ColInfo finds the columns of stacker classes registered after it was built.
+        """
+        colInfo = stackers.ColInfo()
+        self.assertEqual(colInfo.getDataSource('galb'), stackers.GalacticStacker)
+        self.assertEqual(colInfo.getDataSource('testRegistryCol'), colInfo.defaultDataSource)
+        nInstances = []
+
+        class TestRegistryStacker(stackers.BaseStacker):
+            def __init__(self):
+                nInstances.append(1)
+                self.colsReq = ['fieldRA']
+                self.colsAdded = ['testRegistryCol']
+                self.units = ['furlongs']
+
+        try:
+            self.assertEqual(colInfo.getDataSource('testRegistryCol'), TestRegistryStacker)
+            self.assertEqual(colInfo.getUnits('testRegistryCol'), 'furlongs')
+            # The columns of each stacker class are shared by all ColInfo objects.
+            self.assertEqual(stackers.ColInfo().getUnits('testRegistryCol'), 'furlongs')
+            self.assertEqual(len(nInstances), 1)
+        finally:
+            for name, stackerClass in list(stackers.BaseStacker.registry.items()):
+                if stackerClass is TestRegistryStacker:
+                    del stackers.BaseStacker.registry[name]
+        # And the stacker class is forgotten once it is no longer registered.
+        self.assertEqual(colInfo.getDataSource('testRegistryCol'), colInfo.defaultDataSource)
+
 
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass